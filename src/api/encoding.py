@@ -0,0 +1,140 @@
+import orjson
+from fastapi.responses import Response
+from src.utils.utils import CompactResult
+
+try:
+    import msgpack
+except ImportError:
+    # MessagePack responses are only available if the msgpack package is installed
+    msgpack = None
+
+class UnsupportedOutputError(ValueError):
+    """
+    Raised when the requested output mode or format is not supported.
+    """
+
+class ResultEncoder:
+    """
+    ResultEncoder is a class designed to encode the results of the extractions in the requested output mode and format.
+    The `full` mode returns the merged attributes and selectors as they are, the `compact` mode drops the placeholders
+    of the selectors that were not found and flattens the selectors of each attribute. The results are encoded as JSON
+    with orjson, or as MessagePack. Streamed results are written as NDJSON lines or as a sequence
+    of MessagePack objects.
+    """
+
+    output_modes = ("full", "compact")
+    media_types = {
+        "json": "application/json",
+        "ndjson": "application/x-ndjson",
+        "msgpack": "application/msgpack",
+    }
+    # Media types of the Accept header mapped to their format, as clients use several names for MessagePack
+    accepted_media_types = {
+        "application/json": "json",
+        "application/x-ndjson": "ndjson",
+        "application/jsonl": "ndjson",
+        "application/msgpack": "msgpack",
+        "application/x-msgpack": "msgpack",
+        "application/vnd.msgpack": "msgpack",
+    }
+
+    def __init__(self, output="full", output_format="json"):
+        """
+        Initializes the ResultEncoder class.
+
+        Args:
+            output (str): The output mode of the results, `full` or `compact`.
+            output_format (str): The format of the results, `json`, `ndjson` or `msgpack`.
+
+        Raises:
+            UnsupportedOutputError: If the output mode or the format is not supported, or if MessagePack is requested
+                and the msgpack package is not installed.
+        """
+        if output not in self.output_modes:
+            raise UnsupportedOutputError(f"Unknown output mode: {output}. The output modes are {', '.join(self.output_modes)}")
+        if output_format not in self.media_types:
+            raise UnsupportedOutputError(f"Unknown output format: {output_format}. The formats are {', '.join(self.media_types)}")
+        if output_format == "msgpack" and msgpack is None:
+            raise UnsupportedOutputError("MessagePack output requires the msgpack package")
+        self.output = output
+        self.format = output_format
+        self.media_type = self.media_types[output_format]
+
+    @classmethod
+    def from_request(cls, request, output=None, output_format=None, formats=("json", "msgpack")):
+        """
+        Creates the encoder of a request from its query parameters, or from its Accept header if no format is given.
+
+        Args:
+            request (Request): The incoming HTTP request.
+            output (str, optional): The output mode of the results. Defaults to `full`.
+            output_format (str, optional): The format of the results. Defaults to the first format of the Accept
+                header that the endpoint supports, or to the first format of the endpoint.
+            formats (tuple): The formats supported by the endpoint.
+
+        Returns:
+            ResultEncoder: The encoder of the results of the request.
+
+        Raises:
+            UnsupportedOutputError: If the output mode or the format is not supported.
+        """
+        if output_format is None:
+            accepted = [item.split(";")[0].strip().lower() for item in request.headers.get("accept", "").split(",")]
+            output_format = next(
+                (cls.accepted_media_types[item] for item in accepted if cls.accepted_media_types.get(item) in formats), formats[0]
+            )
+        elif output_format not in formats:
+            raise UnsupportedOutputError(f"Unsupported output format: {output_format}. The formats of this endpoint are {', '.join(formats)}")
+        return cls(output or "full", output_format)
+
+    def convert(self, result):
+        """
+        Converts the result of an extraction to the output mode.
+
+        Args:
+            result (dict): The merged attributes and selectors, or the values of the attributes.
+
+        Returns:
+            dict: The result in the output mode.
+        """
+        return CompactResult(result).to_dict() if self.output == "compact" else result
+
+    def dumps(self, content):
+        """
+        Encodes a JSON compatible object in the format.
+
+        Args:
+            content (object): The object to encode.
+
+        Returns:
+            bytes: The encoded object, without a trailing newline.
+        """
+        if self.format == "msgpack":
+            return msgpack.packb(content, use_bin_type=True)
+        return orjson.dumps(content)
+
+    def line(self, content):
+        """
+        Encodes an object as an item of a stream: an NDJSON line, or a MessagePack object that can be read one by one.
+
+        Args:
+            content (object): The object to encode.
+
+        Returns:
+            bytes: The encoded item.
+        """
+        return self.dumps(content) if self.format == "msgpack" else self.dumps(content) + b"\n"
+
+    def response(self, content, status_code=200, headers=None):
+        """
+        Creates the response of an object encoded in the format.
+
+        Args:
+            content (object): The object to encode.
+            status_code (int): The status code of the response.
+            headers (dict, optional): The headers of the response.
+
+        Returns:
+            Response: The response.
+        """
+        return Response(self.dumps(content), status_code=status_code, headers=headers, media_type=self.media_type)
@@ -0,0 +1,292 @@
+import codecs
+import re
+import zlib
+
+from src.extractors.pipeline import NotHTMLContentError
+from src.utils.utils import CheckHTMLContent, StreamingHTMLParser
+
+try:
+    import brotli
+except ImportError:
+    # Brotli request bodies are only accepted if the brotli package is installed
+    brotli = None
+
+if brotli is not None and not hasattr(brotli.Decompressor, "can_accept_more_data"):
+    # Versions of the brotli package before 1.1 cannot bound the output of a decompression step
+    brotli = None
+
+DECOMPRESSION_ERRORS = (zlib.error,) if brotli is None else (zlib.error, brotli.error)
+
+class PayloadTooLargeError(ValueError):
+    """
+    Raised when the request body or the HTML content exceeds the configured size limit.
+    """
+
+class UnsupportedContentEncodingError(ValueError):
+    """
+    Raised when the request body is compressed with an unsupported content encoding.
+    """
+
+class InvalidBodyError(ValueError):
+    """
+    Raised when the request body cannot be decompressed.
+    """
+
+class BodyDecoder:
+    """
+    BodyDecoder is a class designed to decompress a request body chunk by chunk according to its `Content-Encoding`.
+    The decompressed size is checked after every step so a small compressed body cannot expand past the limit.
+    """
+
+    # Maximum number of bytes decompressed at once before the limit is checked
+    step_bytes = 1 << 20
+
+    def __init__(self, content_encoding=None, max_bytes=None):
+        """
+        Initializes the BodyDecoder class.
+
+        Args:
+            content_encoding (str, optional): The value of the `Content-Encoding` header.
+            max_bytes (int, optional): The maximum number of decompressed bytes.
+
+        Raises:
+            UnsupportedContentEncodingError: If the content encoding is not supported.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.decompressors = []
+        # Encodings are listed in the order they were applied, so they are undone in reverse
+        for encoding in reversed([item.strip().lower() for item in (content_encoding or "").split(",") if item.strip()]):
+            if encoding in ("gzip", "x-gzip", "deflate"):
+                # Detects the gzip and zlib headers
+                self.decompressors.append(zlib.decompressobj(zlib.MAX_WBITS | 32))
+            elif encoding == "br" and brotli is not None:
+                self.decompressors.append(brotli.Decompressor())
+            elif encoding != "identity":
+                raise UnsupportedContentEncodingError(f"Unsupported content encoding: {encoding}")
+
+    def check_size(self, size):
+        """
+        Checks a number of decompressed bytes against the limit.
+
+        Args:
+            size (int): The number of decompressed bytes.
+
+        Raises:
+            PayloadTooLargeError: If the size exceeds the limit.
+        """
+        if self.max_bytes is not None and size > self.max_bytes:
+            raise PayloadTooLargeError(f"The HTML content exceeds the limit of {self.max_bytes} bytes")
+
+    def decompress(self, decompressor, data):
+        """
+        Decompresses data with one decompressor, checking the limit after every step.
+
+        Args:
+            decompressor (zlib.Decompress | brotli.Decompressor): The decompressor.
+            data (bytes): The compressed data.
+
+        Returns:
+            bytes: The decompressed data.
+
+        Raises:
+            PayloadTooLargeError: If the decompressed size exceeds the limit.
+        """
+        if not hasattr(decompressor, "unconsumed_tail"):
+            # The brotli decompressor keeps the input it did not decompress, and only accepts more once it is drained
+            parts = [decompressor.process(data, output_buffer_limit=self.step_bytes)]
+            produced = len(parts[0])
+            while not decompressor.can_accept_more_data():
+                self.check_size(self.size + produced)
+                parts.append(decompressor.process(b"", output_buffer_limit=self.step_bytes))
+                produced += len(parts[-1])
+            return b"".join(parts)
+        parts = [decompressor.decompress(data, self.step_bytes)]
+        produced = len(parts[0])
+        while decompressor.unconsumed_tail:
+            self.check_size(self.size + produced)
+            parts.append(decompressor.decompress(decompressor.unconsumed_tail, self.step_bytes))
+            produced += len(parts[-1])
+        return b"".join(parts)
+
+    def decode(self, chunk):
+        """
+        Decompresses a chunk of the request body.
+
+        Args:
+            chunk (bytes): The chunk as received.
+
+        Returns:
+            bytes: The decompressed chunk.
+
+        Raises:
+            PayloadTooLargeError: If the decompressed size exceeds the limit.
+            InvalidBodyError: If the body is not valid compressed data.
+        """
+        try:
+            for decompressor in self.decompressors:
+                chunk = self.decompress(decompressor, chunk)
+        except DECOMPRESSION_ERRORS as e:
+            raise InvalidBodyError(f"The request body cannot be decompressed: {e}")
+        self.size += len(chunk)
+        self.check_size(self.size)
+        return chunk
+
+    def flush(self):
+        """
+        Returns the data left in the decompressors at the end of the body.
+
+        Returns:
+            bytes: The remaining decompressed data.
+
+        Raises:
+            PayloadTooLargeError: If the decompressed size exceeds the limit.
+        """
+        chunk = b""
+        for decompressor in self.decompressors:
+            if chunk:
+                chunk = self.decompress(decompressor, chunk)
+            if hasattr(decompressor, "flush"):
+                chunk += decompressor.flush()
+        self.size += len(chunk)
+        self.check_size(self.size)
+        return chunk
+
+class HTMLIngest:
+    """
+    HTMLIngest is a class designed to read HTML content from a request body as it arrives. The body is decompressed,
+    its charset is detected from its first bytes, and it is decoded and parsed incrementally, so neither the raw body
+    nor the decoded text is ever held in memory in full. The start of the content is validated as soon as it is
+    received, so content that is not HTML is rejected without reading the rest of the body.
+    """
+
+    # Number of bytes read before the charset is detected, as in the prescan of the HTML standard
+    sniff_bytes = 1024
+    # Number of characters after which content whose first tag is still not complete is rejected
+    max_prefix_chars = 65536
+    boms = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+    header_charset_pattern = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+    meta_charset_pattern = re.compile(rb"<meta[^>]+charset\s*=\s*[\"']?\s*([\w.:-]+)", re.IGNORECASE)
+
+    def __init__(self, content_type=None, content_encoding=None, max_bytes=None):
+        """
+        Initializes the HTMLIngest class.
+
+        Args:
+            content_type (str, optional): The value of the `Content-Type` header, which may declare the charset.
+            content_encoding (str, optional): The value of the `Content-Encoding` header.
+            max_bytes (int, optional): The maximum number of bytes of the decompressed HTML content.
+
+        Raises:
+            UnsupportedContentEncodingError: If the content encoding is not supported.
+        """
+        self.content_type = content_type or ""
+        self.body_decoder = BodyDecoder(content_encoding, max_bytes)
+        self.parser = StreamingHTMLParser()
+        self.text_decoder = None
+        self.pending = []
+        self.prefix = ""
+        self.validated = False
+
+    @property
+    def size(self):
+        """
+        Returns the number of bytes of decompressed HTML content read so far.
+
+        Returns:
+            int: The number of bytes.
+        """
+        return self.body_decoder.size
+
+    def detect_charset(self, data):
+        """
+        Detects the charset of the HTML content from its byte order mark, the `Content-Type` header or a meta tag
+        in its first bytes, in that order. Defaults to UTF-8.
+
+        Args:
+            data (bytes): The first bytes of the HTML content.
+
+        Returns:
+            str: The name of the charset.
+        """
+        for bom, charset in self.boms:
+            if data.startswith(bom):
+                return charset
+        header = self.header_charset_pattern.search(self.content_type)
+        meta = self.meta_charset_pattern.search(data[:self.sniff_bytes])
+        for candidate in (header.group(1) if header else None, meta.group(1).decode("ascii", "ignore") if meta else None):
+            if candidate:
+                try:
+                    return codecs.lookup(candidate).name
+                except LookupError:
+                    continue
+        return "utf-8"
+
+    def feed_text(self, text):
+        """
+        Validates the start of the HTML content once it is received, then parses the text.
+
+        Args:
+            text (str): The decoded text.
+
+        Raises:
+            NotHTMLContentError: If the content is not HTML.
+        """
+        if not self.validated:
+            self.prefix += text
+            if CheckHTMLContent(self.prefix).is_html:
+                self.validated = True
+                text, self.prefix = self.prefix, ""
+            elif len(self.prefix) >= self.max_prefix_chars or self.prefix[:1] not in ("", "<"):
+                raise NotHTMLContentError("The provided content is not HTML")
+            else:
+                return
+        if text:
+            self.parser.feed(text)
+
+    def feed(self, chunk, final=False):
+        """
+        Reads a chunk of the request body.
+
+        Args:
+            chunk (bytes): The chunk as received.
+            final (bool): Whether it is the last chunk of the body.
+
+        Raises:
+            PayloadTooLargeError: If the HTML content exceeds the size limit.
+            NotHTMLContentError: If the content is not HTML.
+        """
+        data = self.body_decoder.decode(chunk)
+        if final:
+            data += self.body_decoder.flush()
+        if self.text_decoder is None:
+            self.pending.append(data)
+            buffered = b"".join(self.pending)
+            if len(buffered) < self.sniff_bytes and not final:
+                return
+            self.pending = []
+            self.text_decoder = codecs.getincrementaldecoder(self.detect_charset(buffered))(errors="replace")
+            data = buffered
+        self.feed_text(self.text_decoder.decode(data, final=final))
+
+    def close(self, chunk=b""):
+        """
+        Finishes reading the HTML content.
+
+        Args:
+            chunk (bytes): The last chunk of the request body, if it was not fed yet.
+
+        Returns:
+            ParsedHTML: The parsed HTML content.
+
+        Raises:
+            PayloadTooLargeError: If the HTML content exceeds the size limit.
+            NotHTMLContentError: If the content is not HTML.
+        """
+        self.feed(chunk, final=True)
+        if not self.validated:
+            raise NotHTMLContentError("The provided content is not HTML")
+        document = self.parser.close()
+        if document is None:
+            raise NotHTMLContentError("The provided content is not HTML")
+        return document
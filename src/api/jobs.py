@@ -0,0 +1,525 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from urllib.parse import urlparse
+
+# Statuses of a job, the last two are final
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+logger = logging.getLogger(__name__)
+
+class InvalidCallbackError(ValueError):
+    """
+    Raised when the callback URL of a job is not allowed.
+    """
+
+def check_callback_url(url, allowed_hosts):
+    """
+    Checks that a callback URL is an HTTP URL on one of the allowed hosts, so jobs cannot be used to send requests
+    to arbitrary hosts.
+
+    Args:
+        url (str): The callback URL.
+        allowed_hosts (list): The host names callbacks may be sent to.
+
+    Raises:
+        InvalidCallbackError: If the URL is not allowed.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or parsed.hostname not in allowed_hosts:
+        raise InvalidCallbackError(f"Callbacks can only be sent to {', '.join(allowed_hosts) or 'no host'} over HTTP")
+
+class JobStore:
+    """
+    JobStore is a class designed to persist the extraction jobs in SQLite, which is both the queue of the documents
+    to process and the store of their results. The work is deduplicated by content hash: the jobs of identical
+    documents with the same extraction options share one document row, which is processed once, and documents already processed are answered from
+    their stored result until it expires. Documents claimed by a worker that died are claimed again once their
+    lease expires, so no job is lost when the API restarts.
+    """
+
+    def __init__(self, path=None, ttl=86400, lease=600, max_attempts=5):
+        """
+        Initializes the JobStore class.
+
+        Args:
+            path (str, optional): The path of the SQLite database. If not provided, the jobs are kept in memory and
+                are only visible to this process.
+            ttl (float): The number of seconds the results are kept after the document is processed.
+            lease (float): The number of seconds after which a document still running is given to another worker.
+            max_attempts (int): The maximum number of times a document is processed while the language model is overloaded.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.connection = self.get_connection()
+
+    def get_connection(self):
+        """
+        Opens the SQLite database and creates the job tables if they do not exist.
+
+        Returns:
+            sqlite3.Connection: The connection to the SQLite database.
+        """
+        directory = os.path.dirname(self.path) if self.path else ""
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path or ":memory:", timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL lets several worker processes read while one of them writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "content_hash TEXT PRIMARY KEY, html BLOB, options TEXT, status TEXT NOT NULL, status_code INTEGER, result TEXT, detail TEXT, reason TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL, claimed_at REAL, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, expires_at REAL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, document_id TEXT, content_hash TEXT NOT NULL, callback_url TEXT, callback_status TEXT, "
+            "created_at REAL NOT NULL)"
+        )
+        # Job stores created before the extraction options and the rejection reasons were added
+        for column in ("options TEXT", "reason TEXT"):
+            try:
+                connection.execute(f"ALTER TABLE documents ADD COLUMN {column}")
+            except sqlite3.OperationalError:
+                pass
+        connection.execute("CREATE INDEX IF NOT EXISTS documents_status ON documents (status, available_at)")
+        connection.execute("CREATE INDEX IF NOT EXISTS documents_expires_at ON documents (expires_at)")
+        connection.execute("CREATE INDEX IF NOT EXISTS jobs_content_hash ON jobs (content_hash)")
+        return connection
+
+    def submit(self, documents, callback_url=None):
+        """
+        Creates one job per document and queues the documents that were not already queued or processed.
+        Documents that failed because of a server error are queued again.
+
+        Args:
+            documents (list): The ID, the HTML content and the options of the extraction of each document.
+            callback_url (str, optional): The URL the result of each job is sent to once it is finished.
+
+        Returns:
+            list: The ID, document ID and status of each job.
+        """
+        now = time.time()
+        jobs = []
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for document_id, html_content, options in documents:
+                    content = html_content.encode("utf-8")
+                    options = json.dumps(options, sort_keys=True)
+                    content_hash = hashlib.sha256(content + options.encode("utf-8")).hexdigest()
+                    row = self.connection.execute(
+                        "SELECT status, status_code, expires_at FROM documents WHERE content_hash = ?", (content_hash,)
+                    ).fetchone()
+                    if row is None or (row[2] is not None and row[2] <= now) or (row[0] == "failed" and row[1] >= 500):
+                        self.connection.execute(
+                            "INSERT OR REPLACE INTO documents (content_hash, html, options, status, attempts, available_at, created_at, updated_at) "
+                            "VALUES (?, ?, ?, 'queued', 0, ?, ?, ?)",
+                            (content_hash, zlib.compress(content, 1), options, now, now, now)
+                        )
+                        status = "queued"
+                    else:
+                        status = row[0]
+                    job_id = uuid.uuid4().hex
+                    self.connection.execute(
+                        "INSERT INTO jobs (id, document_id, content_hash, callback_url, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (job_id, None if document_id is None else str(document_id), content_hash, callback_url, now)
+                    )
+                    jobs.append({"id": job_id, "document_id": document_id, "status": status})
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return jobs
+
+    def claim(self):
+        """
+        Claims the oldest queued document, or a document whose worker lease expired.
+
+        Returns:
+            tuple: The content hash, the HTML content and the options of the extraction of the document, or None if
+                there is nothing to process.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT content_hash, html, options FROM documents WHERE (status = 'queued' AND available_at <= ?) "
+                    "OR (status = 'running' AND claimed_at <= ?) ORDER BY available_at LIMIT 1",
+                    (now, now - self.lease)
+                ).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE documents SET status = 'running', claimed_at = ?, updated_at = ?, attempts = attempts + 1 "
+                        "WHERE content_hash = ?",
+                        (now, now, row[0])
+                    )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], zlib.decompress(row[1]).decode("utf-8"), json.loads(row[2] or "{}")
+
+    def release(self, content_hash):
+        """
+        Queues a claimed document again without counting the attempt, when its worker stops before finishing it.
+
+        Args:
+            content_hash (str): The content hash of the document.
+        """
+        with self.lock:
+            self.connection.execute(
+                "UPDATE documents SET status = 'queued', attempts = attempts - 1, updated_at = ? WHERE content_hash = ? AND status = 'running'",
+                (time.time(), content_hash)
+            )
+
+    def complete(self, content_hash, result):
+        """
+        Stores the result of a document. Documents that could not be processed because the language model was
+        overloaded are queued again after the delay it asked for, until they run out of attempts.
+
+        Args:
+            content_hash (str): The content hash of the document.
+            result (dict): The result of the document, or its error and status code.
+
+        Returns:
+            bool: Whether the document is finished.
+        """
+        now = time.time()
+        with self.lock:
+            attempts = self.connection.execute("SELECT attempts FROM documents WHERE content_hash = ?", (content_hash,)).fetchone()
+            if result["status_code"] == 503 and attempts is not None and attempts[0] < self.max_attempts:
+                self.connection.execute(
+                    "UPDATE documents SET status = 'queued', available_at = ?, updated_at = ? WHERE content_hash = ?",
+                    (now + result.get("retry_after", 1), now, content_hash)
+                )
+                return False
+            # The HTML content is no longer needed once the document is finished
+            self.connection.execute(
+                "UPDATE documents SET status = ?, status_code = ?, result = ?, detail = ?, reason = ?, html = NULL, updated_at = ?, expires_at = ? "
+                "WHERE content_hash = ?",
+                (
+                    "done" if result["status_code"] == 200 else "failed", result["status_code"],
+                    json.dumps(result["result"]) if "result" in result else None, result.get("detail"),
+                    result.get("reason"), now, now + self.ttl, content_hash
+                )
+            )
+            return True
+
+    def get(self, job_id):
+        """
+        Reads a job and the state of its document.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            dict: The job, with its result once it is done or its error once it failed, or None if it does not exist.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT jobs.id, jobs.document_id, jobs.callback_url, jobs.callback_status, jobs.created_at, "
+                "documents.status, documents.status_code, documents.result, documents.detail, documents.updated_at, documents.reason "
+                "FROM jobs JOIN documents ON documents.content_hash = jobs.content_hash WHERE jobs.id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = {"id": row[0], "document_id": row[1], "status": row[5], "created_at": row[4], "updated_at": max(row[4], row[9])}
+        if row[2] is not None:
+            job["callback_status"] = row[3]
+        if row[5] in ("done", "failed"):
+            job["status_code"] = row[6]
+            if row[7] is not None:
+                job["result"] = json.loads(row[7])
+            if row[8] is not None:
+                job["detail"] = row[8]
+            if row[10] is not None:
+                job["reason"] = row[10]
+        return job
+
+    def get_callbacks(self, content_hash):
+        """
+        Reads the jobs of a finished document whose callback has not been sent yet.
+
+        Args:
+            content_hash (str): The content hash of the document.
+
+        Returns:
+            list: The ID and the callback URL of each job.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT id, callback_url FROM jobs WHERE content_hash = ? AND callback_url IS NOT NULL AND callback_status IS NULL",
+                (content_hash,)
+            ).fetchall()
+
+    def set_callback_status(self, job_id, status):
+        """
+        Records the outcome of the callback of a job.
+
+        Args:
+            job_id (str): The ID of the job.
+            status (str): The outcome of the callback.
+        """
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (status, job_id))
+
+    def purge(self):
+        """
+        Removes the expired documents and their jobs.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("DELETE FROM jobs WHERE content_hash IN (SELECT content_hash FROM documents WHERE expires_at <= ?)", (now,))
+            self.connection.execute("DELETE FROM documents WHERE expires_at <= ?", (now,))
+
+    def stats(self):
+        """
+        Returns the number of documents by status.
+
+        Returns:
+            dict: The number of documents of each status.
+        """
+        with self.lock:
+            counts = dict(self.connection.execute("SELECT status, COUNT(*) FROM documents GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+    def close(self):
+        """
+        Closes the connection to the SQLite database.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+class JobRunner:
+    """
+    JobRunner is a class designed to process the queued documents of a JobStore in background workers on the event loop,
+    send the callbacks of the finished jobs and wake up the clients waiting for them. Every API worker process runs
+    its own runner, and they share the queue through the SQLite database.
+    """
+
+    # Number of seconds between two purges of the expired jobs
+    purge_interval = 60
+    # Delays in seconds before the retries of a failed callback
+    callback_delays = (1, 5, 30)
+    # Delays in seconds before a worker tries again after an error, doubling up to the maximum
+    error_delay = 1.0
+    max_error_delay = 30.0
+
+    def __init__(self, store, process, workers=8, poll_interval=0.5):
+        """
+        Initializes the JobRunner class.
+
+        Args:
+            store (JobStore): The store of the jobs.
+            process (callable): The coroutine function extracting a document with its options, which returns its result
+                or its error and status code.
+            workers (int): The number of documents processed at the same time by this runner.
+            poll_interval (float): The number of seconds between two checks of the queue by an idle worker, to pick up
+                the documents queued by the other processes.
+        """
+        self.store = store
+        self.process = process
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.tasks = set()
+        self.queued = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.purged_at = 0.0
+
+    def start(self):
+        """
+        Starts the workers.
+        """
+        for _ in range(self.workers):
+            self.spawn(self.work())
+
+    def spawn(self, coroutine):
+        """
+        Runs a coroutine in a task that is kept until it finishes and cancelled when the runner stops.
+
+        Args:
+            coroutine (coroutine): The coroutine.
+        """
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def submit(self, documents, callback_url=None):
+        """
+        Creates the jobs of the documents and wakes up the workers. The documents that were already processed are
+        not processed again, so the callbacks of their jobs are sent right away.
+
+        Args:
+            documents (list): The ID, the HTML content and the options of the extraction of each document.
+            callback_url (str, optional): The URL the result of each job is sent to once it is finished.
+
+        Returns:
+            list: The ID, document ID and status of each job.
+        """
+        jobs = await asyncio.to_thread(self.store.submit, documents, callback_url)
+        self.notify_queued()
+        if callback_url is not None:
+            for job in jobs:
+                if job["status"] in ("done", "failed"):
+                    self.spawn(self.send_callback(job["id"], callback_url))
+        return jobs
+
+    def notify_queued(self):
+        """
+        Wakes up the idle workers after documents were queued by this process.
+        """
+        self.queued.set()
+
+    def notify_finished(self):
+        """
+        Wakes up the clients waiting for a job to finish.
+        """
+        finished, self.finished = self.finished, asyncio.Event()
+        finished.set()
+
+    async def work(self):
+        """
+        Processes the queued documents one after the other until the runner stops. An error, such as a locked database,
+        does not stop the worker: it is logged and the worker tries again after a delay that doubles with each consecutive
+        error. A document whose processing failed is given to another worker once its lease expires.
+        """
+        delay = self.error_delay
+        while True:
+            try:
+                await self.process_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker failed, retrying in %.1f seconds", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_error_delay)
+            else:
+                delay = self.error_delay
+
+    async def process_next(self):
+        """
+        Processes the next queued document, or waits for one to be queued if there is none, purging the expired jobs
+        from time to time.
+        """
+        claimed = await asyncio.to_thread(self.store.claim)
+        if claimed is None:
+            if time.monotonic() - self.purged_at >= self.purge_interval:
+                self.purged_at = time.monotonic()
+                await asyncio.to_thread(self.store.purge)
+            self.queued.clear()
+            try:
+                await asyncio.wait_for(self.queued.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            return
+        content_hash, html_content, options = claimed
+        try:
+            result = await self.process(html_content, options)
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.store.release, content_hash)
+            raise
+        if await asyncio.to_thread(self.store.complete, content_hash, result):
+            self.notify_finished()
+            for job_id, callback_url in await asyncio.to_thread(self.store.get_callbacks, content_hash):
+                self.spawn(self.send_callback(job_id, callback_url))
+
+    async def wait(self, job_id, timeout=0):
+        """
+        Reads a job, waiting until it is finished or the timeout expires.
+
+        Args:
+            job_id (str): The ID of the job.
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            dict: The job, or None if it does not exist.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            finished = self.finished
+            job = await asyncio.to_thread(self.store.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+                return job
+            # Jobs finished by other processes are only seen by polling
+            try:
+                await asyncio.wait_for(finished.wait(), min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+
+    async def send_callback(self, job_id, callback_url):
+        """
+        Sends the finished job to its callback URL, retrying after failures.
+
+        Args:
+            job_id (str): The ID of the job.
+            callback_url (str): The callback URL.
+        """
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None:
+            return
+        job.pop("callback_status", None)
+        body = json.dumps(job).encode("utf-8")
+        status = "failed"
+        for delay in (0,) + self.callback_delays:
+            await asyncio.sleep(delay)
+            try:
+                status_code = await asyncio.to_thread(post_json, callback_url, body)
+            except (urllib.error.URLError, OSError) as e:
+                logger.warning("Callback of job %s to %s failed: %s", job_id, callback_url, e)
+                continue
+            if status_code < 500:
+                status = "sent" if status_code < 400 else f"rejected ({status_code})"
+                break
+        await asyncio.to_thread(self.store.set_callback_status, job_id, status)
+
+    async def stop(self):
+        """
+        Stops the workers and the callbacks. The documents being processed are queued again.
+        """
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def post_json(url, body, timeout=10):
+    """
+    Sends a JSON body to a URL.
+
+    Args:
+        url (str): The URL.
+        body (bytes): The encoded JSON body.
+        timeout (float): The number of seconds to wait for the response.
+
+    Returns:
+        int: The status code of the response.
+
+    Raises:
+        urllib.error.URLError: If the request cannot be sent.
+    """
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
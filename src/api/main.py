@@ -1,64 +1,642 @@
+import asyncio
+import hashlib
 import json
+import logging
+import math
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Request
-from src.extractors.extract_attributes import ExtractAttributes
-from src.extractors.extract_selectors import ExtractSelectors
-from src.utils.utils import MergeAttributesAndSelectors, CheckHTMLContent, CleanHTML
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from src.api.encoding import ResultEncoder, UnsupportedOutputError
+from src.api.ingest import BodyDecoder, HTMLIngest, InvalidBodyError, PayloadTooLargeError, UnsupportedContentEncodingError
+from src.api.jobs import InvalidCallbackError, JobRunner, JobStore, check_callback_url
+from src.extractors.pipeline import ExtractionPipeline, NotHTMLContentError, AttributeExtractionError, InvalidFieldsError, RejectedPageError
+from src.utils.metrics import SamplingProfiler, Timings
+from src.utils.scheduler import OverloadedError
+from starlette.formparsers import MultiPartException, MultiPartParser
 import uvicorn
 
-app = FastAPI()
+# Maximum number of documents of a batch processed at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "64"))
+# Priorities of the requests to the language model, the documents of a batch wait behind the single requests
+INTERACTIVE_PRIORITY = 0
+BATCH_PRIORITY = 1
+JOB_PRIORITY = 2
+# Maximum number of bytes of a request body as received, and of the HTML content of a document once decompressed
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", "20000000"))
+MAX_HTML_BYTES = int(os.getenv("MAX_HTML_BYTES", "20000000"))
+# Number of bytes of a request body received before they are parsed
+INGEST_CHUNK_BYTES = 256 * 1024
+# Status codes of the errors raised while reading the HTML content of a request
+READ_ERROR_STATUS_CODES = (
+    (PayloadTooLargeError, 413),
+    (UnsupportedContentEncodingError, 415),
+    (InvalidBodyError, 400),
+    (NotHTMLContentError, 400),
+)
+# Extractions slower than this number of seconds are logged with their stage timings, 0 disables the log
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "10"))
+# Fraction of the extractions run under the sampling profiler, whose samples are kept if the extraction is slow
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".cache/profiles")
+# Number of documents of the job queue processed at the same time by each worker process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+# Maximum number of seconds a client can wait for a job to finish in a single request
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "60"))
+# Host names the callbacks of the jobs may be sent to
+JOB_CALLBACK_HOSTS = [host.strip() for host in os.getenv("JOB_CALLBACK_HOSTS", "localhost,127.0.0.1").split(",") if host.strip()]
+# Number of seconds between two writes of the metrics of a worker to the directory shared with the other workers
+METRICS_WRITE_INTERVAL = float(os.getenv("METRICS_WRITE_INTERVAL", "5"))
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Creates the extraction pipeline and its shared resources (async inference clients, scheduler of the requests
+    to the language model, result cache and template store), warms up the stages of the extraction and starts the
+    workers of the job queue on startup, and stops and closes them on shutdown. The worker is reported as ready
+    from the end of the startup until the start of the shutdown.
+
+    Args:
+        app (FastAPI): The FastAPI application.
+    """
+    app.state.ready = False
+    app.state.started_at = time.time()
+    app.state.pipeline = ExtractionPipeline.from_env()
+    app.state.job_store = JobStore(
+        # The jobs are only kept in memory, and only visible to the worker that received them, if the path is empty
+        path=os.getenv("JOB_STORE_PATH", ".cache/jobs.sqlite3") or None,
+        ttl=float(os.getenv("JOB_TTL", "86400")),
+        max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+    )
+    app.state.job_runner = JobRunner(
+        app.state.job_store,
+        lambda html_content, options: extract_document(app.state.pipeline, None, html_content, priority=JOB_PRIORITY, **options),
+        workers=JOB_WORKERS
+    )
+    app.state.job_runner.start()
+    metrics_task = asyncio.ensure_future(write_metrics(app.state.pipeline)) if app.state.pipeline.metrics.directory else None
+    # The stages are already warm if the server warmed them up before forking the workers, which makes this run cheap
+    warm_up_start = time.perf_counter()
+    await asyncio.to_thread(ExtractionPipeline.warm_up, app.state.pipeline.prompt_token_budget)
+    app.state.warm_up_seconds = time.perf_counter() - warm_up_start
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        # Load balancers stop sending requests to the worker while it drains
+        app.state.ready = False
+        await app.state.job_runner.stop()
+        if metrics_task is not None:
+            metrics_task.cancel()
+            # The counters of the worker are still added up after it exits
+            await asyncio.to_thread(app.state.pipeline.metrics.write)
+        app.state.job_store.close()
+        await app.state.pipeline.close()
+
+app = FastAPI(lifespan=lifespan)
+
+async def read_document(request, timings):
+    """
+    Reads the HTML content of a request as it is received. The body is decompressed, decoded and parsed chunk by chunk
+    in a dedicated thread, so the raw body is never held in memory in full and the event loop is never blocked.
+    Requests that are too large or that are not HTML are rejected as soon as it is known.
+
+    Args:
+        request (Request): The incoming HTTP request containing the HTML content.
+        timings (Timings): The instrumentation of the extraction.
+
+    Returns:
+        ParsedHTML: The parsed HTML content.
+
+    Raises:
+        PayloadTooLargeError: If the request body or the HTML content exceeds the size limit.
+        UnsupportedContentEncodingError: If the request body is compressed with an unsupported content encoding.
+        InvalidBodyError: If the request body cannot be decompressed.
+        NotHTMLContentError: If the provided content is not HTML.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+        raise PayloadTooLargeError(f"The request body exceeds the limit of {MAX_REQUEST_BYTES} bytes")
+
+    ingest = HTMLIngest(request.headers.get("content-type"), request.headers.get("content-encoding"), MAX_HTML_BYTES)
+    loop = asyncio.get_running_loop()
+    received = 0
+    pending = []
+    # lxml parsers must not be used from several threads, so all the chunks are parsed in the same one
+    with timings.measure("ingest"), ThreadPoolExecutor(max_workers=1) as executor:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_REQUEST_BYTES:
+                raise PayloadTooLargeError(f"The request body exceeds the limit of {MAX_REQUEST_BYTES} bytes")
+            pending.append(chunk)
+            if sum(map(len, pending)) >= INGEST_CHUNK_BYTES:
+                await loop.run_in_executor(executor, ingest.feed, b"".join(pending))
+                pending = []
+        try:
+            document = await loop.run_in_executor(executor, ingest.close, b"".join(pending))
+        finally:
+            timings.record("request_bytes", received)
+            timings.record("input_bytes", ingest.size)
+    return document
+
+def get_field_options(fields=None, known=None, url=None, selectors=True):
+    """
+    Reads the selection of attributes to extract, the known attributes, the URL of the page of a request and whether
+    to extract the selectors.
+
+    Args:
+        fields (str | list, optional): The attributes to extract, as a list or a comma-separated string.
+        known (str | dict, optional): The values of the attributes that are already known, as an object or its JSON encoding.
+        url (str, optional): The URL of the page, which identifies its snapshot.
+        selectors (bool): Whether to extract the selectors of the attributes.
+
+    Returns:
+        dict: The validated `fields`, `known`, `url` and `selectors` arguments of the extraction.
+
+    Raises:
+        InvalidFieldsError: If the attributes or the known values are not valid.
+    """
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    if isinstance(known, str):
+        try:
+            known = json.loads(known)
+        except ValueError:
+            raise InvalidFieldsError("The known attributes must be a JSON object")
+    if url is not None and not isinstance(url, str):
+        raise InvalidFieldsError("The URL must be a string")
+    if not isinstance(selectors, bool):
+        raise InvalidFieldsError("The selectors option must be a boolean")
+    fields, known = ExtractionPipeline.select_fields(fields, known)
+    return {"fields": fields, "known": known, "url": url or None, "selectors": selectors}
 
 @app.post("/extract-attributes-and-selectors/")
-async def extract_attributes_and_selectors(request: Request):
+async def extract_attributes_and_selectors(request: Request, fields: str = None, known: str = None, url: str = None, selectors: bool = True,
+                                           output: str = None, output_format: str = Query(None, alias="format")):
     """
     Endpoint to extract e-commerce attributes and their corresponding CSS selectors and XPaths from HTML content.
-    
+    The body may be compressed with gzip, deflate or, if the brotli package is installed, brotli. The result is
+    returned as JSON, or as MessagePack if it is requested with `format` or the Accept header.
+
     Args:
         request (Request): The incoming HTTP request containing the HTML content.
-    
+        fields (str, optional): The comma-separated attributes to extract. If not provided, all the attributes are extracted.
+        known (str, optional): A JSON object with the values of attributes that are already known, which are not
+            extracted again but whose selectors are still extracted.
+        url (str, optional): The URL of the page. If it was extracted before, only what changed since is extracted again.
+        selectors (bool): Whether to extract the selectors. If false, only the values of the attributes are returned.
+        output (str, optional): The output mode, `full` (default) or `compact`.
+        output_format (str, optional): The `format` of the result, `json` or `msgpack`.
+
     Returns:
-        dict: A dictionary containing the extracted attributes and their corresponding selectors.
-    
+        Response: A dictionary containing the extracted attributes and their corresponding selectors. If the page is not
+            HTML or is rejected by the triage (a bot wall, an empty shell or a listing), the error `detail` and its
+            `reason` code are returned instead, with a 400 or 422 status code.
+
     Raises:
-        HTTPException: If the provided content is not valid HTML or if there is an error during attribute extraction or any other exception.
+        HTTPException: If the provided content is too large or compressed with an unsupported encoding,
+            if the language model is overloaded, with a `Retry-After` header, if the requested or known attributes or
+            the output options are not valid, or if there is an error during attribute extraction or any other exception.
     """
+    pipeline = request.app.state.pipeline
+    try:
+        options = get_field_options(fields, known, url, selectors)
+        encoder = ResultEncoder.from_request(request, output, output_format)
+    except (InvalidFieldsError, UnsupportedOutputError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    timings = Timings()
     try:
-        # Read and decode the HTML content from the request body
-        html_content = await request.body()
-        html_content = html_content.decode("utf-8")
-        
-        # Check if the content is valid HTML
-        if not CheckHTMLContent(html_content).is_html:
-            raise HTTPException(status_code=400, detail="The provided content is not HTML")
-        
-        cleaned_html_content = CleanHTML(html_content).cleaned_html
-
-        # Extract attributes using the ExtractAttributes class
-        attribute_extractor = ExtractAttributes(cleaned_html_content)
+        document = await read_document(request, timings)
+    except Exception as e:
+        status_code = next((code for error, code in READ_ERROR_STATUS_CODES if isinstance(e, error)), 500)
+        result = {"status_code": status_code, "detail": str(e)}
+        if isinstance(e, NotHTMLContentError):
+            result["reason"] = "not_html"
+        timings.outcome("not_html" if isinstance(e, NotHTMLContentError) else "rejected")
+        pipeline.metrics.observe(timings, status_code)
+    else:
+        result = await extract_document(pipeline, None, document, timings, INTERACTIVE_PRIORITY, **options)
+
+    # The stage durations are reported to the client, so they can be read from the network panel of a browser
+    headers = {"Server-Timing": timings.server_timing()}
+    if "retry_after" in result:
+        # Retry-After only allows a whole number of seconds
+        headers["Retry-After"] = str(math.ceil(result["retry_after"]))
+    if "reason" in result:
+        # The reason code tells the pages rejected by the triage apart without parsing the message
+        return JSONResponse({"detail": result["detail"], "reason": result["reason"]}, status_code=result["status_code"], headers=headers)
+    if result["status_code"] != 200:
+        raise HTTPException(status_code=result["status_code"], detail=result["detail"], headers=headers)
+    return encoder.response(encoder.convert(result["result"]), headers=headers)
+
+@app.get("/health/live")
+async def liveness():
+    """
+    Endpoint to check that the worker is alive: it answers as long as its event loop is not blocked.
+
+    Returns:
+        dict: The status and the process ID of the worker.
+    """
+    return {"status": "alive", "pid": os.getpid()}
+
+@app.get("/health/ready")
+async def readiness(request: Request):
+    """
+    Endpoint to check that the worker is ready to extract pages: its pipeline is created, the stages of the extraction
+    are warm and it is not shutting down.
+
+    Args:
+        request (Request): The incoming HTTP request.
+
+    Returns:
+        JSONResponse: The status, the process ID and the uptime of the worker, the duration of its warm-up and its
+            requests to the language model in progress, with a 503 status code if the worker is not ready.
+    """
+    state = request.app.state
+    ready = getattr(state, "ready", False)
+    body = {"status": "ready" if ready else "not_ready", "pid": os.getpid()}
+    if ready:
+        body.update({
+            "uptime_seconds": round(time.time() - state.started_at, 3),
+            "warm_up_seconds": round(state.warm_up_seconds, 6),
+            "in_flight_model_calls": len(state.pipeline.in_flight),
+        })
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+def get_gauges(pipeline):
+    """
+    Reads the gauges of this worker: its requests to the language model in progress and the counters of its scheduler,
+    result cache, template store and snapshot store.
+
+    Args:
+        pipeline (ExtractionPipeline): The extraction pipeline.
+
+    Returns:
+        dict: The gauges, by name, with their labels and values.
+    """
+    gauges = {
+        "extraction_in_flight_model_calls": [((), len(pipeline.in_flight))],
+        "extraction_inference_scheduler": [((("counter", name),), value) for name, value in pipeline.scheduler.stats().items()],
+    }
+    if pipeline.result_cache is not None:
+        gauges["extraction_result_cache"] = [((("counter", name),), value) for name, value in pipeline.result_cache.stats().items()]
+    if pipeline.template_store is not None:
+        gauges["extraction_template_store"] = [((("counter", name),), value) for name, value in pipeline.template_store.stats().items()]
+    if pipeline.snapshot_store is not None:
+        gauges["extraction_snapshot_store"] = [((("counter", name),), value) for name, value in pipeline.snapshot_store.stats().items()]
+    return gauges
+
+async def write_metrics(pipeline):
+    """
+    Writes the metrics of this worker to the directory shared with the other workers at a fixed interval, so they are
+    included when another worker is scraped.
+
+    Args:
+        pipeline (ExtractionPipeline): The extraction pipeline.
+    """
+    while True:
+        await asyncio.sleep(METRICS_WRITE_INTERVAL)
         try:
-            response = attribute_extractor.get_response()
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
-        
-        # Extract selectors using the ExtractSelectors class
-        attributes = response.choices[0].message.tool_calls[0].function.arguments
-        attributes = json.loads(attributes) if isinstance(attributes, str) else attributes
-        selectors = ExtractSelectors(html_content, attributes).extract_selectors()
-        
-        # Merge attributes and selectors
-        result = MergeAttributesAndSelectors(attributes, selectors).result
-        return result
-    
-    except HTTPException as e:
-        # Raise HTTPException for known errors
-        raise e
-    
+            await asyncio.to_thread(pipeline.metrics.write, get_gauges(pipeline))
+        except OSError as e:
+            logger.warning("Failed to write the metrics to %s: %s", pipeline.metrics.directory, e)
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """
+    Endpoint to expose the latency histograms, content sizes, token counts and fast path outcomes of the extractions,
+    along with the counters of the result cache, of the template store, of the snapshot store and of the scheduler
+    of the requests to the language model and the number of documents of the job queue by status, in the Prometheus
+    format. Behind the pre-forked server, the histograms and counters are added up over all the workers, and the
+    counters of the stores and of the scheduler are reported for each running worker with its `pid` label.
+
+    Args:
+        request (Request): The incoming HTTP request.
+
+    Returns:
+        PlainTextResponse: The metrics in the Prometheus text format.
+    """
+    pipeline = request.app.state.pipeline
+    job_stats = await asyncio.to_thread(request.app.state.job_store.stats)
+    # The job queue is shared by the workers through its database, so it is only reported once
+    shared_gauges = {"extraction_job_documents": [((("status", status),), value) for status, value in job_stats.items()]}
+    content = await asyncio.to_thread(pipeline.metrics.render, get_gauges(pipeline), shared_gauges)
+    return PlainTextResponse(content, media_type="text/plain; version=0.0.4")
+
+async def stream_body(request):
+    """
+    Yields the chunks of the body of a request as they are received, stopping as soon as it exceeds the size limit.
+
+    Args:
+        request (Request): The incoming HTTP request.
+
+    Yields:
+        bytes: The chunks of the request body.
+
+    Raises:
+        PayloadTooLargeError: If the request body exceeds the size limit.
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_REQUEST_BYTES:
+        raise PayloadTooLargeError(f"The request body exceeds the limit of {MAX_REQUEST_BYTES} bytes")
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > MAX_REQUEST_BYTES:
+            raise PayloadTooLargeError(f"The request body exceeds the limit of {MAX_REQUEST_BYTES} bytes")
+        yield chunk
+
+async def read_batch(request):
+    """
+    Reads the documents of a batch request, either a multipart upload with one file per document or
+    NDJSON with one `{"id": ..., "html": ...}` object per line. The lines may also hold the `fields` to extract,
+    the `known` attributes, the `url` of their document and whether to extract its `selectors`. The body is read
+    as it is received, and the files of a multipart upload are spooled to disk rather than held in memory.
+
+    Args:
+        request (Request): The incoming HTTP request containing the documents.
+
+    Returns:
+        list: The ID, the HTML content and the `fields`, `known`, `url` and `selectors` options given for each document.
+
+    Raises:
+        HTTPException: If the request body is too large, is not UTF-8 or cannot be read.
+    """
+    content_type = request.headers.get("content-type", "")
+    documents = []
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await MultiPartParser(request.headers, stream_body(request)).parse()
+            try:
+                for name, value in form.multi_items():
+                    if hasattr(value, "read"):
+                        documents.append((value.filename or name, (await value.read()).decode("utf-8"), {}))
+                    else:
+                        documents.append((name, value, {}))
+            finally:
+                await form.close()
+            return documents
+        body = b"".join([chunk async for chunk in stream_body(request)]).decode("utf-8")
+    except PayloadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="The documents of a batch must be encoded in UTF-8")
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    for line_number, line in enumerate(body.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            documents.append((item.get("id", line_number), item["html"], {key: item[key] for key in ("fields", "known", "url", "selectors") if key in item}))
+        except (ValueError, KeyError, AttributeError):
+            raise HTTPException(status_code=400, detail=f"Line {line_number} is not a JSON object with an `html` field")
+    return documents
+
+async def extract_document(pipeline, semaphore, html_content, timings=None, priority=INTERACTIVE_PRIORITY, fields=None, known=None, url=None, selectors=True):
+    """
+    Extracts the attributes and selectors of one document and records its metrics. Slow extractions are logged
+    with their stage timings, and a sample of the extractions is profiled to find where the time of slow ones goes.
+
+    Args:
+        pipeline (ExtractionPipeline): The extraction pipeline.
+        semaphore (asyncio.Semaphore, optional): The limit on the number of documents of a batch processed at the same time.
+        html_content (str | ParsedHTML): The raw HTML content, or the HTML content parsed while it was received.
+        timings (Timings, optional): The instrumentation of the extraction.
+        priority (int): The priority of the request to the language model, lower values are served first.
+        fields (list, optional): The attributes to extract. If not provided, all the attributes are extracted.
+        known (dict, optional): The values of attributes that are already known.
+        url (str, optional): The URL of the page, which identifies its snapshot.
+        selectors (bool): Whether to extract the selectors of the attributes.
+
+    Returns:
+        dict: The result of the document, or its error and status code, with the number of seconds after which
+            to try again if the language model is overloaded, or the reason code if the page is not HTML or was
+            rejected by the triage.
+    """
+    if semaphore is not None:
+        async with semaphore:
+            return await extract_document(pipeline, None, html_content, timings, priority, fields, known, url, selectors)
+
+    timings = timings if timings is not None else Timings()
+    profiler = SamplingProfiler() if random.random() < PROFILE_SAMPLE_RATE else None
+    if profiler is not None:
+        profiler.start()
+    try:
+        result = {"status_code": 200, "result": await pipeline.extract(html_content, timings, priority, fields, known, url, selectors)}
+    except OverloadedError as e:
+        result = {"status_code": 503, "detail": str(e), "retry_after": e.retry_after}
+    except NotHTMLContentError as e:
+        result = {"status_code": 400, "detail": str(e), "reason": "not_html"}
+    except RejectedPageError as e:
+        result = {"status_code": 422, "detail": str(e), "reason": e.reason}
+    except (InvalidFieldsError, AttributeExtractionError) as e:
+        result = {"status_code": 400, "detail": str(e)}
     except Exception as e:
-        # Catch all other exceptions and raise a 500 HTTPException
-        raise HTTPException(status_code=500, detail=str(e))
+        result = {"status_code": 500, "detail": str(e)}
+    finally:
+        if profiler is not None:
+            await asyncio.to_thread(profiler.stop)
+
+    pipeline.metrics.observe(timings, result["status_code"])
+    if SLOW_REQUEST_SECONDS and timings.total >= SLOW_REQUEST_SECONDS:
+        logger.warning("Slow extraction (%.1f s): %s", timings.total, timings.server_timing())
+        if profiler is not None:
+            path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{int(timings.total * 1000)}ms.folded")
+            await asyncio.to_thread(profiler.write, path)
+            logger.warning("Profile of the slow extraction written to %s", path)
+    return result
+
+@app.post("/batch-extract-attributes-and-selectors/")
+async def batch_extract_attributes_and_selectors(request: Request, fields: str = None, known: str = None, url: str = None, selectors: bool = True,
+                                                 output: str = None, output_format: str = Query(None, alias="format")):
+    """
+    Endpoint to extract e-commerce attributes and their corresponding CSS selectors and XPaths from many HTML documents.
+    The documents are processed concurrently and the results are streamed back as NDJSON, or as a sequence of
+    MessagePack objects if it is requested with `format` or the Accept header, as soon as each one finishes.
+    Byte-identical documents are processed once, and identical cleaned pages share a single call to the language model.
+
+    Args:
+        request (Request): The incoming HTTP request containing the documents, as a multipart upload or NDJSON.
+        fields (str, optional): The comma-separated attributes to extract from every document, unless a line of the NDJSON
+            gives its own `fields`. If not provided, all the attributes are extracted.
+        known (str, optional): A JSON object with the known attributes of every document, unless a line of the NDJSON
+            gives its own `known` attributes.
+        url (str, optional): The URL of the page of every document, unless a line of the NDJSON gives its own `url`.
+        selectors (bool): Whether to extract the selectors of every document, unless a line of the NDJSON gives its own `selectors`.
+        output (str, optional): The output mode, `full` (default) or `compact`.
+        output_format (str, optional): The `format` of the results, `ndjson` or `msgpack`.
+
+    Returns:
+        StreamingResponse: One JSON line or MessagePack object per document with its `id`, `status_code` and `result` or error `detail`.
+
+    Raises:
+        HTTPException: If the request body cannot be read or the requested or known attributes or the output options are not valid.
+    """
+    try:
+        default_options = get_field_options(fields, known, url, selectors)
+        encoder = ResultEncoder.from_request(request, output, output_format, formats=("ndjson", "msgpack"))
+    except (InvalidFieldsError, UnsupportedOutputError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    documents = await read_batch(request)
+    pipeline = request.app.state.pipeline
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    def get_resolved_future(result):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(result)
+        return future
+
+    # Documents with the same content and options share the same task
+    tasks = {}
+    document_tasks = []
+    for document_id, html_content, document_options in documents:
+        content = html_content.encode("utf-8")
+        try:
+            options = get_field_options(**{**default_options, **document_options})
+        except InvalidFieldsError as e:
+            document_tasks.append((document_id, get_resolved_future({"status_code": 400, "detail": str(e)})))
+            continue
+        digest = hashlib.sha256(content + json.dumps(options, sort_keys=True).encode("utf-8")).hexdigest()
+        if digest not in tasks and len(content) > MAX_HTML_BYTES:
+            tasks[digest] = get_resolved_future({"status_code": 413, "detail": f"The HTML content exceeds the limit of {MAX_HTML_BYTES} bytes"})
+        elif digest not in tasks:
+            tasks[digest] = asyncio.ensure_future(extract_document(pipeline, semaphore, html_content, priority=BATCH_PRIORITY, **options))
+        document_tasks.append((document_id, tasks[digest]))
+
+    async def stream_results():
+        waiting = {}
+        for document_id, task in document_tasks:
+            waiting.setdefault(task, []).append(document_id)
+        try:
+            for finished in asyncio.as_completed(list(waiting)):
+                await finished
+                for task in [task for task in waiting if task.done()]:
+                    result = task.result()
+                    if "result" in result:
+                        result = {**result, "result": encoder.convert(result["result"])}
+                    for document_id in waiting.pop(task):
+                        yield encoder.line({"id": document_id, **result})
+        finally:
+            # Stop processing the remaining documents if the client disconnects
+            for task in tasks.values():
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type=encoder.media_type)
+
+async def read_job_documents(request):
+    """
+    Reads the documents of a job submission: a multipart upload or NDJSON like the batch endpoint, or a single
+    HTML document as the request body, which may be compressed like the body of the single document endpoint.
+
+    Args:
+        request (Request): The incoming HTTP request containing the documents.
+
+    Returns:
+        list: The ID, the HTML content and the `fields`, `known`, `url` and `selectors` options given for each document. The ID of a single
+            document is None.
+
+    Raises:
+        HTTPException: If the request body cannot be read or a document is too large.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith(("multipart/form-data", "application/x-ndjson", "application/jsonl")):
+        documents = await read_batch(request)
+    else:
+        try:
+            decoder = BodyDecoder(request.headers.get("content-encoding"), MAX_HTML_BYTES)
+            chunks = []
+            async for chunk in stream_body(request):
+                chunks.append(decoder.decode(chunk))
+            chunks.append(decoder.flush())
+        except Exception as e:
+            status_code = next((code for error, code in READ_ERROR_STATUS_CODES if isinstance(e, error)), 500)
+            raise HTTPException(status_code=status_code, detail=str(e))
+        content = b"".join(chunks)
+        charset = HTMLIngest(content_type).detect_charset(content[:HTMLIngest.sniff_bytes])
+        documents = [(None, content.decode(charset, errors="replace"), {})]
+    for document_id, html_content, _ in documents:
+        if len(html_content.encode("utf-8")) > MAX_HTML_BYTES:
+            raise HTTPException(status_code=413, detail=f"The HTML content of document {document_id} exceeds the limit of {MAX_HTML_BYTES} bytes")
+    return documents
+
+@app.post("/jobs/", status_code=202)
+async def submit_jobs(request: Request, callback_url: str = None, fields: str = None, known: str = None, url: str = None, selectors: bool = True):
+    """
+    Endpoint to submit HTML documents for extraction in the background. The job IDs are returned immediately and the
+    documents are processed by the job workers, identical documents only once. The result of a job can be read from
+    `/jobs/{job_id}`, or sent to `callback_url` once the job is finished.
+
+    Args:
+        request (Request): The incoming HTTP request containing a single HTML document as its body, or several documents
+            as a multipart upload or NDJSON.
+        callback_url (str, optional): The URL the finished jobs are posted to. Only the hosts of `JOB_CALLBACK_HOSTS` are allowed.
+        fields (str, optional): The comma-separated attributes to extract from every document, unless a line of the NDJSON
+            gives its own `fields`. If not provided, all the attributes are extracted.
+        known (str, optional): A JSON object with the known attributes of every document, unless a line of the NDJSON
+            gives its own `known` attributes.
+        url (str, optional): The URL of the page of every document, unless a line of the NDJSON gives its own `url`.
+        selectors (bool): Whether to extract the selectors of every document, unless a line of the NDJSON gives its own `selectors`.
+
+    Returns:
+        JSONResponse: The ID, document ID and status of each job.
+
+    Raises:
+        HTTPException: If the request body cannot be read, a document is too large, the requested or known attributes
+            are not valid or the callback URL is not allowed.
+    """
+    try:
+        if callback_url is not None:
+            check_callback_url(callback_url, JOB_CALLBACK_HOSTS)
+        default_options = get_field_options(fields, known, url, selectors)
+        documents = [
+            (document_id, html_content, get_field_options(**{**default_options, **document_options}))
+            for document_id, html_content, document_options in await read_job_documents(request)
+        ]
+    except (InvalidCallbackError, InvalidFieldsError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    jobs = await request.app.state.job_runner.submit(documents, callback_url)
+    headers = {"Location": f"/jobs/{jobs[0]['id']}"} if len(jobs) == 1 else None
+    return JSONResponse({"jobs": jobs}, status_code=202, headers=headers)
+
+@app.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str, wait: float = 0, output: str = None, output_format: str = Query(None, alias="format")):
+    """
+    Endpoint to read the status of a job, and its result once it is finished. With `wait`, the request is held
+    until the job is finished or the number of seconds has passed, so clients can long-poll instead of polling.
+
+    Args:
+        request (Request): The incoming HTTP request.
+        job_id (str): The ID of the job.
+        wait (float): The maximum number of seconds to wait for the job to finish, capped by `JOB_MAX_WAIT`.
+        output (str, optional): The output mode of the result, `full` (default) or `compact`.
+        output_format (str, optional): The `format` of the job, `json` or `msgpack`.
+
+    Returns:
+        Response: The job with its status, and its `status_code` and `result` or error `detail` once it is finished.
+
+    Raises:
+        HTTPException: If the output options are not valid or the job does not exist.
+    """
+    try:
+        encoder = ResultEncoder.from_request(request, output, output_format)
+    except UnsupportedOutputError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = await request.app.state.job_runner.wait(job_id, min(max(wait, 0), JOB_MAX_WAIT))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if "result" in job:
+        job["result"] = encoder.convert(job["result"])
+    return encoder.response(job)
 
 if __name__ == "__main__":
     """
     Main entry point for the FastAPI application. Runs the app on localhost.
     """
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="127.0.0.1", port=8000)
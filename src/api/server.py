@@ -0,0 +1,243 @@
+import argparse
+import gc
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+import uvicorn
+from dotenv import load_dotenv
+
+from src.api.main import app
+from src.extractors.pipeline import ExtractionPipeline
+
+logger = logging.getLogger(__name__)
+
+class PreforkServer:
+    """
+    PreforkServer is a class designed to serve the API with several worker processes forked from a warm master process.
+    The master imports the application and its heavy dependencies (lxml, huggingface_hub, FastAPI), builds the
+    middleware stack and the OpenAPI schema, warms up the stages of the extraction and binds the listening socket
+    before forking, so the workers start in milliseconds and share these pages of memory copy-on-write. Each worker
+    then creates its own pipeline, inference clients and connections to the SQLite stores, which are shared by all
+    workers through the database files, and writes its metrics to a directory shared by all workers, so any of them
+    can report the metrics of the whole server. The master restarts the workers that exit, with a growing delay for the workers
+    that fail to start, and stops them gracefully on SIGTERM.
+    """
+
+    # Workers exiting sooner than this number of seconds after they were forked failed to start
+    min_worker_uptime = 5.0
+    # Number of seconds before restarting a worker that failed to start, doubled with each recent failure
+    restart_delay = 1.0
+    max_restart_delay = 30.0
+    # The server is stopped once more workers than this failed to start within the window, as the next ones would fail too
+    max_start_failures = 5
+    start_failure_window = 300.0
+    # Number of seconds between two checks of the workers
+    poll_interval = 0.5
+
+    def __init__(self, host="127.0.0.1", port=8000, workers=1, log_level="info", graceful_timeout=30.0):
+        """
+        Initializes the PreforkServer class.
+
+        Args:
+            host (str): The host to bind the socket to.
+            port (int): The port to bind the socket to.
+            workers (int): The number of worker processes.
+            log_level (str): The log level of uvicorn.
+            graceful_timeout (float): The number of seconds the workers are given to finish their requests on shutdown
+                before they are killed.
+        """
+        self.workers = max(1, workers)
+        self.graceful_timeout = graceful_timeout
+        self.config = uvicorn.Config(
+            app, host=host, port=port, log_level=log_level, timeout_graceful_shutdown=graceful_timeout, lifespan="on"
+        )
+        self.socket = None
+        # Start time of each worker, by process ID
+        self.processes = {}
+        # Times at which the workers that failed to start are restarted, and times of their failures
+        self.restarts = []
+        self.start_failures = []
+        self.stopping = False
+        self.exit_code = 0
+        # Directory of the metrics of the workers, removed on exit if it was created by the server
+        self.metrics_dir = None
+        self.temporary_metrics_dir = False
+
+    def warm_up(self):
+        """
+        Loads everything the workers would otherwise load on their own before they are forked: the middleware stack and
+        the protocol implementations of uvicorn, the OpenAPI schema and the stages of the extraction. The objects created
+        so far are then moved out of the reach of the garbage collector, so the collections of the workers do not write
+        to the shared pages.
+        """
+        start = time.perf_counter()
+        self.config.load()
+        app.openapi()
+        ExtractionPipeline.warm_up(int(os.getenv("PROMPT_TOKEN_BUDGET", "6000")) or None)
+        gc.collect()
+        gc.freeze()
+        logger.info("Warmed up in %.3f seconds", time.perf_counter() - start)
+
+    def prepare_metrics_dir(self):
+        """
+        Creates the directory where the workers share their metrics, or empties the one given by `METRICS_DIR` of the
+        metrics of a previous run, and passes it to the workers through the environment.
+        """
+        self.metrics_dir = os.getenv("METRICS_DIR")
+        if self.metrics_dir:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            for name in os.listdir(self.metrics_dir):
+                if name.endswith((".json", ".json.tmp")):
+                    os.remove(os.path.join(self.metrics_dir, name))
+        else:
+            self.metrics_dir = tempfile.mkdtemp(prefix="extraction-metrics-")
+            self.temporary_metrics_dir = True
+            os.environ["METRICS_DIR"] = self.metrics_dir
+
+    def spawn_worker(self):
+        """
+        Forks a worker process, which serves the API on the shared socket until it is stopped.
+        """
+        pid = os.fork()
+        if pid != 0:
+            self.processes[pid] = time.monotonic()
+            return
+        # uvicorn installs its own handlers for a graceful shutdown
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            uvicorn.Server(self.config).run(sockets=[self.socket])
+        except BaseException:
+            logger.exception("Worker %s crashed", os.getpid())
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def handle_signal(self, signum, frame):
+        """
+        Starts the shutdown of the server on SIGTERM or SIGINT.
+
+        Args:
+            signum (int): The number of the signal.
+            frame (frame): The current stack frame.
+        """
+        self.stopping = True
+
+    def reap_workers(self):
+        """
+        Collects the workers that exited and restarts them, unless the server is stopping. A worker that failed to start
+        is restarted after a delay that doubles with each recent failure, and the server is stopped after too many of
+        them, as the problem is then unlikely to go away.
+        """
+        while self.processes:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            started_at = self.processes.pop(pid, None)
+            if started_at is None or self.stopping:
+                continue
+            now = time.monotonic()
+            uptime = now - started_at
+            logger.warning("Worker %s exited with status %s after %.1f seconds", pid, os.waitstatus_to_exitcode(status), uptime)
+            if uptime >= self.min_worker_uptime:
+                self.spawn_worker()
+                continue
+            self.start_failures = [failed_at for failed_at in self.start_failures if now - failed_at < self.start_failure_window]
+            self.start_failures.append(now)
+            if len(self.start_failures) > self.max_start_failures:
+                logger.error("%d workers failed to start in %.0f seconds, stopping the server", len(self.start_failures), self.start_failure_window)
+                self.stopping = True
+                self.exit_code = 1
+                return
+            delay = min(self.restart_delay * 2 ** (len(self.start_failures) - 1), self.max_restart_delay)
+            logger.error("Worker %s failed to start, restarting it in %.1f seconds", pid, delay)
+            self.restarts.append(now + delay)
+
+    def restart_workers(self):
+        """
+        Restarts the workers that failed to start once their delay has passed.
+        """
+        now = time.monotonic()
+        due = [restart_at for restart_at in self.restarts if restart_at <= now]
+        self.restarts = [restart_at for restart_at in self.restarts if restart_at > now]
+        for _ in due:
+            self.spawn_worker()
+
+    def stop_workers(self):
+        """
+        Asks the workers to finish their requests and exit, and kills those still running after the graceful timeout.
+        """
+        for pid in self.processes:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.processes and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                time.sleep(0.1)
+            else:
+                self.processes.pop(pid, None)
+        for pid in self.processes:
+            logger.warning("Killing worker %s", pid)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self.processes = {}
+
+    def run(self):
+        """
+        Warms up, prepares the directory of the metrics, binds the socket, forks the workers and supervises them until
+        the server is stopped.
+
+        Returns:
+            int: The exit code of the server.
+        """
+        self.warm_up()
+        self.prepare_metrics_dir()
+        self.socket = self.config.bind_socket()
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        logger.info("Starting %d workers on %s:%d", self.workers, self.config.host, self.config.port)
+        for _ in range(self.workers):
+            self.spawn_worker()
+        try:
+            while not self.stopping:
+                time.sleep(self.poll_interval)
+                self.reap_workers()
+                if not self.stopping:
+                    self.restart_workers()
+        finally:
+            self.stop_workers()
+            self.socket.close()
+            if self.temporary_metrics_dir:
+                shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        return self.exit_code
+
+def main():
+    """
+    Main function to parse the command line arguments and run the server.
+    """
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve the API with pre-forked worker processes.")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"), help="Host to bind to")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")), help="Port to bind to")
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1,
+        help="Number of worker processes, one per core by default"
+    )
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"), help="Log level")
+    parser.add_argument(
+        "--graceful-timeout", type=float, default=float(os.getenv("GRACEFUL_TIMEOUT", "30")),
+        help="Number of seconds the workers are given to finish their requests on shutdown"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s")
+    server = PreforkServer(args.host, args.port, args.workers, args.log_level, args.graceful_timeout)
+    sys.exit(server.run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import argparse
+import glob
+import json
+import os
+import random
+
+# Words of the generated reviews, descriptions and recommendation cards
+WORDS = (
+    "quality delivery product great value fast packaging original seller recommend price good item works "
+    "battery size color fabric fits perfect cheap durable light heavy strong soft smooth easy daily use "
+    "gift family happy satisfied order received condition box warranty service stock offer"
+).split()
+
+# Variants of each sample page, from the original page to multi-megabyte pages
+VARIANTS = {
+    "original": {},
+    "medium": {"target_bytes": 500_000},
+    "large": {"target_bytes": 2_000_000},
+    "xlarge": {"target_bytes": 8_000_000},
+    "deep": {"depth": 200},
+    "images": {"images": 2000},
+    "worst": {"target_bytes": 4_000_000, "depth": 200, "images": 2000},
+}
+
+def get_sentence(generator, length):
+    """
+    Generates a sentence of random words.
+
+    Args:
+    generator (random.Random): The random number generator.
+    length (int): The number of words.
+
+    Returns:
+    str: The sentence.
+    """
+    return " ".join(generator.choice(WORDS) for _ in range(length)).capitalize() + "."
+
+def get_filler_block(generator, index):
+    """
+    Generates a block of content found below the product on real pages: a review, a recommendation carousel or a specification table.
+
+    Args:
+    generator (random.Random): The random number generator.
+    index (int): The index of the block, used to make its attributes unique.
+
+    Returns:
+    str: The HTML of the block.
+    """
+    kind = index % 3
+    if kind == 0:
+        return (
+            f'<div class="review-item" id="review-{index}"><div class="review-header"><span class="author">Customer {index}</span>'
+            f'<span class="review-date">{generator.randint(1, 28)} Jan 2024</span></div>'
+            f'<div class="review-content"><p>{get_sentence(generator, generator.randint(10, 60))}</p></div></div>'
+        )
+    if kind == 1:
+        cards = "".join(
+            f'<div class="card-item"><a href="/products/{index}-{card}"><img src="https://cdn.example.com/rec/{index}-{card}.jpg" alt="">'
+            f'<div class="card-title">{get_sentence(generator, 5)}</div><div class="card-price">Rs. {generator.randint(100, 9999)}</div></a></div>'
+            for card in range(generator.randint(5, 20))
+        )
+        return f'<div class="recommendation-carousel" data-index="{index}">{cards}</div>'
+    rows = "".join(
+        f'<tr><th>{generator.choice(WORDS).capitalize()}</th><td>{get_sentence(generator, 4)}</td></tr>'
+        for _ in range(generator.randint(3, 12))
+    )
+    return f'<table class="specification" data-index="{index}"><tbody>{rows}</tbody></table>'
+
+def scale_page(html_content, target_bytes=None, depth=0, images=0, seed=0):
+    """
+    Scales a page by appending generated content, nesting it in wrapper elements and adding a gallery of images.
+
+    Args:
+    html_content (str): The HTML content of the page.
+    target_bytes (int, optional): The minimum size of the scaled page in bytes.
+    depth (int): The number of wrapper elements around the page. The HTML parser drops the content nested deeper than 255 levels,
+        so the depth of the wrappers and of the page must stay below it.
+    images (int): The number of images added to the page.
+    seed (int): The seed of the random number generator, so the corpus is reproducible.
+
+    Returns:
+    str: The scaled HTML content.
+    """
+    generator = random.Random(seed)
+    # The generated content goes inside the body of pages that close it
+    closing = html_content.lower().rfind("</body>")
+    head, tail = (html_content, "") if closing == -1 else (html_content[:closing], html_content[closing:])
+    parts = [head]
+    if images:
+        gallery = "".join(f'<li class="gallery-item"><img src="https://cdn.example.com/gallery/{index}.jpg" alt="Image {index}"></li>' for index in range(images))
+        parts.append(f'<div class="gallery"><ul>{gallery}</ul></div>')
+    size = sum(len(part.encode("utf-8")) for part in parts)
+    index = 0
+    while target_bytes and size < target_bytes:
+        block = get_filler_block(generator, index)
+        parts.append(block)
+        size += len(block.encode("utf-8"))
+        index += 1
+    content = "".join(parts)
+    if depth:
+        content = '<div class="wrapper">' * depth + content + "</div>" * depth
+    return content + tail
+
+def generate_corpus(data_dir, output_dir, variants=None, seed=0):
+    """
+    Generates the benchmark corpus from the sample pages and writes a manifest of the generated pages.
+
+    Args:
+    data_dir (str): The directory containing the sample HTML files.
+    output_dir (str): The directory to write the corpus to.
+    variants (list, optional): The names of the variants to generate. If not provided, all the variants are generated.
+    seed (int): The seed of the random number generator.
+
+    Returns:
+    list: The manifest entries, with the file name, sample, variant and size of each page.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = []
+    for sample_path in sorted(glob.glob(os.path.join(data_dir, "*.html"))):
+        with open(sample_path, "r") as file:
+            html_content = file.read()
+        sample = os.path.splitext(os.path.basename(sample_path))[0]
+        for variant in variants or VARIANTS:
+            content = scale_page(html_content, seed=seed, **VARIANTS[variant])
+            name = f"{sample}-{variant}.html"
+            with open(os.path.join(output_dir, name), "w") as file:
+                file.write(content)
+            manifest.append({"file": name, "sample": sample, "variant": variant, "bytes": len(content.encode("utf-8"))})
+    with open(os.path.join(output_dir, "manifest.json"), "w") as file:
+        file.write(json.dumps(manifest, indent=4))
+    return manifest
+
+def load_corpus(corpus_dir, variants=None):
+    """
+    Loads the pages of a generated corpus.
+
+    Args:
+    corpus_dir (str): The directory of the corpus.
+    variants (list, optional): The names of the variants to load. If not provided, all the pages are loaded.
+
+    Returns:
+    list: The manifest entry and the HTML content of each page.
+    """
+    with open(os.path.join(corpus_dir, "manifest.json"), "r") as file:
+        manifest = json.load(file)
+    pages = []
+    for entry in manifest:
+        if variants and entry["variant"] not in variants:
+            continue
+        with open(os.path.join(corpus_dir, entry["file"]), "r") as file:
+            pages.append((entry, file.read()))
+    return pages
+
+def main():
+    """
+    Main function to parse the command line arguments and generate the benchmark corpus.
+    """
+    parser = argparse.ArgumentParser(description="Generate a benchmark corpus of scaled pages from the sample HTML files.")
+    parser.add_argument("--data-dir", default="data", help="Directory containing the sample HTML files")
+    parser.add_argument("--output-dir", default=".cache/benchmarks/corpus", help="Directory to write the corpus to")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), help="Variants to generate, defaults to all of them")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator")
+    args = parser.parse_args()
+
+    for entry in generate_corpus(args.data_dir, args.output_dir, args.variants, args.seed):
+        print(f"{entry['file']}: {entry['bytes'] / 1e6:.2f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import argparse
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from src.benchmarks.corpus import VARIANTS, load_corpus
+
+def get_free_port():
+    """
+    Finds a free local port.
+
+    Returns:
+    int: The port.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(url, timeout=60):
+    """
+    Waits until a server answers.
+
+    Args:
+    url (str): The URL to poll.
+    timeout (float): The number of seconds to wait before giving up.
+
+    Raises:
+    TimeoutError: If the server does not answer in time.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} did not answer within {timeout} seconds")
+
+def get_peak_rss(pid):
+    """
+    Reads the peak resident set size of a process. Only available on Linux.
+
+    Args:
+    pid (int): The ID of the process.
+
+    Returns:
+    float: The peak resident set size in MB, or None if it cannot be read.
+    """
+    try:
+        with open(f"/proc/{pid}/status", "r") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+def get_child_pids(pid):
+    """
+    Reads the IDs of the child processes of a process, such as the workers of the API. Only available on Linux.
+
+    Args:
+    pid (int): The ID of the process.
+
+    Returns:
+    list: The IDs of the child processes.
+    """
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", "r") as file:
+            return [int(child) for child in file.read().split()]
+    except OSError:
+        return []
+
+def send_request(url, html_content, timeout):
+    """
+    Sends a page to the extraction endpoint.
+
+    Args:
+    url (str): The URL of the endpoint.
+    html_content (bytes): The encoded HTML content.
+    timeout (float): The number of seconds to wait for the response.
+
+    Returns:
+    tuple: The latency in seconds, the status code and the `Server-Timing` header of the response.
+    """
+    request = urllib.request.Request(url, data=html_content, headers={"Content-Type": "text/html"}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            status_code, headers = response.status, response.headers
+    except urllib.error.HTTPError as e:
+        status_code, headers = e.code, e.headers
+    except (urllib.error.URLError, OSError):
+        status_code, headers = 0, {}
+    return time.perf_counter() - start, status_code, headers.get("Server-Timing", "")
+
+def parse_server_timing(header):
+    """
+    Parses a `Server-Timing` header.
+
+    Args:
+    header (str): The value of the header.
+
+    Returns:
+    dict: The duration of each stage in milliseconds.
+    """
+    stages = {}
+    for metric in filter(None, (item.strip() for item in header.split(","))):
+        name, _, duration = metric.partition(";dur=")
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+def run_load(url, pages, requests, concurrency, timeout):
+    """
+    Sends the pages of the corpus to the extraction endpoint in a loop from concurrent clients.
+
+    Args:
+    url (str): The URL of the endpoint.
+    pages (list): The encoded HTML content of the pages.
+    requests (int): The total number of requests.
+    concurrency (int): The number of concurrent clients.
+    timeout (float): The number of seconds to wait for each response.
+
+    Returns:
+    dict: The latency percentiles, the throughput, the status codes and the mean duration of each stage.
+    """
+    counter = itertools.count()
+    lock = threading.Lock()
+    results = []
+
+    def client():
+        while True:
+            with lock:
+                index = next(counter)
+            if index >= requests:
+                return
+            result = send_request(url, pages[index % len(pages)], timeout)
+            with lock:
+                results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency * 1000 for latency, status_code, _ in results]
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    status_codes = {}
+    stages = {}
+    for _, status_code, header in results:
+        status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+        for stage, duration in parse_server_timing(header).items():
+            stages.setdefault(stage, []).append(duration)
+    return {
+        "requests": len(results),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0,
+        "latency_ms": {"p50": quantiles[49], "p95": quantiles[94], "p99": quantiles[98], "max": max(latencies, default=0)},
+        "status_codes": status_codes,
+        "stages_mean_ms": {stage: statistics.mean(durations) for stage, durations in stages.items()},
+    }
+
+def start_servers(latency, jitter, error_rate, cache, workers):
+    """
+    Starts the mock inference server and the API, configured to send its requests to the mock server.
+
+    Args:
+    latency (float): The mean number of seconds of a call to the mock server.
+    jitter (float): The standard deviation of the number of seconds of a call to the mock server.
+    error_rate (float): The fraction of the calls to the mock server that fail.
+    cache (bool): Whether the result cache and the template store are enabled.
+    workers (int): The number of worker processes of the API.
+
+    Returns:
+    tuple: The mock server process, the API process, the URL of the mock server and the URL of the API.
+    """
+    mock_port, api_port = get_free_port(), get_free_port()
+    mock = subprocess.Popen([
+        sys.executable, "-m", "src.benchmarks.mock_inference", "--port", str(mock_port),
+        "--latency", str(latency), "--jitter", str(jitter), "--error-rate", str(error_rate)
+    ])
+    environment = {**os.environ, "INFERENCE_BASE_URL": f"http://127.0.0.1:{mock_port}", "HF_TOKEN": "mock"}
+    if not cache:
+        environment.update({"RESULT_CACHE_PATH": "", "RESULT_CACHE_SIZE": "0", "TEMPLATE_LEARNING": "false"})
+    api = subprocess.Popen(
+        [sys.executable, "-m", "src.api.server", "--port", str(api_port), "--workers", str(workers), "--log-level", "warning"],
+        env=environment
+    )
+    mock_url, api_url = f"http://127.0.0.1:{mock_port}", f"http://127.0.0.1:{api_port}"
+    wait_until_ready(f"{mock_url}/stats")
+    wait_until_ready(f"{api_url}/health/ready")
+    return mock, api, mock_url, api_url
+
+def main():
+    """
+    Main function to parse the command line arguments and run the load test.
+    """
+    parser = argparse.ArgumentParser(description="Load test the API against a local mock inference server.")
+    parser.add_argument("--corpus", default=".cache/benchmarks/corpus", help="Directory of the corpus generated by src.benchmarks.corpus")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), default=["original", "medium"], help="Variants of the pages to send")
+    parser.add_argument("--requests", type=int, default=200, help="Total number of requests")
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent clients")
+    parser.add_argument("--timeout", type=float, default=300, help="Number of seconds to wait for each response")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean number of seconds of a call to the mock inference server")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Standard deviation of the number of seconds of a call to the mock inference server")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of the calls to the mock inference server that fail")
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache and the template store enabled")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes of the API")
+    parser.add_argument("--url", help="URL of an API that is already running, instead of starting the API and the mock server")
+    parser.add_argument("--output", help="Path to write the report to as JSON")
+    args = parser.parse_args()
+
+    pages = [html_content.encode("utf-8") for _, html_content in load_corpus(args.corpus, args.variants)]
+    mock = api = mock_url = None
+    api_url = args.url
+    if api_url is None:
+        mock, api, mock_url, api_url = start_servers(args.latency, args.jitter, args.error_rate, args.cache, args.workers)
+    try:
+        report = run_load(f"{api_url.rstrip('/')}/extract-attributes-and-selectors/", pages, args.requests, args.concurrency, args.timeout)
+        if api is not None:
+            # With several workers, the peak of the largest worker is reported
+            pids = [api.pid] + get_child_pids(api.pid)
+            report["peak_rss_mb"] = max((rss for rss in map(get_peak_rss, pids) if rss is not None), default=None)
+            with urllib.request.urlopen(f"{mock_url}/stats") as response:
+                report["model_calls"] = json.load(response)["calls"]
+    finally:
+        for process in (api, mock):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from src.benchmarks.corpus import VARIANTS, load_corpus
+from src.benchmarks.mock_inference import build_arguments
+from src.extractors.extract_selectors import ExtractSelectors
+from src.extractors.extract_structured_data import ExtractStructuredData
+from src.utils.utils import MergeAttributesAndSelectors, CleanHTML, ParsedHTML
+
+STAGES = ("parse", "structured_data", "clean", "selectors", "merge")
+
+def benchmark_page(html_content, repeat, token_budget):
+    """
+    Times each CPU bound stage of the extraction of a page.
+
+    Args:
+    html_content (str): The raw HTML content.
+    repeat (int): The number of times each stage is run.
+    token_budget (int): The maximum number of tokens of the cleaned HTML content.
+
+    Returns:
+    dict: The durations of the runs of each stage, in seconds.
+    """
+    durations = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        document = ParsedHTML(html_content)
+        durations["parse"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        ExtractStructuredData(document).extract_structured_data()
+        durations["structured_data"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        cleaned_html = CleanHTML(document, token_budget=token_budget).cleaned_html
+        durations["clean"].append(time.perf_counter() - start)
+
+        # The attributes the language model would return for the cleaned page
+        attributes = build_arguments([{"role": "user", "content": cleaned_html}], None)
+
+        start = time.perf_counter()
+        selectors = ExtractSelectors(document, attributes).extract_selectors()
+        durations["selectors"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        MergeAttributesAndSelectors(attributes, selectors)
+        durations["merge"].append(time.perf_counter() - start)
+    return durations
+
+def run_microbenchmarks(corpus_dir, variants=None, repeat=5, token_budget=6000):
+    """
+    Runs the microbenchmarks on the pages of a corpus.
+
+    Args:
+    corpus_dir (str): The directory of the corpus.
+    variants (list, optional): The names of the variants to benchmark. If not provided, all the pages are benchmarked.
+    repeat (int): The number of times each stage is run on each page.
+    token_budget (int): The maximum number of tokens of the cleaned HTML content.
+
+    Returns:
+    dict: The median and minimum duration of each stage, in milliseconds, by page.
+    """
+    results = {}
+    for entry, html_content in load_corpus(corpus_dir, variants):
+        # Warm up the caches of the allocator and of the interpreter before timing
+        benchmark_page(html_content, 1, token_budget)
+        durations = benchmark_page(html_content, repeat, token_budget)
+        results[entry["file"]] = {
+            "bytes": entry["bytes"],
+            **{stage: {"median_ms": statistics.median(values) * 1000, "min_ms": min(values) * 1000} for stage, values in durations.items()},
+        }
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the results with a baseline run.
+
+    Args:
+    results (dict): The results of the run.
+    baseline (dict): The results of the baseline run.
+    tolerance (float): The relative slowdown of the minimum duration above which a stage is reported as a regression.
+
+    Returns:
+    list: A description of each regression.
+    """
+    regressions = []
+    for page, stages in results.items():
+        for stage in STAGES:
+            # The minimum duration is the least affected by the other processes of the machine
+            before = baseline.get(page, {}).get(stage, {}).get("min_ms")
+            after = stages[stage]["min_ms"]
+            # Durations under a millisecond are mostly noise
+            if before and after > 1 and after > before * (1 + tolerance):
+                regressions.append(f"{page} {stage}: {before:.1f} ms -> {after:.1f} ms (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+def main():
+    """
+    Main function to parse the command line arguments and run the microbenchmarks.
+    """
+    parser = argparse.ArgumentParser(description="Time CleanHTML, ExtractSelectors and MergeAttributesAndSelectors on a benchmark corpus.")
+    parser.add_argument("--corpus", default=".cache/benchmarks/corpus", help="Directory of the corpus generated by src.benchmarks.corpus")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), help="Variants to benchmark, defaults to all of them")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of times each stage is run on each page")
+    parser.add_argument("--token-budget", type=int, default=6000, help="Maximum number of tokens of the cleaned HTML content")
+    parser.add_argument("--output", help="Path to write the results to as JSON, to be used as the baseline of a later run")
+    parser.add_argument("--baseline", help="Path of the results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = run_microbenchmarks(args.corpus, args.variants, args.repeat, args.token_budget)
+    print(f"{'page':<32}{'MB':>7}" + "".join(f"{stage:>17}" for stage in STAGES))
+    for page, stages in results.items():
+        print(f"{page:<32}{stages['bytes'] / 1e6:>7.2f}" + "".join(f"{stages[stage]['median_ms']:>14.1f} ms" for stage in STAGES))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(json.dumps(results, indent=4))
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import html
+import json
+import random
+import re
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+from huggingface_hub import ChatCompletionOutput
+import uvicorn
+
+name_pattern = re.compile(r"<h1[^>]*>\s*([^<]+?)\s*<", re.IGNORECASE)
+title_pattern = re.compile(r"<title[^>]*>\s*([^<]+?)\s*<", re.IGNORECASE)
+price_pattern = re.compile(r"(?:Rs\.?|NPR|USD|EUR|\$|€|£)\s?\d[\d,]*(?:\.\d+)?")
+paragraph_pattern = re.compile(r"<p[^>]*>\s*([^<]{30,}?)\s*<", re.IGNORECASE)
+image_pattern = re.compile(r"<img[^>]*\bsrc=\"([^\"]+)\"", re.IGNORECASE)
+
+def build_arguments(messages, tools):
+    """
+    Builds the arguments of an `extract_ecommerce_attributes` tool call from the HTML content of the prompt.
+    The values are read from the page with regular expressions, so the selectors can be found for them.
+
+    Args:
+    messages (list): The messages sent to the language model.
+    tools (list): The tools sent to the language model.
+
+    Returns:
+    dict: The arguments of the tool call, for the fields of the tool schema.
+    """
+    content = messages[-1]["content"] if messages else ""
+    name = name_pattern.search(content) or title_pattern.search(content)
+    price = price_pattern.search(content)
+    description = paragraph_pattern.search(content)
+    values = {
+        "product_name": html.unescape(name.group(1)) if name else "None",
+        "product_price": html.unescape(price.group(0)) if price else "None",
+        "product_description": html.unescape(description.group(1)) if description else "None",
+        "product_images": [html.unescape(source) for source in image_pattern.findall(content)[:5]],
+        "product_category": "None",
+        "brand_name": "None",
+    }
+    fields = tools[0]["function"]["parameters"]["properties"] if tools else values
+    return {field: values.get(field, "None") for field in fields}
+
+def build_response(messages, tools, model):
+    """
+    Builds a chat completion response in the format of the Inference API, with a tool call holding the attributes.
+
+    Args:
+    messages (list): The messages sent to the language model.
+    tools (list): The tools sent to the language model.
+    model (str): The model ID of the request.
+
+    Returns:
+    dict: The chat completion response.
+    """
+    arguments = json.dumps(build_arguments(messages, tools))
+    # Roughly 4 characters per token, like the token budget of the prompt
+    prompt_tokens = sum(len(message["content"]) for message in messages) // 4 + len(json.dumps(tools or [])) // 4
+    completion_tokens = len(arguments) // 4
+    return {
+        "id": f"mock-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model or "mock",
+        "system_fingerprint": "mock",
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "logprobs": None,
+            "message": {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": "0",
+                    "type": "function",
+                    "function": {"name": "extract_ecommerce_attributes", "arguments": arguments, "description": None},
+                }],
+            },
+        }],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+class MockInferenceClient:
+    """
+    MockInferenceClient is a class designed to stand in for the AsyncInferenceClient in benchmarks.
+    It answers `chat_completion` requests with valid tool calls after a configurable latency, without any network.
+    """
+
+    def __init__(self, latency=0.5, jitter=0.1, error_rate=0.0, seed=0):
+        """
+        Initializes the MockInferenceClient class.
+
+        Args:
+            latency (float): The mean number of seconds of a call.
+            jitter (float): The standard deviation of the number of seconds of a call.
+            error_rate (float): The fraction of the calls that fail.
+            seed (int): The seed of the random number generator.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.generator = random.Random(seed)
+        self.calls = 0
+
+    def get_delay(self):
+        """
+        Draws the latency of a call.
+
+        Returns:
+            float: The number of seconds of the call.
+        """
+        return max(0.0, self.generator.gauss(self.latency, self.jitter))
+
+    async def chat_completion(self, model=None, messages=None, tools=None, **parameters):
+        """
+        Answers a chat completion request after the configured latency.
+
+        Args:
+            model (str, optional): The model ID.
+            messages (list): The messages of the request.
+            tools (list, optional): The tools of the request.
+            **parameters: The sampling parameters, which are ignored.
+
+        Returns:
+            ChatCompletionOutput: The response with the tool call.
+
+        Raises:
+            Exception: If the call is drawn to fail.
+        """
+        self.calls += 1
+        await asyncio.sleep(self.get_delay())
+        if self.generator.random() < self.error_rate:
+            raise Exception("Mock inference error")
+        return ChatCompletionOutput.parse_obj_as_instance(build_response(messages or [], tools, model))
+
+    async def close(self):
+        """
+        Closes the client. There is nothing to release.
+        """
+
+app = FastAPI()
+app.state.client = MockInferenceClient()
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """
+    Endpoint compatible with the chat completion API of the Inference API, so the real client can be pointed at it.
+
+    Args:
+        request (Request): The incoming HTTP request containing the chat completion request.
+
+    Returns:
+        dict: The chat completion response.
+
+    Raises:
+        HTTPException: If the call is drawn to fail.
+    """
+    body = await request.json()
+    client = request.app.state.client
+    client.calls += 1
+    await asyncio.sleep(client.get_delay())
+    if client.generator.random() < client.error_rate:
+        raise HTTPException(status_code=503, detail="Mock inference error")
+    return build_response(body.get("messages", []), body.get("tools"), body.get("model"))
+
+@app.get("/stats")
+async def stats(request: Request):
+    """
+    Endpoint to read the number of calls received by the mock server.
+
+    Args:
+        request (Request): The incoming HTTP request.
+
+    Returns:
+        dict: The number of calls.
+    """
+    return {"calls": request.app.state.client.calls}
+
+def main():
+    """
+    Main function to parse the command line arguments and run the mock inference server.
+    """
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the chat completion API of the Inference API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("--port", type=int, default=8001, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean number of seconds of a call")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Standard deviation of the number of seconds of a call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of the calls that fail with a 503")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random number generator")
+    args = parser.parse_args()
+
+    app.state.client = MockInferenceClient(args.latency, args.jitter, args.error_rate, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
-from huggingface_hub import InferenceClient
+from huggingface_hub import AsyncInferenceClient, InferenceClient
 from dotenv import load_dotenv
+import hashlib
+import json
 import os
 from pprint import pprint
 from src.utils.utils import CheckHTMLContent, CleanHTML
@@ -11,18 +13,55 @@ class ExtractAttributes:
     extracting relevant product details such as name, price, description, images, category, and brand.
     """
 
-    def __init__(self, html_content):
+    model_id = "meta-llama/Llama-3.1-8B-Instruct"
+    timeout = 120
+    fields = ["product_name", "product_price", "product_description", "product_images", "product_category", "brand_name"]
+    generation_parameters = {
+        "tool_choice": "auto",
+        "max_tokens": 1000,
+        "temperature": 0.0,
+        "top_p": 0.9,
+    }
+    # Completion tokens of the tool call itself and of each attribute, so the completion budget scales with the
+    # requested attributes and adds up to `max_tokens` when all of them are requested
+    base_max_tokens = 56
+    field_max_tokens = {
+        "product_name": 64,
+        "product_price": 32,
+        "product_description": 384,
+        "product_images": 400,
+        "product_category": 32,
+        "brand_name": 32,
+    }
+    field_names = {
+        "product_name": "product name",
+        "product_price": "product price",
+        "product_description": "product description",
+        "product_images": "product images",
+        "product_category": "product category",
+        "brand_name": "brand name",
+    }
+    # Instructions of the system prompt that only apply when the attribute is requested
+    field_instructions = {
+        "product_description": "If product description is missing, generate description of the product by inferring from other attributes. "
+                               "The description should be meaningful and relevant to the product.",
+        "product_category": "If product category is missing, infer it from other attributes.",
+        "brand_name": "If brand name is missing, try to generate brand name from the product name.",
+    }
+
+    def __init__(self, html_content, client=None, fields=None):
         """
         Initializes the ExtractAttributes class with the provided HTML content.
         
         Args:
             html_content (str): The HTML content from which to extract product attributes.
+            client (InferenceClient | AsyncInferenceClient, optional): A shared client to send the request with.
+                If not provided, a new synchronous InferenceClient is created.
+            fields (list, optional): The attributes to extract. If not provided, all the attributes are extracted.
+                The tool schema, the system prompt and the completion budget only cover the requested attributes.
         """
-        # Load environment variables
-        load_dotenv()
-        self.HF_TOKEN = os.getenv("HF_TOKEN")
         self.html_content = html_content
-        self.model_id = "meta-llama/Llama-3.1-8B-Instruct"
+        self.fields = [field for field in ExtractAttributes.fields if field in fields] if fields else list(ExtractAttributes.fields)
         self.tools = [
             {
                 "type": "function",
@@ -60,12 +99,16 @@ class ExtractAttributes:
                                 "description": "The name of the brand which produced the product"
                             }
                         },
-                        "required": ["product_name", "product_price", "product_description", "product_images", "product_category", "brand_name"]
+                        "required": list(self.fields)
                     }
                 }
             }
         ]
-        self.client = self.get_client()
+        # Only ask the language model for the requested attributes
+        properties = self.tools[0]["function"]["parameters"]["properties"]
+        self.tools[0]["function"]["parameters"]["properties"] = {field: properties[field] for field in self.fields}
+        self.generation_parameters = {**ExtractAttributes.generation_parameters, "max_tokens": self.get_max_tokens()}
+        self.client = client if client is not None else self.get_client()
         self.messages = self.setup_messages()
 
     def get_client(self):
@@ -75,32 +118,81 @@ class ExtractAttributes:
         Returns:
             InferenceClient: An instance of the InferenceClient configured with the model and token.
         """
+        # Load environment variables
+        load_dotenv()
         return InferenceClient(
             model=self.model_id,
-            timeout=120,
-            token=self.HF_TOKEN
+            timeout=self.timeout,
+            token=os.getenv("HF_TOKEN")
+        )
+
+    @classmethod
+    def get_async_client(cls, base_url=None, token=None):
+        """
+        Initializes an AsyncInferenceClient with the specified model ID and token.
+        The client keeps its connection pool open, so it is meant to be created once and shared across requests.
+        If `INFERENCE_BASE_URL` is set, the requests are sent to that endpoint instead of the Inference API.
+
+        Args:
+            base_url (str, optional): The endpoint to send the requests to. Defaults to `INFERENCE_BASE_URL`.
+            token (str, optional): The token to authenticate with. Defaults to `HF_TOKEN`.
+        
+        Returns:
+            AsyncInferenceClient: An instance of the AsyncInferenceClient configured with the model and token.
+        """
+        # Load environment variables
+        load_dotenv()
+        return AsyncInferenceClient(
+            model=base_url or os.getenv("INFERENCE_BASE_URL") or cls.model_id,
+            timeout=cls.timeout,
+            token=token or os.getenv("HF_TOKEN")
         )
 
+    @classmethod
+    def get_async_clients(cls):
+        """
+        Initializes one AsyncInferenceClient per inference backend, to spread the requests across several endpoints
+        or tokens. `INFERENCE_BASE_URL` and `HF_TOKEN` may hold comma-separated lists, and a client is created for
+        every pair of endpoint and token.
+
+        Returns:
+            list: The AsyncInferenceClient of each backend.
+        """
+        # Load environment variables
+        load_dotenv()
+        base_urls = [url.strip() for url in os.getenv("INFERENCE_BASE_URL", "").split(",") if url.strip()] or [None]
+        tokens = [token.strip() for token in os.getenv("HF_TOKEN", "").split(",") if token.strip()] or [None]
+        return [cls.get_async_client(base_url or cls.model_id, token) for base_url in base_urls for token in tokens]
+
+    def get_max_tokens(self):
+        """
+        Computes the completion budget for the requested attributes.
+
+        Returns:
+            int: The maximum number of tokens of the completion.
+        """
+        return self.base_max_tokens + sum(self.field_max_tokens[field] for field in self.fields)
+
     def setup_messages(self):
         """
         Sets up the messages to be sent to the language model, including system instructions and user input.
+        The system instructions only mention the requested attributes.
         
         Returns:
             list: A list of message dictionaries containing the roles and content for the language model.
         """
+        instructions = [
+            "You are an expert in analyzing and parsing HTML content.",
+            "Your expertise lies in identifying and extracting meaningful attributes relevant to e-commerce contexts.",
+            f"You should extract the following attributes from the HTML content: {', '.join(self.field_names[field] for field in self.fields)}.",
+            "If the attribute is present, it should be extracted as it is without any modification.",
+            *(self.field_instructions[field] for field in self.fields if field in self.field_instructions),
+            "If attributes cannot be generated or inferred then generate 'None' for the missing attributes.",
+        ]
         return [
             {
                 "role": "system",
-                "content": "You are an expert in analyzing and parsing HTML content. \
-                            Your expertise lies in identifying and extracting meaningful attributes relevant to e-commerce contexts.\
-                            You should be able to extract attributes such as product name, product price, product description, \
-                            product images, product category, brand name, etc. from the HTML content. \
-                            If the attribute is present, it should be extracted  as it is without any modification. \
-                            If product description is missing, generate description of the product by inferring from other attributes. \
-                            The description should be meaningful and relevant to the product. \
-                            If product category is missing, infer it from other attributes. \
-                            If brand name is missing, try to generate brand name from the product name. \
-                            If attributes cannot be generated or inferred then generate 'None' for the missing attributes.",
+                "content": " ".join(instructions),
             },
             {
                 "role": "user",
@@ -108,6 +200,38 @@ class ExtractAttributes:
             },
         ]
 
+    def get_cache_key(self):
+        """
+        Generates a key identifying the request to the language model, built from a hash of the messages,
+        which contain the cleaned HTML content, the model ID, the requested attributes, the tool schema and
+        the sampling parameters.
+        
+        Returns:
+            str: The hex digest identifying the request.
+        """
+        payload = json.dumps({
+            "model": self.model_id,
+            "fields": self.fields,
+            "messages": self.messages,
+            "tools": self.tools,
+            "parameters": self.generation_parameters,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_attributes(response):
+        """
+        Reads the extracted attributes from the tool call of the language model response.
+        
+        Args:
+            response (dict): The response from the language model.
+        
+        Returns:
+            dict: The extracted attributes.
+        """
+        attributes = response.choices[0].message.tool_calls[0].function.arguments
+        return json.loads(attributes) if isinstance(attributes, str) else attributes
+
     def get_response(self):
         """
         Sends a request to the language model to analyze and parse the HTML content and extract e-commerce attributes.
@@ -123,14 +247,35 @@ class ExtractAttributes:
                 model=self.model_id,
                 messages=self.messages,
                 tools=self.tools,
-                tool_choice="auto",
-                max_tokens=1000,
-                temperature=0.0,
-                top_p=0.9,
+                **self.generation_parameters,
             )
         except Exception as e:
             raise Exception(f"An error occurred while extracting attributes from the HTML content: {str(e)}")
 
+    async def get_response_async(self, client=None):
+        """
+        Sends a request to the language model without blocking the event loop. Requires the class to be
+        initialized with an AsyncInferenceClient, unless another client is given.
+
+        Args:
+            client (AsyncInferenceClient, optional): The client to send the request with, instead of the one of the class.
+        
+        Returns:
+            dict: The response from the language model containing the extracted attributes.
+        
+        Raises:
+            Exception: If an error occurs during the request to the language model. The error of the client is kept as its cause.
+        """
+        try:
+            return await (client or self.client).chat_completion(
+                model=self.model_id,
+                messages=self.messages,
+                tools=self.tools,
+                **self.generation_parameters,
+            )
+        except Exception as e:
+            raise Exception(f"An error occurred while extracting attributes from the HTML content: {str(e)}") from e
+
 def main():
     """
     Main function to read HTML content from a file, create an instance of ExtractAttributes, and extract e-commerce attributes.
@@ -1,13 +1,367 @@
-from bs4 import BeautifulSoup
-from lxml import etree
+import html
+import re
+import unicodedata
 from pprint import pprint
 from src.extractors.extract_attributes import ExtractAttributes
-from src.utils.utils import CheckHTMLContent, CleanHTML
+from src.utils.utils import CheckHTMLContent, CleanHTML, ParsedHTML
+
+class SelectorIndex:
+    """
+    SelectorIndex is a class designed to index the elements of an lxml tree in a single traversal.
+    It maps the normalized text and the `src`/`srcset` URLs of the page to their elements, and records the
+    CSS and XPath step of every element during the same walk, so selectors are built without rescanning the tree.
+    Values that are not found as they are, because the language model collapsed whitespace, decoded entities, changed
+    the case or returned text split over several elements, are matched in stages against a second index of the
+    canonical texts and tokens of the elements, which is only built the first time it is needed. Each match has a
+    confidence that decreases with the stage it was found at.
+    """
+
+    whitespace_pattern = re.compile(r"\s+")
+    token_pattern = re.compile(r"\w+")
+    url_scheme_pattern = re.compile(r"^(?:https?:)?//", re.IGNORECASE)
+    # Confidence of the matches of each stage of the lookup
+    exact_confidence = 1.0
+    normalized_confidence = 0.95
+    concatenated_confidence = 0.9
+    fuzzy_confidence = 0.85
+    # Minimum token overlap score of a fuzzy match. Lower scores mostly pair a paraphrased value with an element that
+    # only shares some of its words, such as the name of the product for its description
+    min_fuzzy_score = 0.8
+    # Elements whose text, including the text of their descendants, is longer are only indexed by their own text nodes,
+    # which keeps the index linear in the size of the page
+    max_concatenated_chars = 256
+    # Tokens found in more elements are too common to find candidates with
+    max_postings = 512
+    max_candidates = 3
+
+    def __init__(self, tree):
+        """
+        Initializes the SelectorIndex class and indexes the provided tree.
+
+        Args:
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+        """
+        self.parents = []
+        self.elements = []
+        # The text of each element and the tails of its children in order, None standing for the text of a child element
+        self.segments = []
+        self.css_components = []
+        self.xpath_components = []
+        self.text_index = {}
+        self.source_index = {}
+        # The indexes of the lookup stages after the exact one, built on the first value that is not found as it is
+        self.canonical_index = None
+        self.concatenated_index = None
+        self.canonical_source_index = None
+        self.token_entries = None
+        self.token_postings = None
+        if tree is not None:
+            self.build_index(tree)
+
+    @classmethod
+    def normalize(cls, text):
+        """
+        Normalizes a text by collapsing its runs of whitespace and stripping it.
+
+        Args:
+            text (str): The text to normalize.
+
+        Returns:
+            str: The normalized text.
+        """
+        return cls.whitespace_pattern.sub(" ", text).strip()
+
+    @classmethod
+    def tokenize(cls, text):
+        """
+        Splits a text into canonical tokens: entities are decoded, compatibility characters are replaced by their
+        plain equivalent, such as the rupee sign by "Rs", the case is folded and punctuation is dropped.
+
+        Args:
+            text (str): The text to tokenize.
+
+        Returns:
+            list: The tokens of the text.
+        """
+        if "&" in text:
+            text = html.unescape(text)
+        if not text.isascii():
+            text = unicodedata.normalize("NFKC", text)
+        return cls.token_pattern.findall(text.casefold())
+
+    @classmethod
+    def canonicalize_url(cls, url):
+        """
+        Normalizes a URL by decoding its entities and dropping its scheme, so protocol-relative URLs match.
+
+        Args:
+            url (str): The URL to normalize.
+
+        Returns:
+            str: The normalized URL.
+        """
+        return cls.url_scheme_pattern.sub("", html.unescape(url.strip()))
+
+    def build_index(self, tree):
+        """
+        Walks the tree once in document order, recording the selector steps of every element and indexing
+        its text nodes and image URLs. Only the first element is kept for a given text or URL.
+
+        Args:
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+        """
+        # Each entry holds the element, the node of its parent and its CSS and XPath steps
+        stack = [(tree, -1, tree.tag, f"{tree.tag}[1]")]
+        while stack:
+            element, parent, css_component, xpath_component = stack.pop()
+            node = len(self.parents)
+            self.parents.append(parent)
+            self.elements.append(element)
+            self.css_components.append(css_component)
+            self.xpath_components.append(xpath_component)
+
+            segments = [element.text or ""]
+            for child in element:
+                if isinstance(child.tag, str):
+                    segments.append(None)
+                segments.append(child.tail or "")
+            self.segments.append(segments)
+            for text in segments:
+                if text and text.strip():
+                    self.text_index.setdefault(self.normalize(text), node)
+            source = element.get("src")
+            if source:
+                self.source_index.setdefault(source, node)
+            for candidate in (element.get("srcset") or "").split(","):
+                if candidate.strip():
+                    self.source_index.setdefault(candidate.split()[0], node)
+
+            # Positions among the siblings of the same type are counted once per parent
+            children = [child for child in element if isinstance(child.tag, str)]
+            counts = {}
+            for child in children:
+                counts[child.tag] = counts.get(child.tag, 0) + 1
+            positions = {}
+            entries = []
+            for index, child in enumerate(element):
+                if not isinstance(child.tag, str):
+                    continue
+                positions[child.tag] = positions.get(child.tag, 0) + 1
+                if counts[child.tag] > 1:
+                    css_step = f"{child.tag}:nth-of-type({positions[child.tag]})"
+                else:
+                    css_step = child.tag
+                entries.append((child, node, css_step, f"{child.tag}[{index + 1}]"))
+            stack.extend(reversed(entries))
+
+    def add_token_entry(self, node, tokens):
+        """
+        Adds the tokens of a text of an element to the token index.
+
+        Args:
+            node (int): The node of the element.
+            tokens (list): The canonical tokens of the text.
+        """
+        entry = len(self.token_entries)
+        self.token_entries.append((node, frozenset(tokens)))
+        for token in self.token_entries[-1][1]:
+            self.token_postings.setdefault(token, []).append(entry)
+
+    def is_ancestor(self, node, other):
+        """
+        Checks whether an element is an ancestor of another one.
+
+        Args:
+            node (int): The node of the element.
+            other (int): The node of the other element, or None.
+
+        Returns:
+            bool: True if the element is an ancestor of the other one, False otherwise.
+        """
+        while other is not None and other > node:
+            other = self.parents[other]
+        return other == node
+
+    def build_fuzzy_index(self):
+        """
+        Indexes the canonical text nodes of the elements, the concatenated text of the elements whose text is split over
+        their descendants, the tokens of both and the normalized image URLs. The nodes are visited in reverse document
+        order, so the text of the children of an element is known when the element is visited, and the deepest element
+        is kept for a given concatenated text rather than the elements wrapping it.
+        """
+        self.canonical_index, self.concatenated_index, self.canonical_source_index = {}, {}, {}
+        self.token_entries, self.token_postings = [], {}
+        children = [[] for _ in self.parents]
+        for node, parent in enumerate(self.parents):
+            if parent != -1:
+                children[parent].append(node)
+        concatenated = [None] * len(self.parents)
+        for node in range(len(self.parents) - 1, -1, -1):
+            parts = []
+            child_nodes = iter(children[node])
+            # The concatenated text of an element only differs from its own text if its descendants hold text
+            nested = False
+            for segment in self.segments[node]:
+                if segment is None:
+                    segment = concatenated[next(child_nodes)]
+                    if segment is None:
+                        break
+                    nested = nested or bool(segment.strip())
+                parts.append(segment)
+            else:
+                text = "".join(parts)
+                if len(text) <= self.max_concatenated_chars:
+                    concatenated[node] = text
+
+            for text in self.segments[node]:
+                if text and text.strip():
+                    tokens = self.tokenize(text)
+                    if tokens:
+                        self.canonical_index[" ".join(tokens)] = node
+                        self.add_token_entry(node, tokens)
+            if concatenated[node] is not None and nested:
+                tokens = self.tokenize(concatenated[node])
+                key = " ".join(tokens)
+                if tokens and key not in self.canonical_index and not self.is_ancestor(node, self.concatenated_index.get(key)):
+                    self.concatenated_index[key] = node
+                    self.add_token_entry(node, tokens)
+            get = self.elements[node].get
+            for name in ("src", "data-src"):
+                if get(name):
+                    self.canonical_source_index[self.canonicalize_url(get(name))] = node
+            for name in ("srcset", "data-srcset"):
+                for candidate in (get(name) or "").split(","):
+                    if candidate.strip():
+                        self.canonical_source_index[self.canonicalize_url(candidate.split()[0])] = node
+
+    def find_text(self, value):
+        """
+        Finds the first element with a text node equal to the value, ignoring differences in whitespace.
+
+        Args:
+            value (str): The text to look for.
+
+        Returns:
+            int: The node of the element, or None if no element matches.
+        """
+        return self.text_index.get(self.normalize(value))
+
+    def find_source(self, value):
+        """
+        Finds the first element with the value as its `src` or as one of the URLs of its `srcset`.
+
+        Args:
+            value (str): The URL to look for.
+
+        Returns:
+            int: The node of the element, or None if no element matches.
+        """
+        return self.source_index.get(value)
+
+    def rank_text(self, value):
+        """
+        Finds the elements matching a text value, in stages: its text node equal to the value ignoring whitespace,
+        then its canonical text node or the canonical text of its descendants equal to the canonical value, then the
+        elements sharing the most tokens with the value, scored by the harmonic mean of the share of the tokens
+        of the value they hold and the share of their tokens that are in the value.
+
+        Args:
+            value (str): The text to look for.
+
+        Returns:
+            list: The nodes of the best elements and the confidence of their match, best first. Empty if no element matches.
+        """
+        node = self.find_text(value)
+        if node is not None:
+            return [(node, self.exact_confidence)]
+        if self.token_entries is None:
+            self.build_fuzzy_index()
+        tokens = self.tokenize(value)
+        if not tokens:
+            return []
+        key = " ".join(tokens)
+        if key in self.canonical_index:
+            return [(self.canonical_index[key], self.normalized_confidence)]
+        if key in self.concatenated_index:
+            return [(self.concatenated_index[key], self.concatenated_confidence)]
+
+        value_tokens = set(tokens)
+        overlaps = {}
+        for token in value_tokens:
+            postings = self.token_postings.get(token, ())
+            if len(postings) > self.max_postings:
+                continue
+            for entry in postings:
+                overlaps[entry] = overlaps.get(entry, 0) + 1
+        scores = {}
+        for entry, overlap in overlaps.items():
+            node, entry_tokens = self.token_entries[entry]
+            recall, precision = overlap / len(value_tokens), overlap / len(entry_tokens)
+            score = 2 * recall * precision / (recall + precision)
+            # The first element in document order is kept on ties, as with the exact matches
+            if score >= self.min_fuzzy_score and score > scores.get(node, (0, 0))[0]:
+                scores[node] = (score, -node)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:self.max_candidates]
+        return [(node, round(self.fuzzy_confidence * score, 3)) for node, (score, _) in ranked]
+
+    def rank_source(self, value):
+        """
+        Finds the element of an image URL: its `src` or one of the URLs of its `srcset` equal to the value, then
+        equal to the value once both are normalized, including the lazy loading `data-src` and `data-srcset` attributes.
+
+        Args:
+            value (str): The URL to look for.
+
+        Returns:
+            list: The node of the element and the confidence of the match, or an empty list if no element matches.
+        """
+        node = self.find_source(value)
+        if node is not None:
+            return [(node, self.exact_confidence)]
+        if self.token_entries is None:
+            self.build_fuzzy_index()
+        node = self.canonical_source_index.get(self.canonicalize_url(value))
+        return [(node, self.normalized_confidence)] if node is not None else []
+
+    def get_css_selector(self, node):
+        """
+        Generates a CSS selector for an indexed element.
+
+        Args:
+            node (int): The node of the element.
+
+        Returns:
+            str: The CSS selector for the element.
+        """
+        components = []
+        while node != -1:
+            components.append(self.css_components[node])
+            node = self.parents[node]
+        components.reverse()
+        return " > ".join(components)
+
+    def get_xpath(self, node):
+        """
+        Generates an XPath for an indexed element.
+
+        Args:
+            node (int): The node of the element.
+
+        Returns:
+            str: The XPath for the element.
+        """
+        components = []
+        while node != -1:
+            components.append(self.xpath_components[node])
+            node = self.parents[node]
+        components.reverse()
+        return "/" + "/".join(components)
 
 class ExtractSelectors:
     """
     ExtractSelectors is a class designed to extract CSS selectors and XPaths for given attributes
-    from HTML content. It utilizes BeautifulSoup for CSS selectors and lxml for XPaths.
+    from HTML content. Both are generated from a single index of the lxml tree, with the confidence of the match
+    of the value of the attribute.
     """
 
     def __init__(self, html_content, attributes):
@@ -15,55 +369,35 @@ class ExtractSelectors:
         Initializes the ExtractSelectors class with the provided HTML content and attributes.
         
         Args:
-            html_content (str): The HTML content from which to extract selectors.
+            html_content (str | ParsedHTML): The HTML content, or the already parsed HTML content, from which to extract selectors.
             attributes (dict): The attributes for which to extract selectors.
         """
-        self.html_content = html_content
+        self.document = html_content if isinstance(html_content, ParsedHTML) else ParsedHTML(html_content)
+        self.html_content = self.document.html_content
         self.attributes = attributes
-        self.soup = BeautifulSoup(html_content, 'html.parser')
-        self.tree = etree.HTML(html_content)
+        self.tree = self.document.tree
+        self.index = SelectorIndex(self.tree)
 
-    def get_css_selector(self, element):
+    def get_selectors(self, matches):
         """
-        Generates a CSS selector for a given BeautifulSoup element.
+        Generates the CSS selector and the XPath of the best element matching a value, along with the confidence
+        of the match and the other candidate elements.
         
         Args:
-            element (bs4.element.Tag): The BeautifulSoup element for which to generate a CSS selector.
+            matches (list): The nodes of the matching elements and the confidence of their match, best first.
         
         Returns:
-            str: The CSS selector for the given element.
+            dict: The CSS selector, the XPath and the confidence of the best element, and the `candidates` ranked after it if any.
         """
-        components = []
-        while element.parent is not None:
-            siblings = element.parent.find_all(element.name, recursive=False)
-            if len(siblings) > 1:
-                components.append(f'{element.name}:nth-of-type({siblings.index(element) + 1})')
-            else:
-                components.append(element.name)
-            element = element.parent
-        components.reverse()
-        return " > ".join(filter(None, components))
-
-    def get_xpath(self, element):
-        """
-        Generates an XPath for a given lxml element.
-        
-        Args:
-            element (lxml.etree.Element): The lxml element for which to generate an XPath.
-        
-        Returns:
-            str: The XPath for the given element.
-        """
-        path = []
-        while element is not None:
-            siblings = list(element.itersiblings(preceding=True))
-            index = len(siblings) + 1
-            tag = element.tag
-            if tag is not None:
-                path.append(f"{tag}[{index}]")
-            element = element.getparent()
-        path.reverse()
-        return '/' + '/'.join(filter(None, path))
+        if not matches:
+            return {"css_selector": "No CSS Selector Found", "xpath": "No XPath Found", "confidence": 0.0}
+        selectors = [
+            {"css_selector": self.index.get_css_selector(node), "xpath": self.index.get_xpath(node), "confidence": confidence}
+            for node, confidence in matches
+        ]
+        if len(selectors) > 1:
+            selectors[0]["candidates"] = selectors[1:]
+        return selectors[0]
 
     def extract_selectors(self):
         """
@@ -76,33 +410,11 @@ class ExtractSelectors:
         for key, value in self.attributes.items():
             if value != "None":
                 if isinstance(value, list):
-                    selectors[key] = []
-                    for item in value:
-                        element = self.soup.find(lambda tag: tag.has_attr('src') and tag['src'] == item)
-                        if element:
-                            css_selector = self.get_css_selector(element)
-                            xpath_elements = self.tree.xpath(f"//*[@src='{item}']")
-                            if xpath_elements:
-                                xpath = self.get_xpath(xpath_elements[0])
-                            else:
-                                xpath = "inferred"
-                            selectors[key].append({"css_selector": css_selector, "xpath": xpath})
-                        else:
-                            selectors[key].append({"css_selector": "No CSS Selector Found", "xpath": "No XPath Found"})
+                    selectors[key] = [self.get_selectors(self.index.rank_source(item)) for item in value]
                 else:
-                    element = self.soup.find(string=value)
-                    if element:
-                        css_selector = self.get_css_selector(element)
-                        xpath_elements = self.tree.xpath(f"//*[text()='{value}']")
-                        if xpath_elements:
-                            xpath = self.get_xpath(xpath_elements[0])
-                        else:
-                            xpath = "inferred"
-                        selectors[key] = {"css_selector": css_selector, "xpath": xpath}
-                    else:
-                        selectors[key] = {"css_selector": "No CSS Selector Found", "xpath": "No XPath Found"}
+                    selectors[key] = self.get_selectors(self.index.rank_text(str(value)))
             else:
-                selectors[key] = {"css_selector": "Not Found", "xpath": "Not Found"}
+                selectors[key] = {"css_selector": "Not Found", "xpath": "Not Found", "confidence": 0.0}
         return selectors
 
 def main():
@@ -118,13 +430,14 @@ def main():
         print("The provided content is not HTML")
         return
     
-    # Clean the HTML content
-    html_content = CleanHTML(html_content).cleaned_html
+    # Parse the HTML content once and clean it
+    document = ParsedHTML(html_content)
+    cleaned_html_content = CleanHTML(document).cleaned_html
 
-    attribute_extractor = ExtractAttributes(html_content)
-    attributes = attribute_extractor.get_response().choices[0].message.tool_calls[0].function.arguments
+    attribute_extractor = ExtractAttributes(cleaned_html_content)
+    attributes = ExtractAttributes.get_attributes(attribute_extractor.get_response())
 
-    selector_extractor = ExtractSelectors(html_content, attributes)
+    selector_extractor = ExtractSelectors(document, attributes)
     print("Extracting selectors from the HTML content...")
     try:
         selectors = selector_extractor.extract_selectors()
@@ -0,0 +1,338 @@
+import html
+import json
+from pprint import pprint
+from src.utils.utils import CheckHTMLContent, ParsedHTML
+
+class ExtractStructuredData:
+    """
+    ExtractStructuredData is a class designed to extract e-commerce attributes from the structured data embedded
+    in HTML content: JSON-LD Product blocks, schema.org Product microdata and OpenGraph product meta tags.
+    The attributes are mapped onto the fields of the `extract_ecommerce_attributes` schema, so the language model
+    only has to be asked for the fields that are still missing.
+    """
+
+    def __init__(self, html_content):
+        """
+        Initializes the ExtractStructuredData class with the provided HTML content.
+
+        Args:
+            html_content (str | ParsedHTML): The HTML content, or the already parsed HTML content, from which to extract the structured data.
+        """
+        self.document = html_content if isinstance(html_content, ParsedHTML) else ParsedHTML(html_content)
+        self.tree = self.document.tree
+
+    @staticmethod
+    def get_text(value):
+        """
+        Reads a text value from a JSON-LD property, which may be a string, a list or a nested object with a name.
+
+        Args:
+            value (str | list | dict): The JSON-LD property.
+
+        Returns:
+            str: The text value, or None if there is none.
+        """
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if isinstance(value, dict):
+            value = value.get("name")
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = str(value)
+        if isinstance(value, str) and value.strip():
+            # Sites often HTML-escape the strings of their JSON-LD blocks
+            return html.unescape(value.strip())
+        return None
+
+    @staticmethod
+    def get_images(value):
+        """
+        Reads the image URLs from a JSON-LD image property, which may be a string, an ImageObject or a list of them.
+
+        Args:
+            value (str | list | dict): The JSON-LD image property.
+
+        Returns:
+            list: The image URLs.
+        """
+        images = []
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, dict):
+                item = item.get("contentUrl") or item.get("url")
+            if isinstance(item, str) and item.strip() and item.strip() not in images:
+                images.append(item.strip())
+        return images
+
+    @staticmethod
+    def get_price(price, currency):
+        """
+        Formats a price with its currency.
+
+        Args:
+            price (str): The amount.
+            currency (str): The currency code.
+
+        Returns:
+            str: The formatted price, or None if there is no amount.
+        """
+        if not price:
+            return None
+        return f"{currency} {price}" if currency else price
+
+    def find_json_ld_products(self, data):
+        """
+        Finds the Product objects in a JSON-LD document, including the ones nested in lists and `@graph`.
+
+        Args:
+            data (dict | list): The JSON-LD document.
+
+        Returns:
+            list: The Product objects.
+        """
+        products = []
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(reversed(item))
+            elif isinstance(item, dict):
+                types = item.get("@type")
+                types = types if isinstance(types, list) else [types]
+                if "Product" in types:
+                    products.append(item)
+                elif "@graph" in item:
+                    stack.append(item["@graph"])
+        return products
+
+    def map_json_ld_product(self, product):
+        """
+        Maps a JSON-LD Product object onto the attribute schema.
+
+        Args:
+            product (dict): The Product object.
+
+        Returns:
+            dict: The attributes found in the Product object.
+        """
+        offers = product.get("offers")
+        offers = offers[0] if isinstance(offers, list) and offers else offers
+        offers = offers if isinstance(offers, dict) else {}
+        price = self.get_text(offers.get("price") if "price" in offers else offers.get("lowPrice"))
+        return {
+            "product_name": self.get_text(product.get("name")),
+            "product_price": self.get_price(price, self.get_text(offers.get("priceCurrency"))),
+            "product_description": self.get_text(product.get("description")),
+            "product_images": self.get_images(product.get("image")) or None,
+            "product_category": self.get_text(product.get("category")),
+            "brand_name": self.get_text(product.get("brand")),
+        }
+
+    def get_microdata_value(self, element):
+        """
+        Reads the value of a microdata property from an element.
+
+        Args:
+            element (lxml.etree.Element): The element with the `itemprop` attribute.
+
+        Returns:
+            str: The value of the property, or None if there is none.
+        """
+        for attribute in ("content", "src", "href"):
+            value = element.get(attribute)
+            if value and value.strip():
+                return value.strip()
+        return self.get_text("".join(element.itertext()))
+
+    @staticmethod
+    def get_scope(element):
+        """
+        Finds the closest microdata item scope of an element.
+
+        Args:
+            element (lxml.etree.Element): The element.
+
+        Returns:
+            lxml.etree.Element: The closest ancestor with the `itemscope` attribute, or None if there is none.
+        """
+        return next((ancestor for ancestor in element.iterancestors() if ancestor.get("itemscope") is not None), None)
+
+    @staticmethod
+    def is_product_scope(scope):
+        """
+        Checks if a microdata item scope is a schema.org Product.
+
+        Args:
+            scope (lxml.etree.Element): The element with the `itemscope` attribute.
+
+        Returns:
+            bool: True if the item is a Product, False otherwise.
+        """
+        return any(item.rstrip("/").endswith("/Product") for item in (scope.get("itemtype") or "").split())
+
+    def get_product_scope(self, scope):
+        """
+        Finds the top-level Product item a microdata item scope belongs to. Brands and offers belong to the Product
+        they are a property of, while the Products nested in another Product (related products, accessories) or
+        the items of other types do not belong to any Product.
+
+        Args:
+            scope (lxml.etree.Element): The element with the `itemscope` attribute.
+
+        Returns:
+            lxml.etree.Element: The scope of the Product, or None if the item does not belong to a top-level Product.
+        """
+        if not self.is_product_scope(scope):
+            if scope.get("itemprop") not in ("brand", "offers"):
+                return None
+            scope = self.get_scope(scope)
+            if scope is None or not self.is_product_scope(scope):
+                return None
+        parent = self.get_scope(scope)
+        while parent is not None:
+            if self.is_product_scope(parent):
+                return None
+            parent = self.get_scope(parent)
+        return scope
+
+    @staticmethod
+    def find_main_product(products, titles):
+        """
+        Finds the main product of the page among the products of its structured data, which also describe
+        the related products and the variants shown on the page. The main product is the one whose name is
+        in the title of the page, or the first one.
+
+        Args:
+            products (list): The attributes of each product, in document order.
+            titles (list): The titles of the page: its first heading and its OpenGraph title.
+
+        Returns:
+            dict: The attributes of the main product, or an empty dictionary if there is no product.
+        """
+        def normalize(text):
+            return " ".join(text.split()).casefold() if text else ""
+
+        titles = [normalize(title) for title in titles if normalize(title)]
+        for product in products:
+            name = normalize(product.get("product_name"))
+            if name and any(name in title for title in titles):
+                return product
+        return products[0] if products else {}
+
+    def extract_structured_data(self):
+        """
+        Extracts the e-commerce attributes of the main product of the page from the structured data in a single
+        pass over the tree. JSON-LD takes precedence over microdata, which takes precedence over OpenGraph.
+        The attributes of a source are only read from its main product, so the gaps of the main product are never
+        filled with the attributes of the related products.
+
+        Returns:
+            dict: The attributes found in the structured data. Missing attributes are not included.
+        """
+        json_ld_products = []
+        microdata_products = {}
+        opengraph = {}
+        opengraph_images = []
+        heading = None
+        if self.tree is None:
+            return {}
+
+        for element in self.tree.iter():
+            if not isinstance(element.tag, str):
+                continue
+            if element.tag == "script":
+                if (element.get("type") or "").strip().lower() == "application/ld+json" and element.text:
+                    try:
+                        data = json.loads(element.text)
+                    except ValueError:
+                        continue
+                    json_ld_products.extend(self.map_json_ld_product(product) for product in self.find_json_ld_products(data))
+            elif element.tag == "meta":
+                name = (element.get("property") or element.get("name") or "").strip().lower()
+                content = (element.get("content") or "").strip()
+                if name.startswith(("og:", "product:")) and content:
+                    if name in ("og:image", "og:image:url", "og:image:secure_url"):
+                        if content not in opengraph_images:
+                            opengraph_images.append(content)
+                    else:
+                        opengraph.setdefault(name, content)
+            elif element.tag == "h1" and heading is None:
+                heading = self.get_text("".join(element.itertext()))
+
+            itemprop = element.get("itemprop")
+            if not itemprop:
+                continue
+            # The property belongs to the closest item scope, which is either a product or one of its brand and offers
+            scope = self.get_scope(element)
+            product_scope = self.get_product_scope(scope) if scope is not None else None
+            if product_scope is None:
+                continue
+            product = microdata_products.setdefault(product_scope, {"properties": {}, "images": [], "offers": {}})
+            value = self.get_microdata_value(element)
+            for name in itemprop.split():
+                if scope is product_scope:
+                    if name == "image":
+                        if value and value not in product["images"]:
+                            product["images"].append(value)
+                    elif name in ("name", "description", "category"):
+                        product["properties"].setdefault(name, value)
+                    elif name == "brand" and element.get("itemscope") is None:
+                        product["properties"].setdefault("brand", value)
+                elif scope.get("itemprop") == "brand" and name == "name":
+                    product["properties"].setdefault("brand", value)
+                elif scope.get("itemprop") == "offers" and name in ("price", "lowPrice", "priceCurrency"):
+                    product["offers"].setdefault(name, value)
+
+        microdata = [
+            {
+                "product_name": product["properties"].get("name"),
+                "product_price": self.get_price(
+                    product["offers"].get("price") or product["offers"].get("lowPrice"), product["offers"].get("priceCurrency")
+                ),
+                "product_description": product["properties"].get("description"),
+                "product_images": product["images"] or None,
+                "product_category": product["properties"].get("category"),
+                "brand_name": product["properties"].get("brand"),
+            }
+            for product in microdata_products.values()
+        ]
+        titles = [heading, opengraph.get("og:title")]
+        is_product_page = opengraph.get("og:type", "").startswith("product") or any(key.startswith("product:") for key in opengraph)
+        sources = [
+            self.find_main_product(json_ld_products, titles),
+            self.find_main_product(microdata, titles),
+            {
+                "product_name": opengraph.get("og:title"),
+                "product_price": self.get_price(
+                    opengraph.get("product:price:amount") or opengraph.get("og:price:amount"),
+                    opengraph.get("product:price:currency") or opengraph.get("og:price:currency")
+                ),
+                "product_description": opengraph.get("og:description"),
+                "product_images": opengraph_images or None,
+                "product_category": opengraph.get("product:category"),
+                "brand_name": opengraph.get("product:brand"),
+            } if is_product_page else {},
+        ]
+
+        attributes = {}
+        for source in sources:
+            for key, value in source.items():
+                if value and key not in attributes:
+                    attributes[key] = value
+        return attributes
+
+def main():
+    """
+    Main function to read HTML content from a file and extract the e-commerce attributes from its structured data.
+    """
+    with open("./data/sample_1.html", "r") as file:
+        html_content = file.read()
+
+    # Check if the content is valid HTML
+    if not CheckHTMLContent(html_content).is_html:
+        print("The provided content is not HTML")
+        return
+
+    print("Extracting structured data from the HTML content...")
+    pprint(ExtractStructuredData(html_content).extract_structured_data())
+
+if __name__ == "__main__":
+    main()
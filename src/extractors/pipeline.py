@@ -0,0 +1,527 @@
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from src.extractors.extract_attributes import ExtractAttributes
+from src.extractors.extract_selectors import ExtractSelectors
+from src.extractors.extract_structured_data import ExtractStructuredData
+from src.utils.cache import ResultCache
+from src.utils.metrics import Metrics, Timings
+from src.utils.scheduler import InferenceScheduler, OverloadedError
+from src.utils.snapshots import SnapshotStore
+from src.utils.templates import TemplateStore
+from src.utils.triage import PageTriage
+from src.utils.utils import MergeAttributesAndSelectors, CleanHTML, ParsedHTML, StreamingHTMLParser
+
+class NotHTMLContentError(ValueError):
+    """
+    Raised when the provided content is not HTML.
+    """
+
+class RejectedPageError(ValueError):
+    """
+    Raised when the triage finds that the page cannot hold the attributes of a product.
+    """
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+    def __reduce__(self):
+        # Keeps the reason when the error is sent back from a worker process
+        return type(self), (str(self), self.reason)
+
+class AttributeExtractionError(Exception):
+    """
+    Raised when the language model fails to extract the attributes.
+    """
+
+class InvalidFieldsError(ValueError):
+    """
+    Raised when the requested attributes or the known attributes are not valid.
+    """
+
+class ExtractionPipeline:
+    """
+    ExtractionPipeline is a class designed to run the whole extraction of a page: validation, parsing, cleaning,
+    attribute extraction with the language model and selector extraction. It holds the resources shared by
+    all requests: the async inference clients, the scheduler of the requests to the language model, the result cache,
+    the template store, the snapshot store and the metrics. The CPU bound steps run in worker threads so the event loop is never blocked.
+    """
+
+    # Page run through the stages of the extraction by `warm_up`
+    warm_up_html = (
+        "<!DOCTYPE html><html><head><title>Warm up product</title>"
+        '<script type="application/ld+json">{"@context": "https://schema.org", "@type": "Product", "name": "Warm up product"}</script>'
+        "<style>p { color: black; }</style></head><body><div><h1>Warm up product</h1><p>Brand: <b>Example</b></p>"
+        "<div><span>Rs.</span> <span>100</span></div><img src=\"https://example.com/image.jpg\">"
+        "<p>A product used to warm up the parser &amp; the selectors.</p><a href=\"/\">Home</a></div></body></html>"
+    )
+
+    def __init__(self, client, max_concurrent_inference=32, result_cache=None, template_store=None, prompt_token_budget=None, scheduler=None, snapshot_store=None,
+                 rejected_page_types=("bot_wall", "empty_shell", "listing"), metrics=None):
+        """
+        Initializes the ExtractionPipeline class.
+
+        Args:
+            client (AsyncInferenceClient | list): The shared client to send the requests to the language model with,
+                or one client per inference backend. It may be None in processes that only prepare pages and extract selectors.
+            max_concurrent_inference (int): The maximum number of concurrent requests to each inference backend.
+            result_cache (ResultCache, optional): The cache of the attributes extracted by the language model.
+            template_store (TemplateStore, optional): The store of the learned page templates.
+            prompt_token_budget (int, optional): The maximum number of tokens of the cleaned HTML content in the prompt.
+            scheduler (InferenceScheduler, optional): The scheduler of the requests to the language model. If not provided,
+                one is created for the clients with `max_concurrent_inference`.
+            snapshot_store (SnapshotStore, optional): The store of the last extraction of each URL.
+            rejected_page_types (tuple): The types of pages found by the triage that are rejected. The pages of the other
+                types are extracted, their type is only recorded in the metrics.
+            metrics (Metrics, optional): The metrics of the extractions. If not provided, they are only kept in this process.
+        """
+        self.clients = client if isinstance(client, list) else [client] if client is not None else []
+        self.client = self.clients[0] if self.clients else None
+        self.scheduler = scheduler if scheduler is not None else InferenceScheduler(self.clients, max_concurrency=max_concurrent_inference)
+        self.result_cache = result_cache
+        self.template_store = template_store
+        self.snapshot_store = snapshot_store
+        self.rejected_page_types = tuple(rejected_page_types)
+        self.prompt_token_budget = prompt_token_budget
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Requests to the language model in progress, by cache key, so identical pages share a single call
+        self.in_flight = {}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates the pipeline and its shared resources from the environment variables.
+
+        Returns:
+            ExtractionPipeline: The configured pipeline.
+        """
+        load_dotenv()
+        result_cache = ResultCache(
+            # The SQLite tier is disabled if the path is empty
+            path=os.getenv("RESULT_CACHE_PATH", ".cache/results.sqlite3") or None,
+            max_entries=int(os.getenv("RESULT_CACHE_SIZE", "1024")),
+            max_disk_entries=int(os.getenv("RESULT_CACHE_DISK_SIZE", "100000")),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", "86400"))
+        )
+        template_store = None
+        if os.getenv("TEMPLATE_LEARNING", "true").lower() == "true":
+            template_store = TemplateStore(
+                path=os.getenv("TEMPLATE_STORE_PATH", ".cache/templates.sqlite3") or None,
+                similarity=float(os.getenv("TEMPLATE_SIMILARITY", "0.8"))
+            )
+        snapshot_store = None
+        # Snapshots are disabled if the path is empty
+        if os.getenv("SNAPSHOT_STORE_PATH", ".cache/snapshots.sqlite3"):
+            snapshot_store = SnapshotStore(
+                path=os.getenv("SNAPSHOT_STORE_PATH", ".cache/snapshots.sqlite3"),
+                ttl=float(os.getenv("SNAPSHOT_TTL", "2592000"))
+            )
+        clients = ExtractAttributes.get_async_clients()
+        scheduler = InferenceScheduler(
+            clients,
+            max_concurrency=int(os.getenv("MAX_CONCURRENT_INFERENCE", "32")),
+            max_queue=int(os.getenv("INFERENCE_QUEUE_SIZE", "256")),
+            max_retries=int(os.getenv("INFERENCE_RETRIES", "3")),
+            retry_delay=float(os.getenv("INFERENCE_RETRY_DELAY", "0.5")),
+            hedge=os.getenv("INFERENCE_HEDGING", "false").lower() == "true"
+        )
+        return cls(
+            clients,
+            scheduler=scheduler,
+            result_cache=result_cache,
+            template_store=template_store,
+            snapshot_store=snapshot_store,
+            rejected_page_types=[item.strip() for item in os.getenv("TRIAGE_REJECT", "bot_wall,empty_shell,listing").split(",") if item.strip()],
+            # The 8k tokens context of the model also holds the instructions, the tool schema and the completion
+            prompt_token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "6000")) or None,
+            # The workers of the pre-forked server add up their metrics through this directory
+            metrics=Metrics(os.getenv("METRICS_DIR") or None)
+        )
+
+    @classmethod
+    def warm_up(cls, prompt_token_budget=None):
+        """
+        Runs the CPU bound stages of the extraction, from the triage to the merge of the selectors, on a small built-in page
+        without calling the language model nor touching the stores. The first run of each stage loads the parser of lxml,
+        the tables of the entities and of the Unicode normalization and the patterns compiled on their first use, so
+        calling it before the workers of the server are forked shares them all between the workers.
+
+        Args:
+            prompt_token_budget (int, optional): The maximum number of tokens of the cleaned HTML content in the prompt.
+
+        Returns:
+            dict: The merged attributes and selectors of the built-in page.
+        """
+        PageTriage(cls.warm_up_html, len(cls.warm_up_html))
+        parser = StreamingHTMLParser()
+        parser.feed(cls.warm_up_html)
+        document = parser.close()
+        ExtractStructuredData(document).extract_structured_data()
+        CleanHTML(document, token_budget=prompt_token_budget)
+        # Values that differ from the text of the page also build the index of the fuzzy matching
+        attributes = {
+            "product_name": "Warm up  product",
+            "product_price": "Rs. 100",
+            "product_description": "A product used to warm up the parser",
+            "product_images": ["//example.com/image.jpg"],
+            "product_category": "None",
+            "brand_name": "EXAMPLE",
+        }
+        selectors = ExtractSelectors(document, attributes).extract_selectors()
+        return MergeAttributesAndSelectors(attributes, selectors).result
+
+    @staticmethod
+    def select_fields(fields=None, known=None):
+        """
+        Validates a selection of attributes to extract and the values of the attributes that are already known.
+
+        Args:
+            fields (list, optional): The attributes to extract. If not provided, all the attributes are extracted.
+            known (dict, optional): The values of attributes that are already known, which are used as they are.
+                The values of the product images are lists of URLs, the others are strings.
+
+        Returns:
+            tuple: The requested attributes in the order of `ExtractAttributes.fields`, and the known values of the requested attributes.
+
+        Raises:
+            InvalidFieldsError: If an attribute is unknown or a known value has the wrong type.
+        """
+        fields = list(fields) if fields else list(ExtractAttributes.fields)
+        known = known or {}
+        if not isinstance(known, dict):
+            raise InvalidFieldsError("The known attributes must be an object")
+        unknown = [field for field in list(fields) + list(known) if field not in ExtractAttributes.fields]
+        if unknown:
+            raise InvalidFieldsError(f"Unknown attributes: {', '.join(map(str, unknown))}. The attributes are {', '.join(ExtractAttributes.fields)}")
+        for field, value in known.items():
+            is_list = isinstance(value, list) and all(isinstance(item, str) for item in value)
+            if (field == "product_images" and not is_list) or (field != "product_images" and not isinstance(value, str)):
+                raise InvalidFieldsError(f"The known value of {field} must be {'a list of strings' if field == 'product_images' else 'a string'}")
+        fields = [field for field in ExtractAttributes.fields if field in fields]
+        return fields, {field: value for field, value in known.items() if field in fields}
+
+    def triage(self, head, size, timings):
+        """
+        Classifies a page from the first characters of its HTML content, and rejects it if it cannot hold the attributes of a product.
+
+        Args:
+            head (str): The first characters of the HTML content.
+            size (int): The number of characters of the HTML content.
+            timings (Timings): The instrumentation of the extraction.
+
+        Returns:
+            str: The type of the page.
+
+        Raises:
+            NotHTMLContentError: If the provided content is not HTML.
+            RejectedPageError: If the type of the page is one of `rejected_page_types`.
+        """
+        with timings.measure("triage"):
+            page_type = PageTriage(head, size).page_type
+        if page_type != "product":
+            timings.outcome(page_type)
+        if page_type == "not_html":
+            raise NotHTMLContentError(PageTriage.descriptions[page_type])
+        if page_type in self.rejected_page_types:
+            raise RejectedPageError(PageTriage.descriptions[page_type], page_type)
+        return page_type
+
+    def prepare(self, html_content, timings=None, fields=None, known=None, url=None):
+        """
+        Triages and parses the HTML content, reads its structured data and compares the page with the snapshot
+        of its URL, or looks for a learned template if the URL has no snapshot. If requested attributes are still
+        missing, the HTML content is cleaned and the prompt for the language model is built for the missing attributes
+        only, from the regions that changed since the snapshot when they are much smaller than the page.
+
+        Args:
+            html_content (str | ParsedHTML): The raw HTML content, or HTML content that was already validated and parsed
+                while it was received.
+            timings (Timings, optional): The instrumentation of the extraction.
+            fields (list, optional): The attributes to extract. If not provided, all the attributes are extracted.
+            known (dict, optional): The values of attributes that are already known, which are not extracted again.
+            url (str, optional): The URL of the page, which identifies its snapshot.
+
+        Returns:
+            dict: The parsed HTML content, the type of the page, the requested attributes, the attributes found so far and their selectors
+                if they were reused, the template match, the snapshot, the missing attributes, the cleaned HTML content
+                and the prompt HTML content. Apart from the parsed HTML content, it can be sent
+                to another process.
+
+        Raises:
+            NotHTMLContentError: If the provided content is not HTML.
+            RejectedPageError: If the triage rejects the page.
+            InvalidFieldsError: If the requested or known attributes are not valid.
+        """
+        timings = timings if timings is not None else Timings()
+        fields, known = self.select_fields(fields, known)
+        page_type = None
+        if isinstance(html_content, ParsedHTML):
+            document = html_content
+            # HTML content parsed while it was received is triaged before it is cleaned
+            if document.head is not None:
+                page_type = self.triage(document.head, document.size, timings)
+        else:
+            timings.record("input_bytes", len(html_content.encode("utf-8")))
+            page_type = self.triage(html_content[:PageTriage.prefix_chars], len(html_content), timings)
+            with timings.measure("parse"):
+                document = ParsedHTML(html_content)
+        page = {
+            "document": document, "page_type": page_type, "fields": fields, "url": url, "signature": None, "template_id": None, "snapshot": None,
+            "selectors": {}, "missing_fields": [], "cleaned_html": None, "prompt_html": None
+        }
+        # Structured data is read before cleaning, which removes the script and meta tags holding it
+        with timings.measure("structured_data"):
+            structured_attributes = ExtractStructuredData(document).extract_structured_data()
+        page["attributes"] = {field: value for field, value in structured_attributes.items() if field in fields}
+        if all(field in page["attributes"] for field in fields):
+            timings.outcome("structured_data")
+        page["attributes"].update(known)
+        page["missing_fields"] = [field for field in fields if field not in page["attributes"]]
+        if page["missing_fields"] and self.snapshot_store is not None and url:
+            with timings.measure("snapshot"):
+                page["snapshot"] = self.snapshot_store.get(url)
+                if page["snapshot"] is not None:
+                    snapshot_attributes, page["selectors"], page["missing_fields"] = self.snapshot_store.match(document.tree, page["snapshot"], page["missing_fields"])
+                    page["attributes"].update(snapshot_attributes)
+                else:
+                    self.snapshot_store.record_miss()
+            if page["snapshot"] is None:
+                timings.outcome("snapshot_miss")
+            else:
+                timings.outcome("snapshot_partial" if page["missing_fields"] else "snapshot_hit")
+        if not page["missing_fields"]:
+            if known:
+                timings.outcome("known_values")
+        # The selectors of the snapshot are more specific to the URL than a template of its layout
+        elif self.template_store is not None and page["snapshot"] is None:
+            with timings.measure("template"):
+                page["signature"], page["template_id"], template_attributes = self.template_store.match(document.tree)
+            if template_attributes is not None:
+                # A template only holds the attributes that were found with enough confidence, the others are still
+                # asked to the language model
+                served_fields = [field for field in page["missing_fields"] if field in template_attributes]
+                page["attributes"].update({field: template_attributes[field] for field in served_fields})
+                page["selectors"].update(self.template_store.get_selectors(page["template_id"], served_fields, document.tree))
+                page["missing_fields"] = [field for field in page["missing_fields"] if field not in template_attributes]
+                timings.outcome("template_partial" if page["missing_fields"] else "template_hit")
+            else:
+                timings.outcome("template_stale" if page["template_id"] is not None else "template_miss")
+        if page["missing_fields"]:
+            with timings.measure("clean"):
+                page["cleaned_html"] = CleanHTML(document, token_budget=self.prompt_token_budget).cleaned_html
+            timings.record("cleaned_bytes", len(page["cleaned_html"].encode("utf-8")))
+            if page["snapshot"] is not None and page["snapshot"]["cleaned_html"] is not None:
+                with timings.measure("diff"):
+                    page["prompt_html"] = self.snapshot_store.get_changed_html(page["snapshot"]["cleaned_html"], page["cleaned_html"])
+                if page["prompt_html"] is not None:
+                    timings.record("prompt_bytes", len(page["prompt_html"].encode("utf-8")))
+        return page
+
+    async def get_attributes(self, attribute_extractor, timings, priority=0):
+        """
+        Extracts the attributes with the language model, unless the same request has already been answered.
+        Identical requests in flight at the same time are coalesced into a single call to the language model.
+
+        Args:
+            attribute_extractor (ExtractAttributes): The attribute extractor holding the prompt.
+            timings (Timings): The instrumentation of the extraction.
+            priority (int): The priority of the request to the language model, lower values are served first.
+
+        Returns:
+            dict: The extracted attributes.
+
+        Raises:
+            AttributeExtractionError: If an error occurs during the request to the language model.
+            OverloadedError: If the language model is overloaded.
+        """
+        with timings.measure("prompt"):
+            cache_key = attribute_extractor.get_cache_key()
+        task = self.in_flight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(self.fetch_attributes(attribute_extractor, cache_key, timings, priority))
+            self.in_flight[cache_key] = task
+            task.add_done_callback(lambda _: self.in_flight.pop(cache_key, None))
+        else:
+            timings.outcome("coalesced")
+        # The call keeps running for the other requests waiting on it if this request is cancelled
+        return await asyncio.shield(task)
+
+    async def fetch_attributes(self, attribute_extractor, cache_key, timings, priority=0):
+        """
+        Looks up the result cache and calls the language model on a miss, through the scheduler.
+
+        Args:
+            attribute_extractor (ExtractAttributes): The attribute extractor holding the prompt.
+            cache_key (str): The key identifying the request to the language model.
+            timings (Timings): The instrumentation of the extraction that started the call.
+            priority (int): The priority of the request to the language model, lower values are served first.
+
+        Returns:
+            dict: The extracted attributes.
+
+        Raises:
+            AttributeExtractionError: If an error occurs during the request to the language model.
+            OverloadedError: If the language model is overloaded.
+        """
+        if self.result_cache is not None:
+            with timings.measure("cache"):
+                attributes = await asyncio.to_thread(self.result_cache.get, cache_key)
+            if attributes is not None:
+                timings.outcome("cache_hit")
+                return attributes
+
+        try:
+            response = await self.scheduler.run(attribute_extractor.get_response_async, priority, timings)
+        except OverloadedError:
+            timings.outcome("overloaded")
+            raise
+        except Exception as e:
+            timings.outcome("model_error")
+            raise AttributeExtractionError(str(e))
+        timings.outcome("model_call")
+        usage = getattr(response, "usage", None)
+        timings.record("prompt_tokens", getattr(usage, "prompt_tokens", None) or 0)
+        timings.record("completion_tokens", getattr(usage, "completion_tokens", None) or 0)
+        with timings.measure("parse_tool_call"):
+            attributes = ExtractAttributes.get_attributes(response)
+
+        if self.result_cache is not None:
+            await asyncio.to_thread(self.result_cache.set, cache_key, attributes)
+        return attributes
+
+    async def ask_model(self, prompt_html, fields, timings, priority=0):
+        """
+        Asks the language model for some attributes of a page.
+
+        Args:
+            prompt_html (str): The HTML content of the prompt.
+            fields (list): The attributes to extract.
+            timings (Timings): The instrumentation of the extraction.
+            priority (int): The priority of the request to the language model, lower values are served first.
+
+        Returns:
+            dict: The extracted attributes among `fields`.
+
+        Raises:
+            AttributeExtractionError: If an error occurs during the request to the language model.
+            OverloadedError: If the language model is overloaded.
+        """
+        with timings.measure("prompt"):
+            attribute_extractor = ExtractAttributes(prompt_html, client=self.client, fields=fields)
+        extracted_attributes = await self.get_attributes(attribute_extractor, timings, priority)
+        return {field: extracted_attributes[field] for field in attribute_extractor.fields if field in extracted_attributes}
+
+    async def extract_attributes(self, page, timings=None, priority=0):
+        """
+        Completes the attributes of a prepared page, asking the language model for the missing ones. If the prompt
+        was built from the regions that changed since the snapshot of the URL, the attributes of the snapshot that
+        are not found in them are asked again with the whole cleaned HTML content, along with the attributes that
+        the snapshot does not hold.
+
+        Args:
+            page (dict): The prepared page.
+            timings (Timings, optional): The instrumentation of the extraction.
+            priority (int): The priority of the request to the language model, lower values are served first.
+
+        Returns:
+            dict: The requested attributes of the page. Attributes that were not found are reported as "None".
+
+        Raises:
+            AttributeExtractionError: If an error occurs during the request to the language model.
+            OverloadedError: If the language model is overloaded.
+        """
+        timings = timings if timings is not None else Timings()
+        attributes = {field: "None" for field in page["fields"]}
+        missing_fields = page["missing_fields"]
+        if page["prompt_html"] is not None:
+            diff_fields = [field for field in missing_fields if field in page["snapshot"]["result"]]
+            # Attributes that were not on the page before either are not asked again with the whole cleaned HTML content
+            missing_fields = [field for field in missing_fields if field not in diff_fields]
+            if diff_fields:
+                attributes.update(await self.ask_model(page["prompt_html"], diff_fields, timings, priority))
+                missing_fields += [
+                    field for field in diff_fields
+                    if attributes[field] in ("None", []) and self.snapshot_store.was_found(page["snapshot"], field)
+                ]
+        if missing_fields:
+            attributes.update(await self.ask_model(page["cleaned_html"], missing_fields, timings, priority))
+        attributes.update(page["attributes"])
+        return attributes
+
+    def extract_and_merge_selectors(self, page, attributes, timings=None):
+        """
+        Extracts the selectors for the attributes, merges them with the attributes and learns the template
+        of the page when some of its attributes were extracted by the language model. The selectors reused from
+        the snapshot of the URL or from its template are not extracted again, and the result is recorded as the new snapshot.
+
+        Args:
+            page (dict): The prepared page.
+            attributes (dict): The extracted attributes.
+            timings (Timings, optional): The instrumentation of the extraction.
+
+        Returns:
+            dict: A dictionary containing the extracted attributes and their corresponding selectors.
+        """
+        timings = timings if timings is not None else Timings()
+        with timings.measure("selectors"):
+            selectors = dict(page["selectors"])
+            selectors.update(ExtractSelectors(page["document"], {key: value for key, value in attributes.items() if key not in selectors}).extract_selectors())
+        # A template learned from some of the attributes would be missing the selectors of the others
+        if self.template_store is not None and page["missing_fields"] and page["fields"] == ExtractAttributes.fields:
+            with timings.measure("learn"):
+                self.template_store.learn(page["signature"], attributes, selectors, template_id=page["template_id"])
+        with timings.measure("merge"):
+            result = MergeAttributesAndSelectors(attributes, selectors).result
+        if self.snapshot_store is not None and page["url"]:
+            with timings.measure("snapshot_save"):
+                self.snapshot_store.save(page["url"], page["document"].tree, page["cleaned_html"], result, page["snapshot"])
+        return result
+
+    async def extract(self, html_content, timings=None, priority=0, fields=None, known=None, url=None, selectors=True):
+        """
+        Extracts the e-commerce attributes and their corresponding CSS selectors and XPaths from HTML content.
+        Without the selectors, the page is not indexed for the selector extraction and no template nor snapshot is learned.
+
+        Args:
+            html_content (str | ParsedHTML): The raw HTML content, or HTML content that was already validated and parsed.
+            timings (Timings, optional): The instrumentation of the extraction, filled in stage by stage.
+            priority (int): The priority of the request to the language model, lower values are served first.
+            fields (list, optional): The attributes to extract. If not provided, all the attributes are extracted.
+            known (dict, optional): The values of attributes that are already known, which are not extracted again
+                but whose selectors are still extracted.
+            url (str, optional): The URL of the page. If provided, the page is only extracted where it changed since
+                the last extraction of the URL.
+            selectors (bool): Whether to extract the selectors of the attributes.
+
+        Returns:
+            dict: A dictionary containing the requested attributes and their corresponding selectors, or only the values
+                of the requested attributes if the selectors are not extracted.
+
+        Raises:
+            NotHTMLContentError: If the provided content is not HTML.
+            RejectedPageError: If the triage rejects the page.
+            InvalidFieldsError: If the requested or known attributes are not valid.
+            AttributeExtractionError: If an error occurs during the request to the language model.
+            OverloadedError: If the language model is overloaded.
+        """
+        timings = timings if timings is not None else Timings()
+        page = await asyncio.to_thread(self.prepare, html_content, timings, fields, known, url)
+        attributes = await self.extract_attributes(page, timings, priority)
+        if not selectors:
+            return {field: attributes[field] for field in page["fields"]}
+        return await asyncio.to_thread(self.extract_and_merge_selectors, page, attributes, timings)
+
+    async def close(self):
+        """
+        Closes the inference clients, the result cache, the template store and the snapshot store.
+        """
+        for client in self.clients:
+            await client.close()
+        if self.result_cache is not None:
+            self.result_cache.close()
+        if self.template_store is not None:
+            self.template_store.close()
+        if self.snapshot_store is not None:
+            self.snapshot_store.close()
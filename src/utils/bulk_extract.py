@@ -0,0 +1,386 @@
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.extractors.extract_attributes import ExtractAttributes
+from src.extractors.pipeline import ExtractionPipeline, NotHTMLContentError, AttributeExtractionError, RejectedPageError
+from src.utils.scheduler import OverloadedError
+from src.utils.templates import TemplateStore
+from src.utils.utils import CompactResult, ParsedHTML
+
+HTML_EXTENSIONS = (".html", ".htm", ".html.gz", ".htm.gz")
+JSONL_EXTENSIONS = (".jsonl", ".ndjson", ".jsonl.gz", ".ndjson.gz")
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz")
+
+# Pipeline of a worker process, used to prepare pages and extract selectors without an inference client
+worker_pipeline = None
+
+def init_worker(template_store_path, template_similarity, prompt_token_budget, rejected_page_types):
+    """
+    Creates the pipeline of a worker process. Templates are shared with the other processes through SQLite.
+
+    Args:
+    template_store_path (str): The path of the SQLite database of the template store, or None to keep templates in memory.
+    template_similarity (float): The minimum similarity for a page to match a template, or None to disable templates.
+    prompt_token_budget (int): The maximum number of tokens of the cleaned HTML content in the prompt.
+    rejected_page_types (tuple): The types of pages found by the triage that are rejected.
+    """
+    global worker_pipeline
+    template_store = None
+    if template_similarity is not None:
+        template_store = TemplateStore(path=template_store_path, similarity=template_similarity)
+    worker_pipeline = ExtractionPipeline(
+        None, template_store=template_store, prompt_token_budget=prompt_token_budget, rejected_page_types=rejected_page_types
+    )
+
+def prepare_page(html_content, fields=None):
+    """
+    Triages, parses and cleans a page in a worker process.
+
+    Args:
+    html_content (str): The raw HTML content.
+    fields (list, optional): The attributes to extract. If not provided, all the attributes are extracted.
+
+    Returns:
+    dict: The prepared page without its parsed HTML content, which cannot be sent back to the main process.
+    """
+    page = worker_pipeline.prepare(html_content, fields=fields)
+    del page["document"]
+    return page
+
+def extract_and_merge_selectors(html_content, page, attributes):
+    """
+    Extracts the selectors of a page in a worker process. The page is parsed again as lxml trees cannot be sent between processes.
+
+    Args:
+    html_content (str): The raw HTML content.
+    page (dict): The prepared page.
+    attributes (dict): The attributes of the page.
+
+    Returns:
+    dict: A dictionary containing the extracted attributes and their corresponding selectors.
+    """
+    page["document"] = ParsedHTML(html_content)
+    return worker_pipeline.extract_and_merge_selectors(page, attributes)
+
+def decode(content):
+    """
+    Decodes the bytes of a page.
+
+    Args:
+    content (bytes): The raw bytes of the page.
+
+    Returns:
+    str: The decoded HTML content.
+    """
+    return content.decode("utf-8", errors="replace")
+
+def read_jsonl(file, source):
+    """
+    Reads the pages of a JSONL file with one `{"id": ..., "html": ...}` object per line.
+
+    Args:
+    file (file): The opened binary file.
+    source (str): The name of the file, used to build the IDs of the pages without one.
+
+    Yields:
+    tuple: The ID and the HTML content of each page.
+    """
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            yield str(item.get("id", f"{source}:{line_number}")), item["html"]
+        except (ValueError, KeyError, AttributeError):
+            print(f"Skipping line {line_number} of {source}: not a JSON object with an `html` field", file=sys.stderr)
+
+def read_file(path):
+    """
+    Reads the pages of an input file, which may be an HTML file, a gzip compressed HTML file, a JSONL file or a tar archive.
+
+    Args:
+    path (str): The path of the input file.
+
+    Yields:
+    tuple: The ID and the HTML content of each page.
+    """
+    name = path.lower()
+    if name.endswith(TAR_EXTENSIONS):
+        with tarfile.open(path, "r:*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                member_id = f"{path}:{member.name}"
+                with archive.extractfile(member) as file:
+                    if member.name.lower().endswith(JSONL_EXTENSIONS):
+                        opened = gzip.open(file) if member.name.lower().endswith(".gz") else file
+                        yield from read_jsonl(opened, member_id)
+                    elif member.name.lower().endswith(".gz"):
+                        yield member_id, decode(gzip.decompress(file.read()))
+                    else:
+                        yield member_id, decode(file.read())
+    elif name.endswith(JSONL_EXTENSIONS):
+        with (gzip.open(path) if name.endswith(".gz") else open(path, "rb")) as file:
+            yield from read_jsonl(file, path)
+    elif name.endswith(".gz"):
+        with gzip.open(path) as file:
+            yield path, decode(file.read())
+    else:
+        with open(path, "rb") as file:
+            yield path, decode(file.read())
+
+def read_inputs(inputs):
+    """
+    Reads the pages of the inputs, which may be directories, glob patterns or files.
+
+    Args:
+    inputs (list): The input paths or glob patterns.
+
+    Yields:
+    tuple: The ID and the HTML content of each page.
+    """
+    for pattern in inputs:
+        paths = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for path in paths:
+            if os.path.isdir(path):
+                for root, directories, files in os.walk(path):
+                    directories.sort()
+                    for file_name in sorted(files):
+                        if file_name.lower().endswith(HTML_EXTENSIONS + JSONL_EXTENSIONS + TAR_EXTENSIONS):
+                            yield from read_file(os.path.join(root, file_name))
+            elif os.path.isfile(path):
+                yield from read_file(path)
+            else:
+                print(f"Skipping {path}: no such file or directory", file=sys.stderr)
+
+class ShardWriter:
+    """
+    ShardWriter is a class designed to write the results to sharded JSONL files and to resume an interrupted run.
+    The shards are the checkpoint: pages with a final result in an existing shard are skipped, the results of the pages
+    processed again are removed from the shards, and new results are written to new shards so a line truncated by
+    an interruption is never appended to.
+    """
+
+    def __init__(self, output_dir, shard_size):
+        """
+        Initializes the ShardWriter class and reads the pages already processed in the output directory.
+
+        Args:
+        output_dir (str): The directory of the shards.
+        shard_size (int): The maximum number of results in a shard.
+        """
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.completed = set()
+        self.shard_index = 0
+        self.shard_count = 0
+        self.file = None
+        os.makedirs(output_dir, exist_ok=True)
+        self.load_checkpoint()
+
+    def load_checkpoint(self):
+        """
+        Reads the IDs of the pages with a final result from the existing shards. Pages that failed because of the
+        language model are not final and are processed again, so their lines, and the lines truncated by an interruption,
+        are removed from the shards to keep a single result per page.
+        """
+        for path in sorted(glob.glob(os.path.join(self.output_dir, "results-*.jsonl"))):
+            self.shard_index = max(self.shard_index, int(os.path.basename(path)[8:-6]) + 1)
+            lines = []
+            superseded = 0
+            with open(path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        superseded += 1
+                        continue
+                    if item.get("status_code") == 200 or item.get("error") in (NotHTMLContentError.__name__, RejectedPageError.__name__):
+                        self.completed.add(item["id"])
+                        lines.append(line if line.endswith("\n") else line + "\n")
+                    else:
+                        superseded += 1
+            if superseded:
+                # The shard is replaced atomically so an interruption leaves either the old or the new shard
+                with open(path + ".tmp", "w", encoding="utf-8") as file:
+                    file.writelines(lines)
+                os.replace(path + ".tmp", path)
+
+    def write(self, item):
+        """
+        Writes a result to the current shard, opening a new shard once it is full.
+
+        Args:
+        item (dict): The result of a page.
+        """
+        if self.file is None or self.shard_count >= self.shard_size:
+            self.close()
+            path = os.path.join(self.output_dir, f"results-{self.shard_index:05d}.jsonl")
+            self.file = open(path, "w", encoding="utf-8")
+            self.shard_index += 1
+            self.shard_count = 0
+        self.file.write(json.dumps(item, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.shard_count += 1
+
+    def close(self):
+        """
+        Closes the current shard.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+async def process_page(pipeline, pool, page_id, html_content, fields=None, selectors=True, compact=False):
+    """
+    Extracts the attributes and selectors of a page. Parsing, cleaning and selector extraction run in the
+    process pool while the call to the language model runs on the event loop. Without the selectors, the page
+    is not parsed a second time in the process pool.
+
+    Args:
+    pipeline (ExtractionPipeline): The pipeline holding the inference clients, the scheduler and the result cache.
+    pool (ProcessPoolExecutor): The pool of worker processes.
+    page_id (str): The ID of the page.
+    html_content (str): The raw HTML content.
+    fields (list, optional): The attributes to extract. If not provided, all the attributes are extracted.
+    selectors (bool): Whether to extract the selectors of the attributes.
+    compact (bool): Whether to write the result in the compact output mode.
+
+    Returns:
+    dict: The result of the page, or its error and status code.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        page = await loop.run_in_executor(pool, prepare_page, html_content, fields)
+        attributes = await pipeline.extract_attributes(page)
+        if selectors:
+            result = await loop.run_in_executor(pool, extract_and_merge_selectors, html_content, page, attributes)
+        else:
+            result = {field: attributes[field] for field in page["fields"]}
+        return {"id": page_id, "status_code": 200, "result": CompactResult(result).to_dict() if compact else result}
+    except OverloadedError as e:
+        return {"id": page_id, "status_code": 503, "error": type(e).__name__, "detail": str(e)}
+    except RejectedPageError as e:
+        return {"id": page_id, "status_code": 422, "error": type(e).__name__, "reason": e.reason, "detail": str(e)}
+    except NotHTMLContentError as e:
+        return {"id": page_id, "status_code": 400, "error": type(e).__name__, "reason": "not_html", "detail": str(e)}
+    except AttributeExtractionError as e:
+        return {"id": page_id, "status_code": 400, "error": type(e).__name__, "detail": str(e)}
+    except Exception as e:
+        return {"id": page_id, "status_code": 500, "error": type(e).__name__, "detail": str(e)}
+
+async def bulk_extract(inputs, output_dir, workers, max_in_flight, shard_size, progress_interval, max_concurrent_inference=None, fields=None,
+                       selectors=True, compact=False):
+    """
+    Extracts the attributes and selectors of all the pages of the inputs and writes them to sharded JSONL files.
+
+    Args:
+    inputs (list): The input paths or glob patterns.
+    output_dir (str): The directory of the shards.
+    workers (int): The number of worker processes for parsing, cleaning and selector extraction.
+    max_in_flight (int): The maximum number of pages being processed at the same time.
+    shard_size (int): The maximum number of results in a shard.
+    progress_interval (float): The number of seconds between two progress reports.
+    max_concurrent_inference (int, optional): The maximum number of concurrent requests to the language model.
+        If not provided, `MAX_CONCURRENT_INFERENCE` is used.
+    fields (list, optional): The attributes to extract. If not provided, all the attributes are extracted.
+    selectors (bool): Whether to extract the selectors of the attributes.
+    compact (bool): Whether to write the results in the compact output mode.
+
+    Returns:
+    dict: The summary of the run.
+    """
+    pipeline = ExtractionPipeline.from_env()
+    # The number of pages in flight already bounds the queue of the scheduler, so pages wait instead of being rejected
+    pipeline.scheduler.max_queue = 0
+    if max_concurrent_inference is not None:
+        pipeline.scheduler.set_max_concurrency(max_concurrent_inference)
+    template_store = pipeline.template_store
+    writer = ShardWriter(output_dir, shard_size)
+    counters = {"ok": 0, "failed": 0, "skipped": 0}
+    # Pages rejected by the triage, by reason
+    rejected = {}
+    in_flight = asyncio.Semaphore(max_in_flight)
+    tasks = set()
+    start = last_report = time.monotonic()
+
+    def report(final=False):
+        elapsed = time.monotonic() - start
+        processed = counters["ok"] + counters["failed"]
+        print(
+            f"{'Done' if final else 'Progress'}: {processed} processed ({counters['ok']} ok, {counters['failed']} failed), "
+            f"{counters['skipped']} skipped, {processed / elapsed if elapsed else 0:.1f} pages/s, {elapsed:.0f}s elapsed",
+            file=sys.stderr
+        )
+
+    async def run(page_id, html_content):
+        try:
+            item = await process_page(pipeline, pool, page_id, html_content, fields, selectors, compact)
+            writer.write(item)
+            counters["ok" if item["status_code"] == 200 else "failed"] += 1
+            if "reason" in item:
+                rejected[item["reason"]] = rejected.get(item["reason"], 0) + 1
+        finally:
+            in_flight.release()
+
+    initargs = (
+        template_store.path if template_store is not None else None,
+        template_store.similarity if template_store is not None else None,
+        pipeline.prompt_token_budget,
+        pipeline.rejected_page_types
+    )
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as pool:
+            for page_id, html_content in read_inputs(inputs):
+                if page_id in writer.completed:
+                    counters["skipped"] += 1
+                    continue
+                await in_flight.acquire()
+                task = asyncio.ensure_future(run(page_id, html_content))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if time.monotonic() - last_report >= progress_interval:
+                    report()
+                    last_report = time.monotonic()
+            if tasks:
+                await asyncio.gather(*tasks)
+    finally:
+        writer.close()
+        await pipeline.close()
+    report(final=True)
+    elapsed = time.monotonic() - start
+    return {**counters, "rejected": rejected, "elapsed": elapsed, "pages_per_second": (counters["ok"] + counters["failed"]) / elapsed if elapsed else 0}
+
+def main():
+    """
+    Main function to parse the command line arguments and run the bulk extraction.
+    """
+    parser = argparse.ArgumentParser(description="Extract e-commerce attributes and selectors from stored HTML pages without the API.")
+    parser.add_argument("inputs", nargs="+", help="Directories, glob patterns, HTML files (optionally gzip compressed), JSONL files or tar archives")
+    parser.add_argument("--output-dir", default="results/bulk", help="Directory of the sharded JSONL results, also used to resume an interrupted run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes for parsing, cleaning and selector extraction")
+    parser.add_argument("--max-in-flight", type=int, default=128, help="Maximum number of pages being processed at the same time")
+    parser.add_argument("--concurrency", type=int, default=None, help="Maximum number of concurrent requests to the language model, defaults to MAX_CONCURRENT_INFERENCE")
+    parser.add_argument("--fields", nargs="+", choices=ExtractAttributes.fields, help="Attributes to extract, defaults to all of them")
+    parser.add_argument("--no-selectors", action="store_true", help="Only extract the values of the attributes, without their selectors")
+    parser.add_argument("--compact", action="store_true", help="Write the results in the compact output mode")
+    parser.add_argument("--shard-size", type=int, default=10000, help="Maximum number of results per shard")
+    parser.add_argument("--progress-interval", type=float, default=10, help="Number of seconds between two progress reports")
+    args = parser.parse_args()
+
+    summary = asyncio.run(bulk_extract(
+        args.inputs, args.output_dir, args.workers, args.max_in_flight, args.shard_size, args.progress_interval, args.concurrency, args.fields,
+        not args.no_selectors, args.compact
+    ))
+    print(json.dumps(summary, indent=4))
+
+if __name__ == "__main__":
+    main()
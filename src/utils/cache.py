@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+class ResultCache:
+    """
+    ResultCache is a class designed to cache the attributes extracted by the language model.
+    It has a bounded in-process LRU tier and an optional persistent SQLite tier that is shared by all workers.
+    Both tiers expire entries after a TTL and evict the least recently used entries once they are full.
+    """
+
+    def __init__(self, path=None, max_entries=1024, max_disk_entries=100000, ttl=86400):
+        """
+        Initializes the ResultCache class.
+
+        Args:
+            path (str, optional): The path of the SQLite database. If not provided, only the in-process tier is used.
+            max_entries (int): The maximum number of entries kept in the in-process tier.
+            max_disk_entries (int): The maximum number of entries kept in the SQLite tier.
+            ttl (float): The number of seconds after which an entry expires.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self.connection = self.get_connection() if path else None
+
+    def get_connection(self):
+        """
+        Opens the SQLite database and creates the cache table if it does not exist.
+
+        Returns:
+            sqlite3.Connection: The connection to the SQLite database.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL lets several worker processes read while one of them writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+        return connection
+
+    def get(self, key):
+        """
+        Looks up a key, first in the in-process tier and then in the SQLite tier.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict: The cached value, or None if the key is missing or expired.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self.memory[key]
+
+            if self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT value, expires_at FROM results WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+                if row is not None:
+                    self.connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+                    value = json.loads(row[0])
+                    self.set_memory(key, value, row[1])
+                    self.counters["disk_hits"] += 1
+                    return value
+
+            self.counters["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        """
+        Stores a value in both tiers.
+
+        Args:
+            key (str): The cache key.
+            value (dict): The JSON serializable value to cache.
+        """
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.lock:
+            self.set_memory(key, value, expires_at)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires_at, now)
+                )
+                self.evict_disk(now)
+
+    def set_memory(self, key, value, expires_at):
+        """
+        Stores a value in the in-process tier, evicting the least recently used entries once it is full.
+        Must be called with the lock held.
+
+        Args:
+            key (str): The cache key.
+            value (dict): The value to cache.
+            expires_at (float): The timestamp at which the entry expires.
+        """
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def evict_disk(self, now):
+        """
+        Removes the expired entries from the SQLite tier and the least recently used ones once it is full.
+        Must be called with the lock held.
+
+        Args:
+            now (float): The current timestamp.
+        """
+        self.connection.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+        count = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.max_disk_entries:
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_disk_entries,)
+            )
+            self.counters["evictions"] += count - self.max_disk_entries
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: The counters and the number of entries in the in-process tier.
+        """
+        with self.lock:
+            return {**self.counters, "memory_entries": len(self.memory)}
+
+    def close(self):
+        """
+        Closes the connection to the SQLite database.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
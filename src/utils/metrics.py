@@ -0,0 +1,438 @@
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+class Timings:
+    """
+    Timings is a class designed to record the instrumentation of one extraction: the duration of each stage,
+    the sizes of the content, the token counts and the outcome of the fast paths.
+    """
+
+    def __init__(self):
+        """
+        Initializes the Timings class.
+        """
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.values = {}
+        self.outcomes = []
+
+    @contextmanager
+    def measure(self, stage):
+        """
+        Measures the duration of a stage. Durations of a stage measured several times are added up.
+
+        Args:
+            stage (str): The name of the stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = self.stages.get(stage, 0) + time.perf_counter() - start
+
+    def record(self, name, value):
+        """
+        Records a value of the extraction, such as a size in bytes or a token count.
+
+        Args:
+            name (str): The name of the value.
+            value (int): The value.
+        """
+        self.values[name] = self.values.get(name, 0) + value
+
+    def outcome(self, name):
+        """
+        Records the outcome of a stage, such as a cache hit or the use of a learned template.
+
+        Args:
+            name (str): The name of the outcome.
+        """
+        self.outcomes.append(name)
+
+    @property
+    def total(self):
+        """
+        Returns the time elapsed since the start of the extraction.
+
+        Returns:
+            float: The elapsed time in seconds.
+        """
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """
+        Formats the stage durations as a `Server-Timing` header.
+
+        Returns:
+            str: The value of the header.
+        """
+        metrics = [f"{stage};dur={duration * 1000:.1f}" for stage, duration in self.stages.items()]
+        metrics.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(metrics)
+
+class Histogram:
+    """
+    Histogram is a class designed to count observations in cumulative buckets, in the Prometheus format.
+    """
+
+    def __init__(self, name, description, buckets):
+        """
+        Initializes the Histogram class.
+
+        Args:
+            name (str): The name of the metric.
+            description (str): The description of the metric.
+            buckets (list): The upper bounds of the buckets, in increasing order.
+        """
+        self.name = name
+        self.description = description
+        self.buckets = list(buckets)
+        self.series = {}
+
+    def observe(self, value, labels=()):
+        """
+        Adds an observation. Must be called with the lock of the registry held.
+
+        Args:
+            value (float): The observed value.
+            labels (tuple): The label names and values of the series.
+        """
+        series = self.series.setdefault(labels, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series["counts"][index] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def get_state(self):
+        """
+        Returns a copy of the series of the histogram that can be encoded as JSON. Must be called with the lock of the
+        registry held.
+
+        Returns:
+            list: The labels, as pairs of names and values, and the series of each series.
+        """
+        return [
+            [[list(label) for label in labels], {"counts": list(series["counts"]), "sum": series["sum"], "count": series["count"]}]
+            for labels, series in self.series.items()
+        ]
+
+    def add_state(self, state):
+        """
+        Adds up the series of the histogram of another process. Must be called with the lock of the registry held.
+
+        Args:
+            state (list): The series returned by `get_state`.
+        """
+        for labels, other in state:
+            series = self.series.setdefault(to_labels(labels), {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            series["counts"] = [count + other_count for count, other_count in zip(series["counts"], other["counts"])]
+            series["sum"] += other["sum"]
+            series["count"] += other["count"]
+
+    def render(self):
+        """
+        Renders the histogram in the Prometheus text format.
+
+        Returns:
+            list: The lines of the histogram.
+        """
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(labels + (('le', repr(float(bound))),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(labels + (('le', '+Inf'),))} {series['count']}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {series['count']}")
+        return lines
+
+def to_labels(labels):
+    """
+    Converts the labels of a series decoded from JSON back to the tuple used as the key of the series.
+
+    Args:
+        labels (list): The label names and values, as pairs.
+
+    Returns:
+        tuple: The label names and values.
+    """
+    return tuple(tuple(label) for label in labels)
+
+def is_process_running(pid):
+    """
+    Checks whether a process is still running.
+
+    Args:
+        pid (int): The process ID.
+
+    Returns:
+        bool: True if the process is running, False otherwise.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def format_labels(labels):
+    """
+    Formats the labels of a series in the Prometheus text format.
+
+    Args:
+        labels (tuple): The label names and values.
+
+    Returns:
+        str: The formatted labels.
+    """
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+class Metrics:
+    """
+    Metrics is a class designed to aggregate the instrumentation of the extractions of a worker and to expose it
+    in the Prometheus text format. The worker processes of a pre-forked server share the socket, so a scrape reaches
+    any one of them: each process then writes its metrics to a file of a shared directory, and the histograms and
+    counters of all of them are added up when the metrics are rendered.
+    """
+
+    latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+    size_buckets = (1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+    def __init__(self, directory=None):
+        """
+        Initializes the Metrics class.
+
+        Args:
+            directory (str, optional): The directory where the processes share their metrics, one file per process.
+                If not provided, only the metrics of this process are rendered.
+        """
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.request_seconds = Histogram("extraction_request_seconds", "Duration of the extractions.", self.latency_buckets)
+        self.stage_seconds = Histogram("extraction_stage_seconds", "Duration of each stage of the extractions.", self.latency_buckets)
+        self.content_bytes = Histogram("extraction_content_bytes", "Size of the raw and cleaned HTML content.", self.size_buckets)
+        self.histograms = (self.request_seconds, self.stage_seconds, self.content_bytes)
+        self.counters = Counter()
+        self.process = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def observe(self, timings, status_code):
+        """
+        Adds the instrumentation of an extraction.
+
+        Args:
+            timings (Timings): The instrumentation of the extraction.
+            status_code (int): The status code of the extraction.
+        """
+        with self.lock:
+            self.request_seconds.observe(timings.total, (("status_code", status_code),))
+            for stage, duration in timings.stages.items():
+                self.stage_seconds.observe(duration, (("stage", stage),))
+            for name, value in timings.values.items():
+                if name.endswith("_bytes"):
+                    self.content_bytes.observe(value, (("content", name[:-len("_bytes")]),))
+                else:
+                    self.counters[("extraction_" + name + "_total", ())] += value
+            for outcome in timings.outcomes:
+                self.counters[("extraction_outcomes_total", (("outcome", outcome),))] += 1
+
+    def get_process(self):
+        """
+        Identifies this process by its ID and its start time, as the ID of a process that exited can be reused by
+        a new worker, whose metrics must not replace the ones of the exited process.
+
+        Returns:
+            tuple: The process ID and the start time of the process, in nanoseconds.
+        """
+        # The metrics may have been created before the worker was forked from the master process
+        if self.process is None or self.process[0] != os.getpid():
+            self.process = (os.getpid(), time.time_ns())
+        return self.process
+
+    def get_state(self, gauges=None):
+        """
+        Returns the metrics of this process in a form that can be encoded as JSON.
+
+        Args:
+            gauges (dict, optional): The gauges of this process, by name, with their labels and values.
+
+        Returns:
+            dict: The process ID, the start time of the process, the series of the histograms, the counters and the gauges.
+        """
+        pid, started_at = self.get_process()
+        with self.lock:
+            return {
+                "pid": pid,
+                "started_at": started_at,
+                "histograms": {histogram.name: histogram.get_state() for histogram in self.histograms},
+                "counters": [[name, [list(label) for label in labels], value] for (name, labels), value in self.counters.items()],
+                "gauges": {
+                    name: [[[list(label) for label in labels], value] for labels, value in series] for name, series in (gauges or {}).items()
+                },
+            }
+
+    def add_state(self, state):
+        """
+        Adds up the histograms and counters of another process.
+
+        Args:
+            state (dict): The metrics returned by `get_state`.
+        """
+        with self.lock:
+            for histogram in self.histograms:
+                histogram.add_state(state["histograms"].get(histogram.name, []))
+            for name, labels, value in state["counters"]:
+                self.counters[(name, to_labels(labels))] += value
+
+    def write(self, gauges=None):
+        """
+        Writes the metrics of this process to the shared directory, replacing its previous file atomically.
+
+        Args:
+            gauges (dict, optional): The gauges of this process, by name, with their labels and values.
+        """
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, "{}-{}.json".format(*self.get_process()))
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.get_state(gauges), file)
+        os.replace(path + ".tmp", path)
+
+    def read_states(self):
+        """
+        Reads the metrics written by the processes to the shared directory, including the processes that exited.
+
+        Returns:
+            list: The metrics of each process, ordered by process ID and start time.
+        """
+        states = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    states.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        return sorted(states, key=lambda state: (state["pid"], state.get("started_at", 0)))
+
+    def render(self, gauges=None, shared_gauges=None):
+        """
+        Renders the metrics in the Prometheus text format. If the metrics are shared by several processes, the histograms
+        and counters of all of them are added up, including those of the processes that exited so the counters never
+        decrease, and the gauges of each running process are labelled with its `pid`.
+
+        Args:
+            gauges (dict, optional): Additional gauges of this process, by name, with their labels and values.
+            shared_gauges (dict, optional): Additional gauges of the state shared by all the processes, such as the documents
+                of a queue in a shared database, which are rendered once.
+
+        Returns:
+            str: The metrics.
+        """
+        if self.directory:
+            self.write(gauges)
+            total = Metrics()
+            process_gauges = {}
+            states = self.read_states()
+            # Only the last process started with a given ID may still be running
+            latest = {state["pid"]: state for state in states}
+            for state in states:
+                total.add_state(state)
+                if latest[state["pid"]] is state and (state["pid"] == os.getpid() or is_process_running(state["pid"])):
+                    for name, series in state["gauges"].items():
+                        process_gauges.setdefault(name, []).extend(
+                            ((("pid", state["pid"]),) + to_labels(labels), value) for labels, value in series
+                        )
+            return total.render({**process_gauges, **(shared_gauges or {})})
+
+        with self.lock:
+            lines = self.request_seconds.render() + self.stage_seconds.render() + self.content_bytes.render()
+            names = sorted({name for name, labels in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {name} counter")
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+        for name, series in {**(gauges or {}), **(shared_gauges or {})}.items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+class SamplingProfiler:
+    """
+    SamplingProfiler is a class designed to find where the time of slow extractions goes. While running, it samples
+    the stacks of all the threads of the process at a fixed interval, and the samples can be written in the collapsed
+    stack format read by flame graph tools. Samples include the other requests handled by the worker at the same time.
+    """
+
+    def __init__(self, interval=0.005):
+        """
+        Initializes the SamplingProfiler class.
+
+        Args:
+            interval (float): The number of seconds between two samples.
+        """
+        self.interval = interval
+        self.samples = Counter()
+        self.running = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts sampling in a background thread.
+        """
+        self.running.set()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops sampling.
+        """
+        self.running.clear()
+        if self.thread is not None:
+            self.thread.join()
+
+    def sample(self):
+        """
+        Samples the stacks of the other threads until the profiler is stopped.
+        """
+        own_thread = threading.get_ident()
+        while self.running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def write(self, path):
+        """
+        Writes the samples in the collapsed stack format.
+
+        Args:
+            path (str): The path of the output file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
@@ -0,0 +1,440 @@
+import asyncio
+import heapq
+import itertools
+import math
+import random
+import statistics
+import time
+from collections import deque
+
+from src.utils.metrics import Timings
+
+# Status codes of the responses of the inference backend worth retrying
+TRANSIENT_STATUS_CODES = (408, 425, 429, 500, 502, 503, 504)
+# Status codes that mean the backend is saturated, on which its concurrency limit is reduced
+OVERLOAD_STATUS_CODES = (429, 503)
+
+class OverloadedError(Exception):
+    """
+    Raised when the requests to the language model cannot be scheduled, either because the queue is full or
+    because the inference backend is still overloaded after all the retries.
+    """
+
+    def __init__(self, message, retry_after=1):
+        """
+        Initializes the OverloadedError class.
+
+        Args:
+            message (str): The error message.
+            retry_after (int): The number of seconds after which the client may try again.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def get_status_code(error):
+    """
+    Reads the status code of the HTTP response that caused an error, if any.
+
+    Args:
+        error (Exception): The error, possibly wrapping the error of the HTTP client as its cause.
+
+    Returns:
+        tuple: The status code and the `Retry-After` header of the response, or None for both.
+    """
+    while error is not None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+        if status_code is not None:
+            return status_code, response.headers.get("retry-after")
+        error = error.__cause__
+    return None, None
+
+def parse_retry_after(value, max_delay=None):
+    """
+    Parses a `Retry-After` header given in seconds. Dates are ignored.
+
+    Args:
+        value (str): The value of the header.
+        max_delay (float, optional): The maximum number of seconds, so a backend cannot hold the requests for hours.
+
+    Returns:
+        float: The number of seconds, or None if it is missing or a date.
+    """
+    try:
+        delay = max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+    return min(delay, max_delay) if delay is not None and max_delay is not None else delay
+
+def is_timeout(error):
+    """
+    Checks whether an error is a timeout or a connection failure of the HTTP client.
+
+    Args:
+        error (Exception): The error, possibly wrapping the error of the HTTP client as its cause.
+
+    Returns:
+        bool: Whether the error is a timeout or a connection failure.
+    """
+    while error is not None:
+        # The transport errors of httpx are not subclasses of the builtin ones
+        if isinstance(error, (TimeoutError, ConnectionError)) or any(cls.__name__ == "TransportError" for cls in type(error).__mro__):
+            return True
+        error = error.__cause__
+    return False
+
+class Backend:
+    """
+    Backend is a class designed to track one inference endpoint or token: its client, its adaptive concurrency
+    limit and the number of requests in flight. The limit follows AIMD: it grows by one request per round of
+    successful requests and is halved when the backend reports that it is saturated.
+    """
+
+    def __init__(self, client, max_concurrency):
+        """
+        Initializes the Backend class.
+
+        Args:
+            client (AsyncInferenceClient): The client of the endpoint or token.
+            max_concurrency (int): The maximum number of concurrent requests, which is also the initial limit.
+        """
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self.cooldown_until = 0.0
+
+    @property
+    def available(self):
+        """
+        Checks whether a request can be sent to the backend now.
+
+        Returns:
+            bool: Whether the backend is below its limit and not cooling down.
+        """
+        return self.in_flight < int(self.limit) and time.monotonic() >= self.cooldown_until
+
+    @property
+    def load(self):
+        """
+        Returns the fraction of the limit of the backend in use.
+
+        Returns:
+            float: The number of requests in flight divided by the limit.
+        """
+        return self.in_flight / self.limit
+
+    def on_success(self):
+        """
+        Increases the limit additively after a successful request.
+        """
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def on_overload(self, latency, retry_after=None):
+        """
+        Decreases the limit multiplicatively after the backend reported that it is saturated. The requests that
+        were already in flight when the limit was decreased do not decrease it again.
+
+        Args:
+            latency (float): The number of seconds of the failed request.
+            retry_after (float, optional): The number of seconds the backend asked to wait before the next request.
+        """
+        now = time.monotonic()
+        if now - latency >= self.decreased_at:
+            self.limit = max(1.0, self.limit / 2)
+            self.decreased_at = now
+        if retry_after:
+            self.cooldown_until = max(self.cooldown_until, now + retry_after)
+
+class InferenceScheduler:
+    """
+    InferenceScheduler is a class designed to send the requests to the language model on behalf of all the extractions.
+    Requests wait in a priority queue for a slot on one of the backends, each with an adaptive concurrency limit,
+    and are rejected once the queue is full. Transient errors are retried after a jittered exponential backoff,
+    possibly on another backend, and slow requests can be hedged with a second request once they take longer
+    than the 95th percentile of the recent latencies.
+    """
+
+    # Minimum number of latency samples before the hedging delay is trusted
+    min_hedge_samples = 20
+
+    def __init__(self, clients, max_concurrency=32, max_queue=256, max_retries=3, retry_delay=0.5, max_retry_delay=30, hedge=False):
+        """
+        Initializes the InferenceScheduler class.
+
+        Args:
+            clients (list): The clients of the inference backends, one per endpoint or token.
+            max_concurrency (int): The maximum number of concurrent requests to each backend.
+            max_queue (int): The maximum number of requests waiting for a slot. 0 disables the limit.
+            max_retries (int): The maximum number of retries of a request after a transient error.
+            retry_delay (float): The base number of seconds of the backoff before a retry.
+            max_retry_delay (float): The maximum number of seconds of the backoff before a retry.
+            hedge (bool): Whether a second request is sent to another slot when a request is slower than usual.
+        """
+        self.backends = [Backend(client, max_concurrency) for client in clients]
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.hedge = hedge
+        self.queue = []
+        self.waiting = 0
+        self.sequence = itertools.count()
+        self.latencies = deque(maxlen=256)
+        self.wakeup = None
+        self.counters = {"requests": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "rejected": 0, "overloads": 0}
+
+    def set_max_concurrency(self, max_concurrency):
+        """
+        Changes the maximum number of concurrent requests to each backend.
+
+        Args:
+            max_concurrency (int): The maximum number of concurrent requests to each backend.
+        """
+        for backend in self.backends:
+            backend.max_concurrency = max_concurrency
+            backend.limit = float(max_concurrency)
+
+    def pick(self, exclude=None):
+        """
+        Picks the least loaded backend with a free slot.
+
+        Args:
+            exclude (Backend, optional): A backend not to pick.
+
+        Returns:
+            Backend: The backend, or None if none has a free slot.
+        """
+        candidates = [backend for backend in self.backends if backend is not exclude and backend.available]
+        return min(candidates, key=lambda backend: backend.load, default=None)
+
+    def dispatch(self):
+        """
+        Hands the free slots to the requests waiting in the queue, by priority and then in arrival order.
+        If the backends are cooling down, the queue is dispatched again once the first cooldown ends.
+        """
+        while self.queue:
+            backend = self.pick()
+            if backend is None:
+                break
+            _, _, future = heapq.heappop(self.queue)
+            if future.done():
+                continue
+            self.waiting -= 1
+            backend.in_flight += 1
+            future.set_result(backend)
+        cooldowns = [backend.cooldown_until for backend in self.backends if backend.in_flight < int(backend.limit)]
+        if self.queue and cooldowns and self.wakeup is None:
+            delay = max(0.0, min(cooldowns) - time.monotonic())
+            self.wakeup = asyncio.get_running_loop().call_later(delay, self.on_wakeup)
+
+    def on_wakeup(self):
+        """
+        Dispatches the queue at the end of a cooldown.
+        """
+        self.wakeup = None
+        self.dispatch()
+
+    def get_retry_after(self):
+        """
+        Estimates the number of seconds until the queue has room again, from the recent latencies.
+
+        Returns:
+            int: The number of seconds.
+        """
+        latency = statistics.mean(self.latencies) if self.latencies else 1.0
+        capacity = sum(int(backend.limit) for backend in self.backends) or 1
+        return max(1, math.ceil(latency * self.waiting / capacity))
+
+    async def acquire(self, priority=0, exclude=None, wait=True):
+        """
+        Reserves a slot on a backend, waiting in the queue if none is free.
+
+        Args:
+            priority (int): The priority of the request, lower values are served first.
+            exclude (Backend, optional): A backend not to pick.
+            wait (bool): Whether to wait for a slot if none is free.
+
+        Returns:
+            Backend: The backend holding the slot, or None if none is free and `wait` is False.
+
+        Raises:
+            OverloadedError: If the queue is full.
+        """
+        backend = self.pick(exclude) if not self.waiting or not wait else None
+        if backend is not None:
+            backend.in_flight += 1
+            return backend
+        if not wait:
+            return None
+        if self.max_queue and self.waiting >= self.max_queue:
+            self.counters["rejected"] += 1
+            raise OverloadedError("Too many requests are waiting for the language model", self.get_retry_after())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.queue, (priority, next(self.sequence), future))
+        self.waiting += 1
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just before the cancellation
+                self.release(future.result())
+            else:
+                future.cancel()
+                self.waiting -= 1
+            raise
+
+    def release(self, backend):
+        """
+        Frees a slot on a backend and hands it to the next request in the queue.
+
+        Args:
+            backend (Backend): The backend holding the slot.
+        """
+        backend.in_flight -= 1
+        self.dispatch()
+
+    async def send(self, backend, request):
+        """
+        Sends a request to a backend on which a slot is reserved, and adapts its limit to the outcome.
+
+        Args:
+            backend (Backend): The backend holding the slot.
+            request (callable): The coroutine function sending the request with the client it is given.
+
+        Returns:
+            Any: The response of the request.
+        """
+        start = time.monotonic()
+        try:
+            response = await request(backend.client)
+        except Exception as e:
+            status_code, retry_after = get_status_code(e)
+            if status_code in OVERLOAD_STATUS_CODES or is_timeout(e):
+                backend.on_overload(time.monotonic() - start, parse_retry_after(retry_after, self.max_retry_delay))
+            raise
+        self.latencies.append(time.monotonic() - start)
+        backend.on_success()
+        return response
+
+    def start(self, backend, request):
+        """
+        Starts sending a request in a task. The slot is freed when the task finishes, even if it is cancelled before it runs.
+
+        Args:
+            backend (Backend): The backend holding the slot.
+            request (callable): The coroutine function sending the request with the client it is given.
+
+        Returns:
+            asyncio.Task: The task.
+        """
+        task = asyncio.ensure_future(self.send(backend, request))
+        task.add_done_callback(lambda _: self.release(backend))
+        return task
+
+    def get_hedge_delay(self):
+        """
+        Returns the number of seconds after which a request is hedged: the 95th percentile of the recent latencies.
+
+        Returns:
+            float: The number of seconds, or None if hedging is disabled or there are too few samples.
+        """
+        if not self.hedge or len(self.latencies) < self.min_hedge_samples:
+            return None
+        return statistics.quantiles(self.latencies, n=20, method="inclusive")[18]
+
+    async def attempt(self, request, priority, timings):
+        """
+        Sends a request once, hedging it with a second request if it is slower than usual and a slot is free.
+
+        Args:
+            request (callable): The coroutine function sending the request with the client it is given.
+            priority (int): The priority of the request.
+            timings (Timings): The instrumentation of the extraction.
+
+        Returns:
+            Any: The response of the first request to succeed.
+        """
+        with timings.measure("queue"):
+            backend = await self.acquire(priority)
+        with timings.measure("model"):
+            tasks = {self.start(backend, request)}
+            hedge = None
+            try:
+                delay = self.get_hedge_delay()
+                if delay is not None:
+                    done, _ = await asyncio.wait(tasks, timeout=delay)
+                    # Hedges only use free slots, so they never delay the requests in the queue, and go to
+                    # another backend if there are several
+                    exclude = backend if len(self.backends) > 1 else None
+                    other = None if done else await self.acquire(priority, exclude=exclude, wait=False)
+                    if other is not None:
+                        self.counters["hedges"] += 1
+                        timings.outcome("hedge")
+                        hedge = self.start(other, request)
+                        tasks.add(hedge)
+                error = None
+                while tasks:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is hedge:
+                                self.counters["hedge_wins"] += 1
+                            return task.result()
+                        error = task.exception()
+                raise error
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    async def run(self, request, priority=0, timings=None):
+        """
+        Sends a request to the language model, retrying it after transient errors.
+
+        Args:
+            request (callable): The coroutine function sending the request with the client it is given.
+            priority (int): The priority of the request, lower values are served first.
+            timings (Timings, optional): The instrumentation of the extraction.
+
+        Returns:
+            Any: The response of the request.
+
+        Raises:
+            OverloadedError: If the queue is full or the backends are still overloaded after all the retries.
+            Exception: If the request fails with an error that is not transient.
+        """
+        timings = timings if timings is not None else Timings()
+        self.counters["requests"] += 1
+        for retry in range(self.max_retries + 1):
+            try:
+                return await self.attempt(request, priority, timings)
+            except OverloadedError:
+                raise
+            except Exception as e:
+                status_code, retry_after = get_status_code(e)
+                if status_code not in TRANSIENT_STATUS_CODES and not is_timeout(e):
+                    raise
+                if retry == self.max_retries:
+                    self.counters["overloads"] += 1
+                    raise OverloadedError(f"The inference backend is overloaded: {e}", parse_retry_after(retry_after, self.max_retry_delay) or self.get_retry_after()) from e
+            self.counters["retries"] += 1
+            timings.outcome("retry")
+            # Full jitter spreads the retries of the requests that failed together
+            delay = parse_retry_after(retry_after, self.max_retry_delay) or random.uniform(0, min(self.max_retry_delay, self.retry_delay * 2 ** retry))
+            with timings.measure("backoff"):
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        """
+        Returns the state and the counters of the scheduler.
+
+        Returns:
+            dict: The counters, the number of waiting requests and the limit and requests in flight of the backends.
+        """
+        return {
+            **self.counters,
+            "waiting": self.waiting,
+            "limit": sum(int(backend.limit) for backend in self.backends),
+            "in_flight": sum(backend.in_flight for backend in self.backends),
+        }
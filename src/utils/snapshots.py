@@ -0,0 +1,347 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from lxml import etree
+from src.utils.templates import TemplateStore
+
+class SnapshotStore:
+    """
+    SnapshotStore is a class designed to keep the last extraction of each URL, so a page that is crawled again is
+    only extracted where it changed. A snapshot holds the cleaned HTML content of the page, its hash, the merged
+    result and, for each attribute, the selector and a hash of the subtree of the element it was found in.
+    On the next extraction of the URL, the attributes whose subtree is unchanged are reused with their selectors,
+    the attributes whose subtree changed are read again through their selector if it was matched on the text of its
+    element, and the other attributes are sent to the language model, with the changed regions of the cleaned HTML
+    content as the prompt. Snapshots are persisted in SQLite so they are shared by all workers.
+    """
+
+    # Changed regions larger than this fraction of the cleaned HTML content are not worth a smaller prompt
+    max_region_ratio = 0.5
+    # Number of snapshots saved between two purges of the expired snapshots
+    purge_interval = 1000
+    not_found = ("No CSS Selector Found", "Not Found")
+
+    def __init__(self, path, ttl=2592000):
+        """
+        Initializes the SnapshotStore class.
+
+        Args:
+            path (str): The path of the SQLite database.
+            ttl (float): The number of seconds after which a snapshot is no longer used and is removed.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "partial_hits": 0, "misses": 0, "saved": 0, "purged": 0}
+        self.saves_since_purge = 0
+        self.connection = self.get_connection()
+        with self.lock:
+            self.purge(time.time())
+
+    def get_connection(self):
+        """
+        Opens the SQLite database and creates the snapshots table if it does not exist.
+
+        Returns:
+            sqlite3.Connection: The connection to the SQLite database.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        # WAL lets several worker processes read while one of them writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "url TEXT PRIMARY KEY, cleaned_html BLOB, cleaned_hash TEXT, nodes TEXT NOT NULL, result TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS snapshots_updated_at ON snapshots (updated_at)")
+        return connection
+
+    def purge(self, now):
+        """
+        Removes the expired snapshots, so the database does not keep a snapshot of every URL ever extracted.
+        Must be called with the lock held.
+
+        Args:
+            now (float): The current timestamp.
+        """
+        cursor = self.connection.execute("DELETE FROM snapshots WHERE updated_at <= ?", (now - self.ttl,))
+        self.counters["purged"] += max(cursor.rowcount, 0)
+        self.saves_since_purge = 0
+
+    @staticmethod
+    def get_element_hash(element):
+        """
+        Hashes the subtree of an element: its tags, attributes and text.
+
+        Args:
+            element (lxml.etree.Element): The element.
+
+        Returns:
+            str: The hex digest of the subtree.
+        """
+        digest = hashlib.sha1()
+        for item in element.iter():
+            if isinstance(item.tag, str):
+                digest.update(f"<{item.tag} {sorted(item.attrib.items())}>".encode("utf-8"))
+            if item is not element and item.tail:
+                digest.update(item.tail.strip().encode("utf-8"))
+            if isinstance(item.tag, str) and item.text:
+                digest.update(item.text.strip().encode("utf-8"))
+        return digest.hexdigest()
+
+    def resolve(self, tree, css_selector):
+        """
+        Finds the element a CSS selector generated by ExtractSelectors points to.
+
+        Args:
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+            css_selector (str): The CSS selector.
+
+        Returns:
+            lxml.etree.Element: The element, or None if the selector no longer resolves.
+        """
+        xpath = TemplateStore.css_to_xpath(css_selector)
+        elements = tree.xpath(xpath) if xpath is not None else []
+        return elements[0] if elements else None
+
+    def get_node(self, tree, selectors):
+        """
+        Records the element of an attribute: its selectors and the hash of its subtree.
+
+        Args:
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+            selectors (dict): The CSS selector and the XPath of the attribute.
+
+        Returns:
+            dict: The selectors and the hash of the element, or None if the attribute has no element.
+        """
+        if not selectors or selectors["css_selector"] in self.not_found:
+            return None
+        element = self.resolve(tree, selectors["css_selector"])
+        if element is None:
+            return None
+        return {"selectors": selectors, "hash": self.get_element_hash(element)}
+
+    def get(self, url):
+        """
+        Reads the snapshot of a URL.
+
+        Args:
+            url (str): The URL of the page.
+
+        Returns:
+            dict: The snapshot, or None if the URL has no snapshot or it expired.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT cleaned_html, cleaned_hash, nodes, result FROM snapshots WHERE url = ? AND updated_at > ?",
+                (url, time.time() - self.ttl)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "cleaned_html": zlib.decompress(row[0]).decode("utf-8") if row[0] is not None else None,
+            "cleaned_hash": row[1],
+            "nodes": json.loads(row[2]),
+            "result": json.loads(row[3]),
+        }
+
+    def match(self, tree, snapshot, fields):
+        """
+        Compares a page with the snapshot of its URL and recovers the attributes that can be read without the language model.
+
+        Args:
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+            snapshot (dict): The snapshot of the URL.
+            fields (list): The attributes to recover.
+
+        Returns:
+            tuple: The recovered attributes, their selectors and the attributes that must be extracted by the language model.
+        """
+        attributes, selectors, missing, unanchored = {}, {}, [], []
+        for field in fields:
+            previous = snapshot["result"].get(field)
+            node = snapshot["nodes"].get(field)
+            if previous is None:
+                missing.append(field)
+            elif isinstance(previous, list):
+                images = []
+                for item, item_node in zip(previous, node or []):
+                    element = self.resolve(tree, item_node["selectors"]["css_selector"]) if item_node else None
+                    source = element.get("src") if element is not None else None
+                    if source:
+                        images.append((source, item["selectors"] if source == item["value"] else item_node["selectors"]))
+                if images:
+                    attributes[field] = [source for source, _ in images]
+                    selectors[field] = [item_selectors for _, item_selectors in images]
+                else:
+                    (missing if node else unanchored).append(field)
+            elif node is None:
+                # Values that are not on the page, such as generated descriptions, cannot be checked
+                unanchored.append(field)
+            else:
+                element = self.resolve(tree, node["selectors"]["css_selector"])
+                if element is not None and self.get_element_hash(element) == node["hash"]:
+                    attributes[field], selectors[field] = previous["value"], previous["selectors"]
+                elif element is not None and TemplateStore.is_learnable(node["selectors"]) and TemplateStore.get_text(element) is not None:
+                    attributes[field], selectors[field] = TemplateStore.get_text(element), node["selectors"]
+                else:
+                    missing.append(field)
+        # Values that cannot be checked are only reused if the rest of the page could be read without the language model
+        if missing:
+            missing.extend(unanchored)
+        else:
+            for field in unanchored:
+                attributes[field], selectors[field] = snapshot["result"][field]["value"], snapshot["result"][field]["selectors"]
+        with self.lock:
+            self.counters["partial_hits" if missing else "hits"] += 1
+        return attributes, selectors, [field for field in fields if field in missing]
+
+    @staticmethod
+    def was_found(snapshot, field):
+        """
+        Checks whether an attribute was found on the page when its snapshot was taken.
+
+        Args:
+            snapshot (dict): The snapshot of the URL.
+            field (str): The attribute.
+
+        Returns:
+            bool: True if the snapshot holds a value for the attribute, False otherwise.
+        """
+        previous = snapshot["result"].get(field)
+        return bool(previous) and (isinstance(previous, list) or previous["value"] != "None")
+
+    def get_subtree_hashes(self, tree):
+        """
+        Hashes every subtree of a tree, bottom-up.
+
+        Args:
+            tree (lxml.etree.Element): The root element.
+
+        Returns:
+            dict: The hash of the subtree of each element.
+        """
+        hashes = {}
+        # Walk the tree with an explicit stack so deeply nested pages do not hit the recursion limit
+        stack = [(tree, False)]
+        while stack:
+            element, visited = stack.pop()
+            children = [child for child in element if isinstance(child.tag, str)]
+            if not visited:
+                stack.append((element, True))
+                stack.extend((child, False) for child in children)
+                continue
+            digest = hashlib.sha1(f"<{element.tag} {sorted(element.attrib.items())}>{(element.text or '').strip()}".encode("utf-8"))
+            for child in children:
+                digest.update(f"{hashes[child]}{(child.tail or '').strip()}".encode("utf-8"))
+            hashes[element] = digest.hexdigest()
+        return hashes
+
+    def get_changed_html(self, previous_html, cleaned_html):
+        """
+        Diffs the cleaned HTML content of a page with the one of its snapshot by subtree hashes, and keeps the
+        regions that changed: the deepest changed elements along with their previous and next siblings, which
+        usually hold their labels.
+
+        Args:
+            previous_html (str): The cleaned HTML content of the snapshot.
+            cleaned_html (str): The cleaned HTML content of the page.
+
+        Returns:
+            str: The HTML content of the changed regions, or None if nothing changed or if they are not much smaller
+                than the whole cleaned HTML content.
+        """
+        if not previous_html or not cleaned_html:
+            return None
+        previous_tree, tree = etree.HTML(previous_html), etree.HTML(cleaned_html)
+        if previous_tree is None or tree is None:
+            return None
+        previous_hashes = set(self.get_subtree_hashes(previous_tree).values())
+        hashes = self.get_subtree_hashes(tree)
+        changed = {element for element, digest in hashes.items() if digest not in previous_hashes}
+        regions = set()
+        for element in changed:
+            if any(child in changed for child in element):
+                continue
+            regions.update(item for item in (element.getprevious(), element, element.getnext()) if item is not None)
+        # Regions nested in other regions are already included, and the others are kept in document order
+        changed_html = "".join(
+            etree.tostring(element, method="html", encoding="unicode", with_tail=False) for element in tree.iter()
+            if element in regions and not any(ancestor in regions for ancestor in element.iterancestors())
+        )
+        if not changed_html or len(changed_html) > len(cleaned_html) * self.max_region_ratio:
+            return None
+        return changed_html
+
+    def save(self, url, tree, cleaned_html, result, snapshot=None):
+        """
+        Records the extraction of a URL as its snapshot. The attributes that were not extracted this time are kept
+        from the previous snapshot.
+
+        Args:
+            url (str): The URL of the page.
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+            cleaned_html (str): The cleaned HTML content, or None if the page was not cleaned this time.
+            result (dict): The merged attributes and selectors.
+            snapshot (dict, optional): The previous snapshot of the URL.
+        """
+        nodes = {}
+        for field, value in result.items():
+            if isinstance(value, list):
+                nodes[field] = [self.get_node(tree, item["selectors"]) for item in value]
+            else:
+                nodes[field] = self.get_node(tree, value["selectors"])
+        if snapshot is not None:
+            nodes = {**snapshot["nodes"], **nodes}
+            result = {**snapshot["result"], **result}
+            if cleaned_html is None:
+                cleaned_html = snapshot["cleaned_html"]
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO snapshots (url, cleaned_html, cleaned_hash, nodes, result, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    zlib.compress(cleaned_html.encode("utf-8"), 1) if cleaned_html is not None else None,
+                    hashlib.sha1(cleaned_html.encode("utf-8")).hexdigest() if cleaned_html is not None else None,
+                    json.dumps(nodes), json.dumps(result), now
+                )
+            )
+            self.counters["saved"] += 1
+            self.saves_since_purge += 1
+            if self.saves_since_purge >= self.purge_interval:
+                self.purge(now)
+
+    def record_miss(self):
+        """
+        Counts an extraction of a URL without a snapshot.
+        """
+        with self.lock:
+            self.counters["misses"] += 1
+
+    def stats(self):
+        """
+        Returns the counters of the snapshot store.
+
+        Returns:
+            dict: The counters.
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def close(self):
+        """
+        Closes the connection to the SQLite database.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,388 @@
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+class TemplateStore:
+    """
+    TemplateStore is a class designed to learn the selectors of the pages built from the same template.
+    A page is fingerprinted with a MinHash signature of the tag paths of its upper levels, and the selectors
+    validated on one page are reused to extract the attributes of the next pages with a similar fingerprint
+    without calling the language model. Templates are persisted in SQLite so they are shared by all workers.
+    """
+
+    # Only the upper levels of the tree are fingerprinted, as they hold the layout of the page while
+    # the lower levels vary with the product (descriptions, reviews, recommendations)
+    max_depth = 8
+    num_permutations = 64
+    num_bands = 16
+    # Attributes a template must have selectors for, otherwise it is not learned
+    required_fields = ("product_name", "product_price")
+    # Selectors matched on the text of the descendants of their element or on some of its tokens do not read back
+    # the value from the first text node of the element, so they are not learned
+    min_confidence = 0.95
+    mersenne_prime = (1 << 61) - 1
+    css_component_pattern = re.compile(r"^([\w-]+)(?::nth-of-type\((\d+)\))?$")
+    whitespace_pattern = re.compile(r"\s+")
+
+    def __init__(self, path=None, similarity=0.8):
+        """
+        Initializes the TemplateStore class.
+
+        Args:
+            path (str, optional): The path of the SQLite database. If not provided, templates are only kept in memory.
+            similarity (float): The minimum estimated Jaccard similarity for a page to match a template.
+        """
+        self.path = path
+        self.similarity = similarity
+        self.templates = {}
+        self.bands = {}
+        self.last_loaded_id = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stale": 0, "learned": 0}
+        # Fixed seed so every worker computes the same signature for the same page
+        generator = random.Random(0)
+        self.permutations = [
+            (generator.randrange(1, self.mersenne_prime), generator.randrange(0, self.mersenne_prime))
+            for _ in range(self.num_permutations)
+        ]
+        self.connection = self.get_connection() if path else None
+        self.load_templates()
+
+    def get_connection(self):
+        """
+        Opens the SQLite database and creates the templates table if it does not exist.
+
+        Returns:
+            sqlite3.Connection: The connection to the SQLite database.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS templates ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, signature TEXT NOT NULL, selectors TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        return connection
+
+    def load_templates(self):
+        """
+        Loads the templates learned by other workers since the last load.
+        """
+        if self.connection is None:
+            return
+        rows = self.connection.execute(
+            "SELECT id, signature, selectors FROM templates WHERE id > ? ORDER BY id", (self.last_loaded_id,)
+        ).fetchall()
+        for template_id, signature, selectors in rows:
+            self.add_template(template_id, json.loads(signature), json.loads(selectors))
+            self.last_loaded_id = template_id
+
+    def add_template(self, template_id, signature, selectors):
+        """
+        Adds a template to the in-memory index. Must be called with the lock held or during initialization.
+
+        Args:
+            template_id (int): The ID of the template.
+            signature (list): The MinHash signature of the template.
+            selectors (dict): The learned CSS selectors for each attribute.
+        """
+        self.templates[template_id] = {"signature": signature, "selectors": selectors}
+        for band in self.get_bands(signature):
+            self.bands.setdefault(band, set()).add(template_id)
+
+    def get_bands(self, signature):
+        """
+        Splits a signature into the locality sensitive hashing bands used to find candidate templates.
+
+        Args:
+            signature (list): The MinHash signature.
+
+        Returns:
+            list: A key for each band of the signature.
+        """
+        rows = self.num_permutations // self.num_bands
+        return [(index, tuple(signature[index * rows:(index + 1) * rows])) for index in range(self.num_bands)]
+
+    def get_fingerprint(self, tree):
+        """
+        Computes the MinHash signature of the set of tag paths, including class names, of the upper levels of a tree.
+
+        Args:
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+
+        Returns:
+            list: The MinHash signature of the tree.
+        """
+        shingles = set()
+        stack = [(tree, 0, 0)] if tree is not None else []
+        while stack:
+            element, parent_hash, depth = stack.pop()
+            if not isinstance(element.tag, str) or depth > self.max_depth:
+                continue
+            segment = element.tag + "".join(f".{name}" for name in sorted(element.get("class", "").split()))
+            # Chaining the checksums hashes the whole path from the root without building the path strings
+            path_hash = zlib.crc32(segment.encode("utf-8"), parent_hash)
+            shingles.add(path_hash)
+            stack.extend((child, path_hash, depth + 1) for child in element)
+        if not shingles:
+            return None
+        return [min((a * shingle + b) % self.mersenne_prime for shingle in shingles) for a, b in self.permutations]
+
+    def get_similarity(self, signature, other):
+        """
+        Estimates the Jaccard similarity of two pages from their signatures.
+
+        Args:
+            signature (list): The MinHash signature of the first page.
+            other (list): The MinHash signature of the second page.
+
+        Returns:
+            float: The estimated Jaccard similarity.
+        """
+        return sum(1 for a, b in zip(signature, other) if a == b) / self.num_permutations
+
+    def find_template(self, signature):
+        """
+        Finds the most similar template for a signature.
+
+        Args:
+            signature (list): The MinHash signature of the page.
+
+        Returns:
+            tuple: The ID and the template, or (None, None) if no template is similar enough.
+        """
+        with self.lock:
+            for attempt in range(2):
+                candidates = set()
+                for band in self.get_bands(signature):
+                    candidates.update(self.bands.get(band, ()))
+                best_id, best_similarity = None, self.similarity
+                for template_id in candidates:
+                    similarity = self.get_similarity(signature, self.templates[template_id]["signature"])
+                    if similarity >= best_similarity:
+                        best_id, best_similarity = template_id, similarity
+                if best_id is not None:
+                    return best_id, self.templates[best_id]
+                # Pick up the templates learned by other workers before giving up
+                if attempt == 0:
+                    self.load_templates()
+            return None, None
+
+    @classmethod
+    def css_to_xpath(cls, css_selector, all_of_type=False):
+        """
+        Converts a CSS selector generated by ExtractSelectors into an XPath that selects the same element.
+
+        Args:
+            css_selector (str): The CSS selector made of `tag` and `tag:nth-of-type(n)` components.
+            all_of_type (bool): Whether the last component should select all the siblings of the same type.
+
+        Returns:
+            str: The equivalent XPath, or None if the selector cannot be converted.
+        """
+        steps = []
+        components = css_selector.split(" > ")
+        for index, component in enumerate(components):
+            match = cls.css_component_pattern.match(component.strip())
+            if not match:
+                return None
+            tag, position = match.groups()
+            if all_of_type and index == len(components) - 1:
+                steps.append(tag)
+            else:
+                steps.append(f"{tag}[{position or 1}]")
+        return "/" + "/".join(steps)
+
+    @classmethod
+    def is_learnable(cls, selectors):
+        """
+        Checks whether the selectors of an attribute can be used to read it again.
+
+        Args:
+            selectors (dict): The CSS selector, the XPath and the confidence of the match of the attribute.
+
+        Returns:
+            bool: True if the element was found with enough confidence, False otherwise.
+        """
+        return selectors["css_selector"] not in ("No CSS Selector Found", "Not Found") and selectors.get("confidence", 1.0) >= cls.min_confidence
+
+    def learn(self, signature, attributes, selectors, template_id=None):
+        """
+        Records the selectors that were found for the attributes of a page as the template of its layout.
+
+        Args:
+            signature (list): The MinHash signature of the page.
+            attributes (dict): The extracted attributes.
+            selectors (dict): The CSS selectors and XPaths extracted for the attributes.
+            template_id (int, optional): The ID of the template to replace, if the page matched a stale template.
+        """
+        learned = {}
+        for key, value in selectors.items():
+            if isinstance(value, list):
+                found = [item["css_selector"] for item in value if self.is_learnable(item)]
+                if found:
+                    learned[key] = found
+            elif self.is_learnable(value) and isinstance(attributes.get(key), str):
+                learned[key] = value["css_selector"]
+        if signature is None or not all(field in learned for field in self.required_fields):
+            return
+
+        with self.lock:
+            now = time.time()
+            if template_id is not None:
+                self.templates[template_id]["selectors"] = learned
+                if self.connection is not None:
+                    self.connection.execute(
+                        "UPDATE templates SET selectors = ?, updated_at = ? WHERE id = ?", (json.dumps(learned), now, template_id)
+                    )
+            elif self.connection is not None:
+                cursor = self.connection.execute(
+                    "INSERT INTO templates (signature, selectors, updated_at) VALUES (?, ?, ?)",
+                    (json.dumps(signature), json.dumps(learned), now)
+                )
+                self.add_template(cursor.lastrowid, signature, learned)
+            else:
+                self.add_template(len(self.templates) + 1, signature, learned)
+            self.counters["learned"] += 1
+
+    @classmethod
+    def get_text(cls, element):
+        """
+        Reads the value of a text attribute from its element, with its whitespace normalized like the values
+        matched by ExtractSelectors.
+
+        Args:
+            element (lxml.etree.Element): The element.
+
+        Returns:
+            str: The first non-empty text node of the element, or None if there is none.
+        """
+        texts = [text for text in element.xpath("text()") if text.strip()]
+        return cls.whitespace_pattern.sub(" ", texts[0]).strip() if texts else None
+
+    def extract_attributes(self, tree, template):
+        """
+        Extracts the attributes of a page with the selectors of a template.
+
+        Args:
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+            template (dict): The matching template.
+
+        Returns:
+            dict: The extracted attributes, or None if a learned selector no longer matches the page.
+        """
+        attributes = {}
+        for key, css_selector in template["selectors"].items():
+            if isinstance(css_selector, list):
+                # Pages of the same template show a different number of images, so every sibling
+                # of the same type as a learned image is collected
+                images = []
+                for xpath in dict.fromkeys(self.css_to_xpath(item, all_of_type=True) for item in css_selector):
+                    if xpath is None:
+                        return None
+                    for element in tree.xpath(xpath):
+                        source = element.get("src")
+                        if source and source not in images:
+                            images.append(source)
+                if not images:
+                    return None
+                attributes[key] = images
+            else:
+                xpath = self.css_to_xpath(css_selector)
+                elements = tree.xpath(xpath) if xpath is not None else []
+                text = self.get_text(elements[0]) if elements else None
+                if text is None:
+                    return None
+                attributes[key] = text
+        return attributes
+
+    def match(self, tree):
+        """
+        Fingerprints a page and extracts its attributes with the selectors of a matching template.
+
+        Args:
+            tree (lxml.etree.Element): The root element of the parsed HTML content.
+
+        Returns:
+            tuple: The signature of the page, the ID of the matching template and the extracted attributes.
+                The attributes are None if no template matches or if the template is stale.
+        """
+        signature = self.get_fingerprint(tree)
+        if signature is None:
+            return None, None, None
+        template_id, template = self.find_template(signature)
+        attributes = self.extract_attributes(tree, template) if template is not None else None
+        with self.lock:
+            if template is None:
+                self.counters["misses"] += 1
+            elif attributes is None:
+                self.counters["stale"] += 1
+            else:
+                self.counters["hits"] += 1
+        return signature, template_id, attributes
+
+    @staticmethod
+    def get_xpath(element):
+        """
+        Generates the XPath of an element in the format of ExtractSelectors, whose steps hold the position of each
+        element among all its siblings.
+
+        Args:
+            element (lxml.etree.Element): The element.
+
+        Returns:
+            str: The XPath of the element.
+        """
+        steps = [f"{item.tag}[{len(list(item.itersiblings(preceding=True))) + 1}]" for item in (element, *element.iterancestors())]
+        return "/" + "/".join(reversed(steps))
+
+    def get_selectors(self, template_id, fields, tree):
+        """
+        Returns the learned selectors of a template for some attributes of a page, in the format of ExtractSelectors,
+        so the attributes it extracted keep the selectors they were read with. The selectors of the images are not
+        returned, as the images of a page are found again by their exact URL.
+
+        Args:
+            template_id (int): The ID of the template.
+            fields (list): The attributes to return the selectors of.
+            tree (lxml.etree.Element): The root element of the parsed HTML content the attributes were extracted from.
+
+        Returns:
+            dict: The CSS selector, the XPath and the confidence of each attribute the template has a selector for.
+        """
+        with self.lock:
+            template = self.templates.get(template_id)
+            learned = dict(template["selectors"]) if template is not None else {}
+        selectors = {}
+        for field in fields:
+            css_selector = learned.get(field)
+            xpath = self.css_to_xpath(css_selector) if isinstance(css_selector, str) else None
+            elements = tree.xpath(xpath) if xpath is not None else []
+            if elements:
+                selectors[field] = {"css_selector": css_selector, "xpath": self.get_xpath(elements[0]), "confidence": 1.0}
+        return selectors
+
+    def stats(self):
+        """
+        Returns the counters of the template store.
+
+        Returns:
+            dict: The counters and the number of known templates.
+        """
+        with self.lock:
+            return {**self.counters, "templates": len(self.templates)}
+
+    def close(self):
+        """
+        Closes the connection to the SQLite database.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
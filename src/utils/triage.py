@@ -0,0 +1,162 @@
+import re
+
+from src.utils.utils import CheckHTMLContent, StreamingHTMLParser
+
+class PageTriage:
+    """
+    PageTriage is a class designed to classify a page before it is cleaned and sent to the language model, from the
+    first characters of its HTML content only. A page is classified as `not_html` (binary content, XML or text that
+    only starts like a tag), `bot_wall` (captcha and bot challenge interstitials), `empty_shell` (not found pages and
+    pages without content), `listing` (search results and category pages) or `product`. The checks are plain string
+    and regular expression searches, so they cost a fraction of the parsing of the page.
+    """
+
+    # Number of characters of the HTML content that are looked at, as many as the streaming parser keeps
+    prefix_chars = StreamingHTMLParser.head_chars
+    # Share of control characters above which the content is considered binary
+    max_control_ratio = 0.05
+    # Number of characters of visible text below which a page without images or structured data is an empty shell
+    min_text_chars = 200
+    page_types = ("not_html", "bot_wall", "empty_shell", "listing", "product")
+    descriptions = {
+        "not_html": "The provided content is not HTML",
+        "bot_wall": "The page is a captcha or a bot challenge",
+        "empty_shell": "The page is not found or has no content",
+        "listing": "The page lists several products",
+    }
+
+    html_tag_pattern = re.compile(
+        r"<(?:!doctype\s+html|html|head|body|title|meta|link|div|span|p|a|img|ul|ol|li|table|section|main|article|header|nav|form|h[1-6])[\s>/]",
+        re.IGNORECASE
+    )
+    control_pattern = re.compile("[\x00-\x08\x0b\x0e-\x1f\ufffd]")
+    title_pattern = re.compile(r"<title[^>]*>([^<]*)", re.IGNORECASE)
+    bot_wall_title_pattern = re.compile(
+        r"just a moment|attention required|access denied|are you a (?:robot|human)|verify(?:ing)? you are (?:a )?human"
+        r"|pardon our interruption|security check|robot check|captcha|request blocked|bot detection",
+        re.IGNORECASE
+    )
+    # Markers of the challenge pages of the common bot protections, which are also loaded by some regular pages
+    bot_wall_markers = (
+        "cf-browser-verification", "cf_chl_", "_incapsula_resource", "captcha-delivery.com", "px-captcha", "x5secdata",
+        "/punish?", "g-recaptcha", "h-captcha", "geo.captcha"
+    )
+    # A bare 404 is also the name of products (Peugeot 404, Levi's 404), so it only counts next to error or page,
+    # or alone at the start of the title
+    not_found_title_pattern = re.compile(
+        r"\b(?:error|page)\s*404\b|\b404\s*(?:error|page)\b|^404\s*(?:$|[-|:\u2013\u2014])|not found|no longer available"
+        r"|page unavailable|(?:does not|doesn't) exist",
+        re.IGNORECASE
+    )
+    hidden_pattern = re.compile(r"<(script|style|noscript|template)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+    tag_pattern = re.compile(r"<[^>]*>")
+    # Markers of images and structured data, which may hold the attributes of a page with little text
+    content_markers = ("<img", "application/ld+json", "itemtype=", "og:title")
+    # The types of schema.org are case sensitive. Substring searches are much faster than regular expressions, so the patterns
+    # are only run if one of the types is found
+    listing_types = ("ItemList", "CollectionPage", "SearchResultsPage", "OfferCatalog", "product.group")
+    listing_type_pattern = re.compile(r"(?:@type[\"']\s*:\s*[\"']|schema\.org/)(?:ItemList|CollectionPage|SearchResultsPage|OfferCatalog)[\"']")
+    listing_meta_pattern = re.compile(r"og:type[\"'][^>]*content=[\"']product\.group[\"']")
+    product_type_pattern = re.compile(r"(?:@type[\"']\s*:\s*[\"']|schema\.org/)Product[\"']")
+
+    def __init__(self, prefix, size=None):
+        """
+        Initializes the PageTriage class and classifies the page.
+
+        Args:
+            prefix (str): The first characters of the HTML content, at least `prefix_chars` of them if the content is longer.
+            size (int, optional): The number of characters of the whole HTML content, if it is known.
+        """
+        self.prefix = (prefix or "")[:self.prefix_chars]
+        self.lowered = self.prefix.lower()
+        # The checks that need the whole page are only made if it fits in the prefix
+        self.complete = size is not None and size <= len(self.prefix)
+        self.page_type = self.classify()
+
+    def is_html(self):
+        """
+        Checks that the content starts with a tag, is not binary and holds HTML tags.
+
+        Returns:
+            bool: True if the content is HTML, False otherwise.
+        """
+        if not CheckHTMLContent(self.prefix).is_html:
+            return False
+        if len(self.control_pattern.findall(self.prefix)) > len(self.prefix) * self.max_control_ratio:
+            return False
+        return self.html_tag_pattern.search(self.prefix) is not None
+
+    def get_title(self):
+        """
+        Reads the title of the page.
+
+        Returns:
+            str: The title, or an empty string if the page has no title in the prefix.
+        """
+        match = self.title_pattern.search(self.prefix)
+        return match.group(1).strip() if match else ""
+
+    def is_bot_wall(self, title):
+        """
+        Checks whether the page is a captcha or a bot challenge. The markers of the bot protections are only
+        trusted on small pages, as the scripts of the protections are also loaded by regular pages.
+
+        Args:
+            title (str): The title of the page.
+
+        Returns:
+            bool: True if the page is a bot wall, False otherwise.
+        """
+        if title and self.bot_wall_title_pattern.search(title):
+            return True
+        return self.complete and any(marker in self.lowered for marker in self.bot_wall_markers)
+
+    def is_empty_shell(self, title):
+        """
+        Checks whether the page is a not found page, or a page with almost no visible text and no images nor structured data.
+
+        Args:
+            title (str): The title of the page.
+
+        Returns:
+            bool: True if the page is an empty shell, False otherwise.
+        """
+        if title and self.not_found_title_pattern.search(title):
+            return True
+        if not self.complete or any(marker in self.lowered for marker in self.content_markers):
+            return False
+        text = self.tag_pattern.sub(" ", self.hidden_pattern.sub(" ", self.prefix))
+        return len("".join(text.split())) < self.min_text_chars
+
+    def is_listing(self):
+        """
+        Checks whether the structured data of the page describes a list of products rather than one product.
+        Product pages also describe their related products and their variants as products, so several products
+        only make a listing if the page is marked up as a list or a collection.
+
+        Returns:
+            bool: True if the page is a listing, False otherwise.
+        """
+        if not any(listing_type in self.prefix for listing_type in self.listing_types):
+            return False
+        if not (self.listing_type_pattern.search(self.prefix) or self.listing_meta_pattern.search(self.prefix)):
+            return False
+        return len(self.product_type_pattern.findall(self.prefix)) != 1
+
+    def classify(self):
+        """
+        Classifies the page.
+
+        Returns:
+            str: The type of the page, one of `page_types`.
+        """
+        if not self.is_html():
+            return "not_html"
+        title = self.get_title()
+        if self.is_bot_wall(title):
+            return "bot_wall"
+        if self.is_empty_shell(title):
+            return "empty_shell"
+        if self.is_listing():
+            return "listing"
+        return "product"
@@ -1,4 +1,5 @@
-from bs4 import BeautifulSoup
+from html import escape
+from lxml import etree
 import re
 
 class MergeAttributesAndSelectors:
@@ -54,6 +55,91 @@ class MergeAttributesAndSelectors:
                     }
         return result
 
+class AttributeResult:
+    """
+    AttributeResult is a class designed to hold the value of an attribute and the selectors of its element, without
+    the placeholders of the selectors that were not found and without the next best candidates.
+    """
+
+    __slots__ = ("value", "css_selector", "xpath", "confidence")
+    not_found = ("No CSS Selector Found", "Not Found")
+
+    def __init__(self, value, css_selector=None, xpath=None, confidence=None):
+        """
+        Initializes the AttributeResult class.
+
+        Args:
+            value (str): The value of the attribute.
+            css_selector (str, optional): The CSS selector of the element of the attribute, None if it was not found.
+            xpath (str, optional): The XPath of the element of the attribute, None if it was not found.
+            confidence (float, optional): The confidence of the match of the value to the element.
+        """
+        self.value = value
+        self.css_selector = css_selector
+        self.xpath = xpath
+        self.confidence = confidence
+
+    @classmethod
+    def from_merged(cls, item):
+        """
+        Creates the result of an attribute from its merged value and selectors.
+
+        Args:
+            item (dict): The `value` and the `selectors` of the attribute, as merged by MergeAttributesAndSelectors.
+
+        Returns:
+            AttributeResult: The result of the attribute.
+        """
+        selectors = item["selectors"]
+        if not selectors or selectors["css_selector"] in cls.not_found:
+            return cls(item["value"])
+        return cls(item["value"], selectors["css_selector"], selectors["xpath"], selectors.get("confidence"))
+
+    def to_dict(self):
+        """
+        Converts the result of the attribute to a dictionary with short keys, holding the selectors only if they were found.
+
+        Returns:
+            dict: The `value`, and the `css`, `xpath` and `confidence` of the element if it was found.
+        """
+        if self.css_selector is None:
+            return {"value": self.value}
+        return {"value": self.value, "css": self.css_selector, "xpath": self.xpath, "confidence": self.confidence}
+
+class CompactResult:
+    """
+    CompactResult is a class designed to hold the result of an extraction as typed, slotted objects rather than nested
+    dictionaries, and to convert it to the compact output, which is much smaller for pages with many images.
+    """
+
+    __slots__ = ("attributes",)
+
+    def __init__(self, result):
+        """
+        Initializes the CompactResult class with the merged attributes and selectors.
+
+        Args:
+            result (dict): The merged attributes and selectors, or the values of the attributes if the selectors were not extracted.
+        """
+        self.attributes = {}
+        for key, value in result.items():
+            if isinstance(value, list):
+                self.attributes[key] = [AttributeResult.from_merged(item) if isinstance(item, dict) else AttributeResult(item) for item in value]
+            else:
+                self.attributes[key] = AttributeResult.from_merged(value) if isinstance(value, dict) else AttributeResult(value)
+
+    def to_dict(self):
+        """
+        Converts the result to the compact output.
+
+        Returns:
+            dict: The compact result of each attribute, a list of them for the product images.
+        """
+        return {
+            key: [item.to_dict() for item in value] if isinstance(value, list) else value.to_dict()
+            for key, value in self.attributes.items()
+        }
+
 class CheckHTMLContent:
     """
     CheckHTMLContent is a class designed to verify if the provided content is valid HTML.
@@ -87,45 +173,350 @@ class CheckHTMLContent:
             return False
         
 
+class ParsedHTML:
+    """
+    ParsedHTML is a class designed to parse HTML content once so that the same lxml tree can be shared
+    by the cleaning, prompt building and selector extraction stages of a request.
+    The content of the script, style and svg elements is never used by these stages, so it is dropped from the tree,
+    which is kept in memory for the whole request. The elements themselves are kept so the selectors do not change.
+    """
+
+    pruned_tags = ("script", "style", "svg")
+
+    def __init__(self, html_content, tree=None, head=None, size=None):
+        """
+        Initializes the ParsedHTML class with the provided HTML content.
+
+        Args:
+            html_content (str): The raw HTML content, or None if the tree is provided.
+            tree (lxml.etree.Element, optional): The root element of HTML content already parsed by a StreamingHTMLParser.
+            head (str, optional): The first characters of the HTML content parsed by a StreamingHTMLParser.
+            size (int, optional): The number of characters of the HTML content parsed by a StreamingHTMLParser.
+        """
+        self.html_content = html_content
+        self.head = head
+        self.size = size
+        self.tree = tree if tree is not None else self.parse_html()
+
+    @classmethod
+    def prune(cls, element):
+        """
+        Drops the content of a script, style or svg element, keeping its tail. JSON-LD scripts are kept
+        as they hold the structured data of the page.
+
+        Args:
+            element (lxml.etree.Element): The element to prune.
+        """
+        if element.tag == "script" and (element.get("type") or "").strip().lower() == "application/ld+json":
+            return
+        element.clear(keep_tail=True)
+
+    def parse_html(self):
+        """
+        Parses the HTML content into an lxml tree.
+
+        Returns:
+            lxml.etree.Element: The root element of the parsed HTML content.
+        """
+        tree = etree.HTML(self.html_content)
+        if tree is not None:
+            for element in list(tree.iter(*self.pruned_tags)):
+                self.prune(element)
+        return tree
+
+class StreamingHTMLParser:
+    """
+    StreamingHTMLParser is a class designed to parse HTML content fed in chunks, so the raw content never has to be
+    held in memory in full. The content of the script, style and svg elements is dropped as soon as they are closed.
+    Only the first characters of the content are kept, for the triage of the page.
+    """
+
+    # Number of characters of the HTML content that are kept
+    head_chars = 65536
+
+    def __init__(self):
+        """
+        Initializes the StreamingHTMLParser class.
+        """
+        self.parser = etree.HTMLPullParser(events=("end",), tag=ParsedHTML.pruned_tags)
+        self.head = []
+        self.head_size = 0
+        self.size = 0
+
+    def feed(self, html_content):
+        """
+        Parses a chunk of HTML content.
+
+        Args:
+            html_content (str): The chunk of HTML content.
+        """
+        if self.head_size < self.head_chars:
+            self.head.append(html_content[:self.head_chars - self.head_size])
+            self.head_size += len(self.head[-1])
+        self.size += len(html_content)
+        self.parser.feed(html_content)
+        for _, element in self.parser.read_events():
+            ParsedHTML.prune(element)
+
+    def close(self):
+        """
+        Finishes parsing the HTML content.
+
+        Returns:
+            ParsedHTML: The parsed HTML content, or None if the content is empty.
+        """
+        try:
+            tree = self.parser.close()
+        except etree.XMLSyntaxError:
+            tree = None
+        if tree is None:
+            return None
+        for _, element in self.parser.read_events():
+            ParsedHTML.prune(element)
+        return ParsedHTML(None, tree=tree, head="".join(self.head), size=self.size)
+
 class CleanHTML:
     """
-    CleanHTML is a class designed to clean HTML content by removing scripts, styles, anchor, svg elements, style attributes, and unnecessary tags.
+    CleanHTML is a class designed to clean HTML content by removing scripts, styles, anchor, svg elements, attributes
+    that are not useful to the language model, repeated sibling blocks and unnecessary tags. If the cleaned content
+    does not fit the token budget, the regions of the page most likely to hold product data are kept.
     """
 
-    def __init__(self, html_content):
+    removed_tags = {'script', 'style', 'a', 'svg'}
+    unwrapped_tags = {'div', 'span', 'header', 'footer', 'nav', 'aside', 'form', 'iframe', 'noscript', 'input', 'textarea', 'button', 'ul'}
+    void_tags = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+    allowed_attributes = {'src', 'alt', 'title', 'itemprop', 'itemtype', 'content', 'datetime', 'value'}
+    # Runs of more identical sibling blocks than the threshold (carousels, recommendation lists) are cut down
+    repeated_siblings_threshold = 10
+    max_repeated_siblings = 3
+    # Rough number of characters per token of the language model for HTML content
+    chars_per_token = 4
+    # Maximum number of tokens of a region that is ranked as a whole
+    region_tokens = 256
+    positive_keywords = ('product', 'price', 'title', 'name', 'brand', 'gallery', 'image', 'detail', 'description', 'spec', 'sku', 'category', 'breadcrumb', 'pdp', 'buy')
+    negative_keywords = ('review', 'comment', 'rating', 'recommend', 'related', 'similar', 'carousel', 'footer', 'nav', 'menu', 'cart', 'login', 'cookie', 'banner', 'share', 'social', 'newsletter', 'seller', 'delivery')
+    price_pattern = re.compile(r'(?:[$€£¥₹]|\b(?:rs|npr|usd|eur|inr)\.?)\s?\d', re.IGNORECASE)
+    whitespace_pattern = re.compile(r'\s+')
+
+    def __init__(self, html_content, token_budget=None):
         """
         Initializes the CleanHTML class with the provided HTML content.
 
         Args:
-        html_content (str): The raw HTML content.
+        html_content (str | ParsedHTML): The raw HTML content or the already parsed HTML content.
+        token_budget (int, optional): The maximum number of tokens of the cleaned content. If not provided, the content is not truncated.
         """
-        self.html_content = html_content
+        self.document = html_content if isinstance(html_content, ParsedHTML) else ParsedHTML(html_content)
+        self.html_content = self.document.html_content
+        self.token_budget = token_budget
+        self.sizes = {}
+        self.dropped = set()
         self.cleaned_html = self.clean_html()
 
     def clean_html(self):
         """
-        Clean HTML content by removing scripts, styles, anchor, svg elements, style attributes, and unnecessary tags.
+        Clean HTML content by removing scripts, styles, anchor, svg elements, attributes, repeated sibling blocks and unnecessary tags.
+        The parsed tree is serialized without being modified, so it can still be used to extract the selectors.
+
+        Returns:
+        str: The cleaned HTML content.
+        """
+        tree = self.document.tree
+        if tree is None:
+            return ""
+        self.measure(tree)
+        if self.token_budget is None or self.sizes[tree] <= self.token_budget * self.chars_per_token:
+            return self.serialize(tree)
+        return self.pack_regions(tree)
+
+    def collapse(self, text):
+        """
+        Collapses the runs of whitespace of a text and escapes it. Whitespace-only text between tags is dropped.
 
         Args:
-        html_content (str): The raw HTML content.
+        text (str): The text of an element.
 
         Returns:
-        str: The cleaned HTML content.
+        str: The collapsed and escaped text.
         """
+        if not text or text.isspace():
+            return ''
+        return escape(self.whitespace_pattern.sub(' ', text), quote=False)
 
-        # Parse the HTML content
-        soup = BeautifulSoup(self.html_content, 'html.parser')
+    def start_tag(self, element):
+        """
+        Builds the start tag of an element with the allowed attributes only.
 
-        # Remove script, style, a, i and svg elements
-        for tag in soup(['script', 'style', 'a', 'svg']):
-            tag.decompose()
+        Args:
+        element (lxml.etree.Element): The element.
 
-        # Remove style attributes from all tags
-        for tag in soup.find_all(True):
-            del tag['style']
-        
-        # Remove unnecessary tags but keep their contents
-        for tag in soup.find_all(['div', 'span', 'header', 'footer', 'nav', 'aside', 'form', 'iframe', 'noscript', 'input', 'textarea', 'button', 'ul']):
-            tag.unwrap()
+        Returns:
+        str: The start tag.
+        """
+        attributes = "".join(f' {name}="{escape(value)}"' for name, value in element.attrib.items() if name in self.allowed_attributes)
+        return f"<{element.tag}{attributes}/>" if element.tag in self.void_tags else f"<{element.tag}{attributes}>"
+
+    def is_kept(self, element):
+        """
+        Checks if an element is part of the cleaned content.
+
+        Args:
+        element (lxml.etree.Element): The element.
+
+        Returns:
+        bool: True if the element is kept, False if it is removed.
+        """
+        return isinstance(element.tag, str) and element.tag not in self.removed_tags and element not in self.dropped
+
+    def measure(self, tree):
+        """
+        Computes the size of the cleaned content of every element, bottom-up, and marks the repeated sibling blocks to drop.
+        Blocks are compared by a signature of their tags and classes.
+
+        Args:
+        tree (lxml.etree.Element): The root element of the parsed HTML content.
+        """
+        signatures = {}
+        # Walk the tree with an explicit stack so deeply nested pages do not hit the recursion limit
+        stack = [(tree, False)]
+        while stack:
+            element, visited = stack.pop()
+            if not visited:
+                stack.append((element, True))
+                stack.extend((child, False) for child in element if isinstance(child.tag, str) and child.tag not in self.removed_tags)
+                continue
+
+            children = [child for child in element if isinstance(child.tag, str) and child.tag not in self.removed_tags]
+            runs = {}
+            for child in children:
+                runs.setdefault(signatures[child], []).append(child)
+            for run in runs.values():
+                if len(run) > self.repeated_siblings_threshold:
+                    self.dropped.update(run[self.max_repeated_siblings:])
+
+            size = len(self.collapse(element.text))
+            if element.tag not in self.unwrapped_tags:
+                size += len(self.start_tag(element)) + (0 if element.tag in self.void_tags else len(element.tag) + 3)
+            for child in element:
+                if self.is_kept(child):
+                    size += self.sizes[child]
+                size += len(self.collapse(child.tail))
+            self.sizes[element] = size
+            signatures[element] = hash((element.tag, element.get('class'), tuple(signatures[child] for child in children)))
+
+    def serialize(self, element, include_tail=False):
+        """
+        Serializes the cleaned content of an element and its descendants.
+
+        Args:
+        element (lxml.etree.Element): The element to serialize.
+        include_tail (bool): Whether the text following the element is included.
+
+        Returns:
+        str: The cleaned content.
+        """
+        parts = []
+        stack = [element]
+        while stack:
+            element = stack.pop()
+            if isinstance(element, str):
+                # Closing tag or tail text queued after the descendants of an element
+                parts.append(element)
+                continue
+            if element.tail and (include_tail or parts):
+                # The text following an element is kept even if the element itself is removed
+                stack.append(self.collapse(element.tail))
+            if self.is_kept(element):
+                # Remove unnecessary tags but keep their contents
+                if element.tag not in self.unwrapped_tags:
+                    parts.append(self.start_tag(element))
+                    if element.tag not in self.void_tags:
+                        stack.append(f"</{element.tag}>")
+                parts.append(self.collapse(element.text))
+                stack.extend(reversed(element))
+        return "".join(parts)
+
+    def get_keyword_score(self, element):
+        """
+        Scores an element by the keywords found in its class, id and itemprop attributes.
+
+        Args:
+        element (lxml.etree.Element): The element.
+
+        Returns:
+        int: The keyword score of the element.
+        """
+        names = " ".join(element.get(name, '') for name in ('class', 'id', 'itemprop')).lower()
+        if not names.strip():
+            return 0
+        score = sum(1 for keyword in self.positive_keywords if keyword in names)
+        score -= sum(3 for keyword in self.negative_keywords if keyword in names)
+        return score
+
+    def get_region_score(self, content, keyword_score, position):
+        """
+        Scores a region by how likely it is to hold product data.
+
+        Args:
+        content (str): The cleaned content of the region.
+        keyword_score (int): The keyword score of the region and its ancestors.
+        position (float): The relative position of the region in the page, from 0 to 1.
+
+        Returns:
+        float: The score of the region.
+        """
+        score = keyword_score + (1 - position)
+        if self.price_pattern.search(content):
+            score += 3
+        if '<h1' in content:
+            score += 4
+        if 'itemprop=' in content:
+            score += 2
+        score += min(content.count('<img'), 3)
+        return score
+
+    def pack_regions(self, tree):
+        """
+        Splits the cleaned content into regions, ranks them by their score and keeps the best ones that fit the
+        token budget, in the order of the page.
+
+        Args:
+        tree (lxml.etree.Element): The root element of the parsed HTML content.
+
+        Returns:
+        str: The cleaned content of the kept regions.
+        """
+        regions = []
+        region_chars = self.region_tokens * self.chars_per_token
+        stack = [(tree, 0)]
+        while stack:
+            element, keyword_score = stack.pop()
+            if isinstance(element, str):
+                # Text of an element too large to be a single region
+                if element.strip():
+                    regions.append((element, keyword_score))
+                continue
+            if not self.is_kept(element):
+                continue
+            keyword_score += self.get_keyword_score(element)
+            if self.sizes[element] <= region_chars or len(element) == 0:
+                regions.append((self.serialize(element), keyword_score))
+                continue
+            # Large elements are split into their text and children, the tails of the children being separate regions
+            items = [(self.collapse(element.text), keyword_score)]
+            for child in element:
+                items.append((child, keyword_score))
+                items.append((self.collapse(child.tail), keyword_score))
+            stack.extend(reversed(items))
 
-        return soup
\ No newline at end of file
+        scored = []
+        for index, (content, keyword_score) in enumerate(regions):
+            score = self.get_region_score(content, keyword_score, index / len(regions))
+            scored.append((score, index, content))
+        budget = self.token_budget * self.chars_per_token
+        kept = []
+        for score, index, content in sorted(scored, key=lambda region: (-region[0], region[1])):
+            if len(content) <= budget:
+                kept.append((index, content))
+                budget -= len(content)
+        return "".join(content for index, content in sorted(kept))
@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+from src.benchmarks.mock_inference import MockInferenceClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class RecordingInferenceClient(MockInferenceClient):
+    """
+    RecordingInferenceClient is a class designed to answer instantly like the MockInferenceClient and to record
+    the attributes asked in each request.
+    """
+
+    def __init__(self):
+        """
+        Initializes the RecordingInferenceClient class.
+        """
+        super().__init__(latency=0.0, jitter=0.0)
+        self.requested = []
+
+    async def chat_completion(self, model=None, messages=None, tools=None, **parameters):
+        """
+        Records the attributes of the tool schema and answers the request.
+        """
+        self.requested.append(sorted(tools[0]["function"]["parameters"]["properties"]) if tools else [])
+        return await super().chat_completion(model, messages, tools, **parameters)
+
+def read_sample(number):
+    """
+    Reads one of the sample HTML files of the `data` directory.
+
+    Args:
+    number (int): The number of the sample.
+
+    Returns:
+    str: The HTML content.
+    """
+    with open(os.path.join(ROOT, "data", f"sample_{number}.html"), encoding="utf-8") as file:
+        return file.read()
+
+def read_sample_values(number):
+    """
+    Reads the values of the attributes of the result of one of the sample HTML files of the `results` directory.
+
+    Args:
+    number (int): The number of the sample.
+
+    Returns:
+    dict: The value of each attribute.
+    """
+    with open(os.path.join(ROOT, "results", f"sample_{number}_result.json"), encoding="utf-8") as file:
+        result = json.load(file)
+    return {field: [item["value"] for item in value] if isinstance(value, list) else value["value"] for field, value in result.items()}
+
+def product_page(name, price, description="", image="https://example.com/image.jpg"):
+    """
+    Builds a product page of a small shop, whose pages all share the same layout.
+
+    Args:
+    name (str): The name of the product.
+    price (str): The price of the product.
+    description (str): The description of the product, left empty if not given.
+    image (str): The URL of the image of the product.
+
+    Returns:
+    str: The HTML content.
+    """
+    links = "".join(f'<li class="menu-item"><a href="/category/{index}">Category {index}</a></li>' for index in range(12))
+    footer = "".join(f'<div class="footer-column"><h4>Help {index}</h4><p>Shipping and returns.</p></div>' for index in range(4))
+    return (
+        f"<!DOCTYPE html><html><head><title>{name} | Shop</title></head><body>"
+        f'<header class="site-header"><nav class="menu"><ul>{links}</ul></nav></header>'
+        f'<main class="product"><div class="gallery"><img src="{image}"></div>'
+        f'<div class="details"><h1 class="title">{name}</h1><div class="price"><span class="amount">{price}</span></div>'
+        f'<div class="description"><p>{description}</p></div></div></main>'
+        f'<footer class="site-footer">{footer}</footer></body></html>'
+    )
+
+@pytest.fixture
+def inference_client():
+    """
+    Returns an inference client answering instantly and recording the attributes asked in each request.
+    """
+    return RecordingInferenceClient()
@@ -0,0 +1,49 @@
+import json
+
+from src.utils.bulk_extract import ShardWriter
+
+def read_shards(output_dir):
+    """
+    Reads the results of all the shards of an output directory.
+
+    Args:
+    output_dir (Path): The directory of the shards.
+
+    Returns:
+    list: The ID and the status code of each result, in the order of the shards.
+    """
+    results = []
+    for path in sorted(output_dir.glob("results-*.jsonl")):
+        with open(path, encoding="utf-8") as file:
+            results.extend((item["id"], item["status_code"]) for item in map(json.loads, file))
+    return results
+
+def test_resumed_run_skips_the_final_results(tmp_path):
+    """
+    Pages with a result or rejected by the triage are skipped when a run is resumed, the others are processed again.
+    """
+    writer = ShardWriter(str(tmp_path), shard_size=10)
+    writer.write({"id": "a", "status_code": 200, "result": {}})
+    writer.write({"id": "b", "status_code": 422, "error": "RejectedPageError", "reason": "listing", "detail": "Listing"})
+    writer.write({"id": "c", "status_code": 503, "error": "OverloadedError", "detail": "Overloaded"})
+    writer.close()
+    assert ShardWriter(str(tmp_path), shard_size=10).completed == {"a", "b"}
+
+def test_retried_pages_keep_a_single_result(tmp_path):
+    """
+    Regression: the error lines of the pages processed again are removed from the shards, along with the lines
+    truncated by an interruption, so each page has a single line once the run is resumed.
+    """
+    writer = ShardWriter(str(tmp_path), shard_size=2)
+    writer.write({"id": "a", "status_code": 200, "result": {}})
+    writer.write({"id": "b", "status_code": 503, "error": "OverloadedError", "detail": "Overloaded"})
+    writer.write({"id": "c", "status_code": 500, "error": "AttributeExtractionError", "detail": "Failed"})
+    writer.close()
+    with open(tmp_path / "results-00001.jsonl", "a", encoding="utf-8") as file:
+        file.write('{"id": "d", "status_co')
+    writer = ShardWriter(str(tmp_path), shard_size=2)
+    assert writer.completed == {"a"}
+    for page_id in ("b", "c", "d"):
+        writer.write({"id": page_id, "status_code": 200, "result": {}})
+    writer.close()
+    assert read_shards(tmp_path) == [("a", 200), ("b", 200), ("c", 200), ("d", 200)]
@@ -0,0 +1,49 @@
+from src.utils.cache import ResultCache
+
+def test_memory_tier_hit():
+    """
+    A value is read back from the in-process tier.
+    """
+    cache = ResultCache()
+    cache.set("key", {"product_name": "Shoe"})
+    assert cache.get("key") == {"product_name": "Shoe"}
+    assert cache.get("other") is None
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+def test_disk_tier_is_shared(tmp_path):
+    """
+    A value stored by one instance is read from the SQLite tier by another, then kept in its in-process tier.
+    """
+    path = str(tmp_path / "results.sqlite3")
+    writer = ResultCache(path=path)
+    writer.set("key", {"product_name": "Shoe"})
+    reader = ResultCache(path=path)
+    assert reader.get("key") == {"product_name": "Shoe"}
+    assert reader.get("key") == {"product_name": "Shoe"}
+    assert reader.stats()["disk_hits"] == 1
+    assert reader.stats()["memory_hits"] == 1
+    writer.close()
+    reader.close()
+
+def test_expired_entries_are_misses(tmp_path):
+    """
+    Entries are not returned once their TTL has passed, from either tier.
+    """
+    cache = ResultCache(path=str(tmp_path / "results.sqlite3"), ttl=0)
+    cache.set("key", {"product_name": "Shoe"})
+    assert cache.get("key") is None
+    cache.close()
+
+def test_least_recently_used_entries_are_evicted():
+    """
+    The in-process tier evicts the least recently used entry once it is full.
+    """
+    cache = ResultCache(max_entries=2)
+    cache.set("first", {"value": 1})
+    cache.set("second", {"value": 2})
+    cache.get("first")
+    cache.set("third", {"value": 3})
+    assert cache.get("second") is None
+    assert cache.get("first") == {"value": 1}
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,53 @@
+import pytest
+
+from src.extractors.extract_selectors import ExtractSelectors
+from src.utils.utils import ParsedHTML
+from tests.conftest import read_sample, read_sample_values
+
+@pytest.mark.parametrize("number", [1, 2, 3])
+def test_exact_values_are_found(number):
+    """
+    The names and prices of the samples are found exactly.
+    """
+    values = read_sample_values(number)
+    selectors = ExtractSelectors(read_sample(number), {field: values[field] for field in ("product_name", "product_price")}).extract_selectors()
+    for field in ("product_name", "product_price"):
+        assert selectors[field]["confidence"] == 1.0
+        assert selectors[field]["css_selector"].startswith("html > body > ")
+
+def test_selectors_read_back_the_value():
+    """
+    The XPath of a value selects the element holding it.
+    """
+    document = ParsedHTML(read_sample(1))
+    values = read_sample_values(1)
+    selectors = ExtractSelectors(document, {"product_price": values["product_price"]}).extract_selectors()
+    element = document.tree.xpath(selectors["product_price"]["xpath"])[0]
+    assert element.text.strip() == values["product_price"]
+
+@pytest.mark.parametrize("field", ["product_description", "product_category"])
+def test_paraphrased_values_are_not_matched_to_unrelated_elements(field):
+    """
+    Regression: values written by the language model are not matched to elements that only share some of their words,
+    such as the name of the product for its description.
+    """
+    values = read_sample_values(2)
+    selectors = ExtractSelectors(read_sample(2), {field: values[field]}).extract_selectors()
+    assert selectors[field]["css_selector"] == "No CSS Selector Found"
+    assert selectors[field]["confidence"] == 0.0
+
+def test_value_with_a_few_extra_words_is_matched_loosely():
+    """
+    A value held by an element along with a label is still found, with a lower confidence.
+    """
+    values = read_sample_values(3)
+    selectors = ExtractSelectors(read_sample(3), {"product_description": values["product_description"]}).extract_selectors()
+    assert selectors["product_description"]["css_selector"].endswith("> li:nth-of-type(2)")
+    assert 0.5 < selectors["product_description"]["confidence"] < 0.95
+
+def test_missing_values_are_not_searched():
+    """
+    Attributes the language model did not find have placeholder selectors.
+    """
+    selectors = ExtractSelectors(read_sample(1), {"product_category": "None"}).extract_selectors()
+    assert selectors["product_category"] == {"css_selector": "Not Found", "xpath": "Not Found", "confidence": 0.0}
@@ -0,0 +1,126 @@
+import gzip
+import zlib
+
+import pytest
+
+from src.api.ingest import BodyDecoder, HTMLIngest, InvalidBodyError, PayloadTooLargeError, UnsupportedContentEncodingError
+from src.extractors.pipeline import NotHTMLContentError
+from tests.conftest import read_sample
+
+def chunks(data, size=4096):
+    """
+    Splits data into chunks, like a request body received over the network.
+
+    Args:
+    data (bytes): The data.
+    size (int): The number of bytes of each chunk.
+
+    Returns:
+    list: The chunks.
+    """
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+@pytest.mark.parametrize("content_encoding, compress", [("gzip", gzip.compress), ("deflate", zlib.compress), (None, lambda data: data)])
+def test_body_is_decompressed_chunk_by_chunk(content_encoding, compress):
+    """
+    Compressed bodies are decompressed across chunk boundaries.
+    """
+    data = read_sample(1).encode("utf-8")
+    decoder = BodyDecoder(content_encoding)
+    decoded = b"".join(decoder.decode(chunk) for chunk in chunks(compress(data))) + decoder.flush()
+    assert decoded == data
+    assert decoder.size == len(data)
+
+def test_decompression_bomb_is_rejected():
+    """
+    The decompressed size is checked while decompressing, so a small body cannot expand past the limit.
+    """
+    decoder = BodyDecoder("gzip", max_bytes=1 << 20)
+    with pytest.raises(PayloadTooLargeError):
+        decoder.decode(gzip.compress(b"\0" * (1 << 24)))
+
+def test_brotli_body_is_decompressed_chunk_by_chunk():
+    """
+    Brotli bodies are decompressed across chunk boundaries.
+    """
+    brotli = pytest.importorskip("brotli")
+    data = read_sample(2).encode("utf-8")
+    decoder = BodyDecoder("br")
+    decoded = b"".join(decoder.decode(chunk) for chunk in chunks(brotli.compress(data))) + decoder.flush()
+    assert decoded == data
+
+def test_brotli_bomb_is_rejected_before_it_expands():
+    """
+    Regression: a brotli body is decompressed in bounded steps, so a small body is rejected before it is
+    decompressed in memory.
+    """
+    brotli = pytest.importorskip("brotli")
+    steps = []
+
+    class RecordingDecompressor:
+        def __init__(self):
+            self.decompressor = brotli.Decompressor()
+
+        def process(self, data, output_buffer_limit):
+            output = self.decompressor.process(data, output_buffer_limit=output_buffer_limit)
+            steps.append(len(output))
+            return output
+
+        def can_accept_more_data(self):
+            return self.decompressor.can_accept_more_data()
+
+    decoder = BodyDecoder("br", max_bytes=1 << 20)
+    decoder.decompressors = [RecordingDecompressor()]
+    with pytest.raises(PayloadTooLargeError):
+        decoder.decode(brotli.compress(b"\0" * (1 << 26), quality=1))
+    assert sum(steps) < 1 << 23
+
+def test_unsupported_encoding_is_rejected():
+    """
+    Unknown content encodings are rejected before reading the body.
+    """
+    with pytest.raises(UnsupportedContentEncodingError):
+        BodyDecoder("compress")
+
+def test_invalid_compressed_body_is_rejected():
+    """
+    Bodies that are not valid compressed data are rejected.
+    """
+    with pytest.raises(InvalidBodyError):
+        BodyDecoder("gzip").decode(b"not gzip data")
+
+def test_html_is_parsed_as_it_is_received():
+    """
+    The HTML content is decoded and parsed chunk by chunk into the same tree as the whole page.
+    """
+    html_content = read_sample(2)
+    ingest = HTMLIngest("text/html", "gzip")
+    for chunk in chunks(gzip.compress(html_content.encode("utf-8"))):
+        ingest.feed(chunk)
+    document = ingest.close()
+    assert document.tree is not None
+    assert ingest.size == len(html_content.encode("utf-8"))
+    assert "CADEVE" in "".join(document.tree.itertext())
+
+def test_charset_is_detected_from_the_meta_tag():
+    """
+    The charset declared in a meta tag is used to decode the HTML content.
+    """
+    html_content = '<html><head><meta charset="iso-8859-1"><title>Café</title></head><body><p>Crème brûlée</p></body></html>'
+    ingest = HTMLIngest("text/html")
+    document = ingest.close(html_content.encode("iso-8859-1"))
+    assert "Crème brûlée" in "".join(document.tree.itertext())
+
+def test_charset_of_the_header_comes_before_the_meta_tag():
+    """
+    The charset of the `Content-Type` header takes precedence over the meta tag.
+    """
+    ingest = HTMLIngest("text/html; charset=utf-16")
+    assert ingest.detect_charset(b'<meta charset="utf-8">') == "utf-16"
+
+def test_content_that_is_not_html_is_rejected():
+    """
+    Content that does not start like HTML is rejected.
+    """
+    with pytest.raises(NotHTMLContentError):
+        HTMLIngest("text/html").close(b'{"product_name": "Shoe"}')
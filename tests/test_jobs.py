@@ -0,0 +1,146 @@
+import asyncio
+import json
+import sqlite3
+
+from src.api import jobs
+from src.api.jobs import JobRunner, JobStore
+
+def test_identical_documents_are_processed_once():
+    """
+    Jobs of identical documents with the same options share one document, while other options make another one.
+    """
+    store = JobStore()
+    jobs = store.submit([("a", "<html>page</html>", {}), ("b", "<html>page</html>", {}), ("c", "<html>page</html>", {"fields": ["product_name"]})])
+    assert [job["status"] for job in jobs] == ["queued", "queued", "queued"]
+    assert store.stats()["queued"] == 2
+    store.close()
+
+def test_claimed_document_is_completed():
+    """
+    A claimed document runs until its result is stored, and every job of the document returns the result.
+    """
+    store = JobStore()
+    first, second = store.submit([("a", "<html>page</html>", {"url": "https://example.com"}), ("b", "<html>page</html>", {"url": "https://example.com"})])
+    content_hash, html_content, options = store.claim()
+    assert html_content == "<html>page</html>"
+    assert options == {"url": "https://example.com"}
+    assert store.get(first["id"])["status"] == "running"
+    assert store.claim() is None
+    assert store.complete(content_hash, {"status_code": 200, "result": {"product_name": "Shoe"}})
+    for job in (first, second):
+        finished = store.get(job["id"])
+        assert finished["status"] == "done"
+        assert finished["result"] == {"product_name": "Shoe"}
+    # Documents already processed are answered from their result
+    assert store.submit([("c", "<html>page</html>", {"url": "https://example.com"})])[0]["status"] == "done"
+    store.close()
+
+def test_overloaded_document_is_queued_again():
+    """
+    A document that failed because the language model was overloaded is queued again until it runs out of attempts.
+    """
+    store = JobStore(max_attempts=2)
+    job = store.submit([(None, "<html>page</html>", {})])[0]
+    content_hash, _, _ = store.claim()
+    assert not store.complete(content_hash, {"status_code": 503, "detail": "Overloaded", "retry_after": 0})
+    assert store.get(job["id"])["status"] == "queued"
+    content_hash, _, _ = store.claim()
+    assert store.complete(content_hash, {"status_code": 503, "detail": "Overloaded", "retry_after": 0})
+    assert store.get(job["id"])["status"] == "failed"
+    store.close()
+
+def test_released_document_is_claimed_again():
+    """
+    A document released by a worker that stopped is given to the next worker.
+    """
+    store = JobStore()
+    store.submit([(None, "<html>page</html>", {})])
+    content_hash, _, _ = store.claim()
+    store.release(content_hash)
+    assert store.claim()[0] == content_hash
+    store.close()
+
+def test_jobs_are_shared_through_the_database(tmp_path):
+    """
+    A job submitted to one store is visible to another store on the same database.
+    """
+    path = str(tmp_path / "jobs.sqlite3")
+    submitter, worker = JobStore(path=path), JobStore(path=path)
+    job = submitter.submit([(None, "<html>page</html>", {})])[0]
+    content_hash, _, _ = worker.claim()
+    worker.complete(content_hash, {"status_code": 400, "detail": "Not HTML", "reason": "not_html"})
+    finished = submitter.get(job["id"])
+    assert finished["status"] == "failed"
+    assert finished["reason"] == "not_html"
+    submitter.close()
+    worker.close()
+
+def test_runner_processes_the_queue_and_survives_store_errors():
+    """
+    Regression: the workers of the runner keep processing the queue after the store fails.
+    """
+    store = JobStore()
+    claim = store.claim
+    failures = [sqlite3.OperationalError("database is locked")] * 2
+
+    def failing_claim():
+        if failures:
+            raise failures.pop()
+        return claim()
+
+    store.claim = failing_claim
+
+    async def process(html_content, options):
+        return {"status_code": 200, "result": {"length": len(html_content)}}
+
+    async def run():
+        runner = JobRunner(store, process, workers=1, poll_interval=0.01)
+        runner.error_delay = 0.01
+        job = store.submit([(None, "<html>page</html>", {})])[0]
+        runner.start()
+        try:
+            return await runner.wait(job["id"], timeout=5)
+        finally:
+            await runner.stop()
+
+    finished = asyncio.run(run())
+    assert finished["status"] == "done"
+    assert finished["result"] == {"length": 17}
+    store.close()
+
+def test_callback_of_an_already_processed_document_is_sent(monkeypatch):
+    """
+    Regression: a job whose document was already processed by an earlier job gets its callback.
+    """
+    store = JobStore()
+    sent = []
+
+    def post_json(url, body, timeout=10):
+        sent.append((url, json.loads(body)))
+        return 200
+
+    monkeypatch.setattr(jobs, "post_json", post_json)
+
+    async def process(html_content, options):
+        return {"status_code": 200, "result": {"length": len(html_content)}}
+
+    async def run():
+        runner = JobRunner(store, process, workers=1, poll_interval=0.01)
+        runner.start()
+        try:
+            first = (await runner.submit([(None, "<html>page</html>", {})]))[0]
+            await runner.wait(first["id"], timeout=5)
+            second = (await runner.submit([(None, "<html>page</html>", {})], "https://example.com/callback"))[0]
+            for _ in range(100):
+                if store.get(second["id"])["callback_status"] is not None:
+                    break
+                await asyncio.sleep(0.01)
+            return second
+        finally:
+            await runner.stop()
+
+    second = asyncio.run(run())
+    assert second["status"] == "done"
+    assert store.get(second["id"])["callback_status"] == "sent"
+    assert [(url, body["id"], body["status"]) for url, body in sent] == [("https://example.com/callback", second["id"], "done")]
+    store.close()
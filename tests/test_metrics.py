@@ -0,0 +1,41 @@
+from src.utils import metrics
+from src.utils.metrics import Metrics, Timings
+
+def observe_requests(directory, count):
+    """
+    Records some extractions in the metrics of a process and writes them to the shared directory.
+
+    Args:
+    directory (str): The directory shared by the processes.
+    count (int): The number of extractions.
+
+    Returns:
+    Metrics: The metrics of the process.
+    """
+    process_metrics = Metrics(str(directory))
+    for _ in range(count):
+        timings = Timings()
+        timings.outcome("model")
+        process_metrics.observe(timings, 200)
+    process_metrics.write()
+    return process_metrics
+
+def test_metrics_of_the_processes_are_added_up(tmp_path, monkeypatch):
+    """
+    The counters written by every process to the shared directory are added up.
+    """
+    monkeypatch.setattr(metrics.os, "getpid", lambda: 101)
+    observe_requests(tmp_path, 2)
+    monkeypatch.setattr(metrics.os, "getpid", lambda: 102)
+    rendered = observe_requests(tmp_path, 3).render()
+    assert 'extraction_outcomes_total{outcome="model"} 5' in rendered.splitlines()
+
+def test_reused_process_id_does_not_replace_the_metrics_of_an_exited_process(tmp_path, monkeypatch):
+    """
+    Regression: a worker started with the process ID of a worker that exited keeps the counters of the exited worker.
+    """
+    monkeypatch.setattr(metrics.os, "getpid", lambda: 101)
+    observe_requests(tmp_path, 2)
+    rendered = observe_requests(tmp_path, 1).render()
+    assert 'extraction_outcomes_total{outcome="model"} 3' in rendered.splitlines()
+    assert len(list(tmp_path.iterdir())) == 2
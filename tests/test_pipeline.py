@@ -0,0 +1,46 @@
+import asyncio
+
+from src.extractors.pipeline import ExtractionPipeline
+from src.utils.cache import ResultCache
+from src.utils.metrics import Timings
+from src.utils.templates import TemplateStore
+from tests.conftest import product_page, read_sample
+
+def test_sample_page_is_extracted(inference_client):
+    """
+    The attributes of a sample page are extracted by the language model along with their selectors.
+    """
+    pipeline = ExtractionPipeline(inference_client)
+    result = asyncio.run(pipeline.extract(read_sample(1)))
+    assert len(inference_client.requested) == 1
+    assert result["product_price"]["value"] == "Rs. 279"
+    assert result["product_price"]["selectors"]["xpath"].startswith("/html[1]/body[")
+
+def test_repeated_page_is_served_by_the_result_cache(inference_client):
+    """
+    A page extracted again is served by the result cache without asking the language model.
+    """
+    pipeline = ExtractionPipeline(inference_client, result_cache=ResultCache())
+    first = asyncio.run(pipeline.extract(read_sample(2)))
+    timings = Timings()
+    second = asyncio.run(pipeline.extract(read_sample(2), timings))
+    assert len(inference_client.requested) == 1
+    assert second == first
+
+def test_partial_template_asks_the_model_for_the_missing_attributes(inference_client):
+    """
+    A template learned on a page without description only serves the attributes it has selectors for, the others
+    are still extracted by the language model instead of being returned as "None".
+    """
+    pipeline = ExtractionPipeline(inference_client, template_store=TemplateStore())
+    first = asyncio.run(pipeline.extract(product_page("Trail Running Shoe", "Rs. 4,500")))
+    assert first["product_description"]["value"] == "None"
+    timings = Timings()
+    description = "A light shoe for long runs on rocky trails, with a grippy sole."
+    second = asyncio.run(pipeline.extract(product_page("Leather Boot", "Rs. 7,200", description), timings))
+    assert inference_client.requested[1] == ["brand_name", "product_category", "product_description"]
+    assert "template_partial" in timings.outcomes
+    assert second["product_name"]["value"] == "Leather Boot"
+    assert second["product_description"]["value"] == description
+    assert second["product_name"]["selectors"]["confidence"] == 1.0
+    assert second["product_name"]["selectors"]["xpath"] == first["product_name"]["selectors"]["xpath"]
@@ -0,0 +1,173 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src.api.main import app
+from src.benchmarks.mock_inference import MockInferenceClient
+from src.extractors.pipeline import ExtractionPipeline
+from src.utils.scheduler import InferenceScheduler, OverloadedError
+from tests.conftest import read_sample
+
+class HTTPError(Exception):
+    """
+    HTTPError is a class designed to stand in for the errors of the HTTP client, which carry their response.
+    """
+
+    def __init__(self, status_code):
+        """
+        Initializes the HTTPError class.
+
+        Args:
+            status_code (int): The status code of the response.
+        """
+        super().__init__(f"HTTP {status_code}")
+        self.response = SimpleNamespace(status_code=status_code, headers={})
+
+def test_request_is_sent_to_the_backend():
+    """
+    A request is sent with the client of a backend and its response is returned.
+    """
+    scheduler = InferenceScheduler([MockInferenceClient(latency=0.0, jitter=0.0)])
+    messages = [{"role": "user", "content": "<h1>Trail Running Shoe</h1><span>Rs. 4,500</span>"}]
+
+    async def request(client):
+        return await client.chat_completion(messages=messages)
+
+    response = asyncio.run(scheduler.run(request))
+    arguments = json.loads(response.choices[0].message.tool_calls[0].function.arguments)
+    assert arguments["product_name"] == "Trail Running Shoe"
+    assert arguments["product_price"] == "Rs. 4,500"
+    assert scheduler.stats()["requests"] == 1
+    assert scheduler.stats()["in_flight"] == 0
+
+def test_waiting_requests_are_served_by_priority():
+    """
+    Requests waiting for a slot are served by priority, then in arrival order.
+    """
+    scheduler = InferenceScheduler([MockInferenceClient()], max_concurrency=1)
+    order = []
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def blocking(client):
+            await gate.wait()
+
+        def recording(name):
+            async def request(client):
+                order.append(name)
+            return request
+
+        first = asyncio.ensure_future(scheduler.run(blocking))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.ensure_future(scheduler.run(recording(name), priority))
+            for name, priority in (("batch", 1), ("job", 2), ("interactive", 0), ("other batch", 1))
+        ]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, *waiting)
+
+    asyncio.run(run())
+    assert order == ["interactive", "batch", "other batch", "job"]
+
+def test_full_queue_is_rejected():
+    """
+    Requests are rejected with a delay to try again once the queue is full.
+    """
+    scheduler = InferenceScheduler([MockInferenceClient()], max_concurrency=1, max_queue=1)
+
+    async def run():
+        gate = asyncio.Event()
+
+        async def blocking(client):
+            await gate.wait()
+
+        tasks = [asyncio.ensure_future(scheduler.run(blocking)) for _ in range(2)]
+        await asyncio.sleep(0)
+        try:
+            with pytest.raises(OverloadedError) as error:
+                await scheduler.run(blocking)
+            assert error.value.retry_after >= 1
+        finally:
+            gate.set()
+            await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert scheduler.stats()["rejected"] == 1
+
+def test_transient_errors_are_retried():
+    """
+    Requests failing with a transient error are retried, and the limit of a saturated backend is halved.
+    """
+    scheduler = InferenceScheduler([MockInferenceClient()], max_concurrency=8, retry_delay=0.0)
+    errors = [HTTPError(503), HTTPError(502)]
+
+    async def request(client):
+        if errors:
+            raise errors.pop()
+        return "response"
+
+    assert asyncio.run(scheduler.run(request)) == "response"
+    assert scheduler.stats()["retries"] == 2
+    assert scheduler.stats()["limit"] == 4
+
+def test_backend_still_overloaded_after_the_retries():
+    """
+    Requests still failing after all the retries are reported as overloaded.
+    """
+    scheduler = InferenceScheduler([MockInferenceClient()], max_retries=1, retry_delay=0.0)
+
+    async def request(client):
+        raise HTTPError(429)
+
+    with pytest.raises(OverloadedError):
+        asyncio.run(scheduler.run(request))
+    assert scheduler.stats()["overloads"] == 1
+
+def test_other_errors_are_not_retried():
+    """
+    Requests failing with an error that is not transient fail at once.
+    """
+    scheduler = InferenceScheduler([MockInferenceClient()], retry_delay=0.0)
+
+    async def request(client):
+        raise HTTPError(400)
+
+    with pytest.raises(HTTPError):
+        asyncio.run(scheduler.run(request))
+    assert scheduler.stats()["retries"] == 0
+
+def test_retry_after_of_the_backend_is_capped():
+    """
+    Regression: the `Retry-After` delay asked by the backend is capped to the maximum retry delay.
+    """
+    scheduler = InferenceScheduler([MockInferenceClient()], max_retries=0, max_retry_delay=30)
+
+    async def request(client):
+        error = HTTPError(429)
+        error.response.headers["retry-after"] = "86400"
+        raise error
+
+    with pytest.raises(OverloadedError) as error:
+        asyncio.run(scheduler.run(request))
+    assert error.value.retry_after == 30
+
+def test_retry_after_header_is_a_whole_number_of_seconds(monkeypatch):
+    """
+    Regression: the `Retry-After` header sent to the clients of an overloaded backend is a whole number of seconds.
+    """
+    class OverloadedClient(MockInferenceClient):
+        async def chat_completion(self, model=None, messages=None, tools=None, **parameters):
+            error = HTTPError(503)
+            error.response.headers["retry-after"] = "2.5"
+            raise error
+
+    pipeline = ExtractionPipeline(OverloadedClient(), scheduler=InferenceScheduler([OverloadedClient()], max_retries=0))
+    monkeypatch.setattr(app.state, "pipeline", pipeline, raising=False)
+    response = TestClient(app).post("/extract-attributes-and-selectors/", content=read_sample(1), headers={"Content-Type": "text/html"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "3"
@@ -0,0 +1,96 @@
+from src.api import server
+from src.api.server import PreforkServer
+
+class FakeClock:
+    """
+    FakeClock is a class designed to stand in for the monotonic clock of the server, so the uptimes of the workers
+    and the delays of their restarts can be set by the tests.
+    """
+
+    def __init__(self):
+        """
+        Initializes the FakeClock class.
+        """
+        self.now = 1000.0
+
+    def monotonic(self):
+        """
+        Returns the current time.
+        """
+        return self.now
+
+def make_server(monkeypatch, clock):
+    """
+    Creates a server whose workers are not forked, and whose exited workers are read from a list.
+
+    Args:
+    monkeypatch (MonkeyPatch): The pytest fixture patching the modules.
+    clock (FakeClock): The clock of the server.
+
+    Returns:
+    tuple: The server and the list of the process IDs of the workers that exited.
+    """
+    prefork_server = PreforkServer(workers=1)
+    exited = []
+    spawned = iter(range(100, 200))
+
+    def spawn_worker():
+        prefork_server.processes[next(spawned)] = clock.monotonic()
+
+    def waitpid(pid, options):
+        return (exited.pop(0), 256) if exited else (0, 0)
+
+    monkeypatch.setattr(prefork_server, "spawn_worker", spawn_worker)
+    monkeypatch.setattr(server.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(server.os, "waitpid", waitpid)
+    monkeypatch.setattr(server.os, "waitstatus_to_exitcode", lambda status: 1)
+    prefork_server.spawn_worker()
+    return prefork_server, exited
+
+def test_worker_failing_to_start_is_restarted_with_backoff(monkeypatch):
+    """
+    Regression: a worker exiting right after it was forked is restarted after a delay that doubles with each failure,
+    instead of stopping the server.
+    """
+    clock = FakeClock()
+    prefork_server, exited = make_server(monkeypatch, clock)
+    delays = []
+    for _ in range(3):
+        exited.append(next(iter(prefork_server.processes)))
+        clock.now += 1
+        prefork_server.reap_workers()
+        assert not prefork_server.stopping
+        assert prefork_server.processes == {}
+        failed_at = clock.now
+        while not prefork_server.processes:
+            clock.now += 0.5
+            prefork_server.restart_workers()
+        delays.append(clock.now - failed_at)
+    assert delays == [1.0, 2.0, 4.0]
+
+def test_server_stops_after_repeated_start_failures(monkeypatch):
+    """
+    The server is stopped once too many workers failed to start within the window.
+    """
+    clock = FakeClock()
+    prefork_server, exited = make_server(monkeypatch, clock)
+    for _ in range(PreforkServer.max_start_failures + 1):
+        exited.append(next(iter(prefork_server.processes)))
+        clock.now += 1
+        prefork_server.reap_workers()
+        clock.now += PreforkServer.max_restart_delay
+        prefork_server.restart_workers()
+    assert prefork_server.stopping
+    assert prefork_server.exit_code == 1
+
+def test_worker_exiting_after_it_started_is_restarted_at_once(monkeypatch):
+    """
+    A worker that exits after it started is restarted right away.
+    """
+    clock = FakeClock()
+    prefork_server, exited = make_server(monkeypatch, clock)
+    exited.append(next(iter(prefork_server.processes)))
+    clock.now += 3600
+    prefork_server.reap_workers()
+    assert len(prefork_server.processes) == 1
+    assert prefork_server.start_failures == []
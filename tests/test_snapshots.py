@@ -0,0 +1,89 @@
+from src.extractors.extract_selectors import ExtractSelectors
+from src.utils.snapshots import SnapshotStore
+from src.utils.utils import CleanHTML, MergeAttributesAndSelectors, ParsedHTML
+from tests.conftest import product_page
+
+URL = "https://shop.example.com/products/trail-running-shoe"
+
+def save_page(store, html_content, attributes):
+    """
+    Extracts the selectors of the attributes of a page and records the result as the snapshot of its URL.
+
+    Args:
+    store (SnapshotStore): The snapshot store.
+    html_content (str): The HTML content of the page.
+    attributes (dict): The attributes of the page.
+    """
+    document = ParsedHTML(html_content)
+    selectors = ExtractSelectors(document, attributes).extract_selectors()
+    result = MergeAttributesAndSelectors(attributes, selectors).result
+    store.save(URL, document.tree, CleanHTML(document).cleaned_html, result)
+
+def test_unchanged_page_is_read_from_its_snapshot(tmp_path):
+    """
+    The attributes of a page that did not change are reused with their selectors.
+    """
+    store = SnapshotStore(str(tmp_path / "snapshots.sqlite3"))
+    html_content = product_page("Trail Running Shoe", "Rs. 4,500", "Light shoe with a grippy sole for muddy trails.")
+    attributes = {"product_name": "Trail Running Shoe", "product_price": "Rs. 4,500", "product_description": "Light shoe with a grippy sole for muddy trails."}
+    save_page(store, html_content, attributes)
+    snapshot = store.get(URL)
+    recovered, selectors, missing = store.match(ParsedHTML(html_content).tree, snapshot, list(attributes))
+    assert recovered == attributes
+    assert missing == []
+    assert selectors["product_name"]["confidence"] == 1.0
+    store.close()
+
+def test_changed_attribute_is_read_again_through_its_selector(tmp_path):
+    """
+    An attribute whose element changed is read again through its selector.
+    """
+    store = SnapshotStore(str(tmp_path / "snapshots.sqlite3"))
+    attributes = {"product_name": "Trail Running Shoe", "product_price": "Rs. 4,500"}
+    save_page(store, product_page("Trail Running Shoe", "Rs. 4,500"), attributes)
+    recovered, _, missing = store.match(ParsedHTML(product_page("Trail Running Shoe", "Rs. 3,999")).tree, store.get(URL), list(attributes))
+    assert recovered == {"product_name": "Trail Running Shoe", "product_price": "Rs. 3,999"}
+    assert missing == []
+    store.close()
+
+def test_changed_regions_are_much_smaller_than_the_page(tmp_path):
+    """
+    Only the regions of the cleaned HTML content that changed are kept for the prompt.
+    """
+    store = SnapshotStore(str(tmp_path / "snapshots.sqlite3"))
+    previous = CleanHTML(ParsedHTML(product_page("Trail Running Shoe", "Rs. 4,500", "Light shoe with a grippy sole."))).cleaned_html
+    current = CleanHTML(ParsedHTML(product_page("Trail Running Shoe", "Rs. 4,500", "Light shoe with a grippy sole, now waterproof."))).cleaned_html
+    changed_html = store.get_changed_html(previous, current)
+    assert "now waterproof" in changed_html
+    assert "Category 5" not in changed_html
+    assert store.get_changed_html(current, current) is None
+    store.close()
+
+def test_unknown_url_has_no_snapshot(tmp_path):
+    """
+    A URL that was never extracted has no snapshot.
+    """
+    store = SnapshotStore(str(tmp_path / "snapshots.sqlite3"))
+    assert store.get(URL) is None
+    store.close()
+
+def test_expired_snapshots_are_purged(tmp_path):
+    """
+    Regression: the expired snapshots are removed from the database when it is opened and after a number of saves.
+    """
+    path = str(tmp_path / "snapshots.sqlite3")
+    store = SnapshotStore(path, ttl=60)
+    save_page(store, product_page("Trail Running Shoe", "Rs. 4,500"), {"product_name": "Trail Running Shoe", "product_price": "Rs. 4,500"})
+    store.connection.execute("UPDATE snapshots SET updated_at = updated_at - 3600")
+    store.close()
+    store = SnapshotStore(path, ttl=60)
+    assert store.connection.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0] == 0
+    assert store.stats()["purged"] == 1
+
+    store.purge_interval = 2
+    save_page(store, product_page("Trail Running Shoe", "Rs. 4,500"), {"product_name": "Trail Running Shoe", "product_price": "Rs. 4,500"})
+    store.connection.execute("UPDATE snapshots SET updated_at = updated_at - 3600")
+    store.save("https://shop.example.com/products/leather-boot", None, None, {})
+    assert store.connection.execute("SELECT url FROM snapshots").fetchall() == [("https://shop.example.com/products/leather-boot",)]
+    assert store.stats()["purged"] == 2
+    store.close()
@@ -0,0 +1,62 @@
+import json
+
+from src.extractors.extract_structured_data import ExtractStructuredData
+
+def json_ld_page(products, heading="Trail Running Shoe"):
+    """
+    Builds a product page describing its products with JSON-LD.
+
+    Args:
+    products (list): The JSON-LD Product objects.
+    heading (str): The heading of the page.
+
+    Returns:
+    str: The HTML content.
+    """
+    return (
+        f'<html><head><script type="application/ld+json">{json.dumps(products)}</script></head>'
+        f"<body><h1>{heading}</h1></body></html>"
+    )
+
+def test_json_ld_product_is_extracted():
+    """
+    The attributes of a JSON-LD Product are mapped onto the attribute schema.
+    """
+    html_content = json_ld_page({
+        "@context": "https://schema.org", "@type": "Product", "name": "Trail Running Shoe", "brand": {"@type": "Brand", "name": "Stride"},
+        "image": ["https://example.com/shoe.jpg"], "offers": {"@type": "Offer", "price": "4500", "priceCurrency": "NPR"},
+    })
+    attributes = ExtractStructuredData(html_content).extract_structured_data()
+    assert attributes == {
+        "product_name": "Trail Running Shoe", "product_price": "NPR 4500", "product_images": ["https://example.com/shoe.jpg"], "brand_name": "Stride",
+    }
+
+def test_related_json_ld_products_do_not_fill_the_main_product():
+    """
+    The attributes missing from the main product are not taken from the related products of the page,
+    and the main product is the one named in the heading even if it is not the first one.
+    """
+    html_content = json_ld_page([
+        {"@type": "Product", "name": "Trail Socks", "brand": "Woolly", "description": "Warm socks for long runs.",
+         "category": "Socks", "image": "https://example.com/socks.jpg", "offers": {"price": "900"}},
+        {"@type": "Product", "name": "Trail Running Shoe", "offers": {"price": "4500"}},
+    ])
+    attributes = ExtractStructuredData(html_content).extract_structured_data()
+    assert attributes == {"product_name": "Trail Running Shoe", "product_price": "4500"}
+
+def test_nested_microdata_products_are_ignored():
+    """
+    Only the properties of the top-level Product item are read, not the ones of the Products nested in it
+    or of the other Products of the page.
+    """
+    html_content = (
+        '<html><body><div itemscope itemtype="https://schema.org/Product"><h1 itemprop="name">Trail Running Shoe</h1>'
+        '<div itemprop="offers" itemscope itemtype="https://schema.org/Offer"><span itemprop="price">4500</span></div>'
+        '<div itemprop="isRelatedTo" itemscope itemtype="https://schema.org/Product"><span itemprop="name">Trail Socks</span>'
+        '<span itemprop="description">Warm socks for long runs.</span><img itemprop="image" src="https://example.com/socks.jpg">'
+        '<div itemprop="brand" itemscope itemtype="https://schema.org/Brand"><span itemprop="name">Woolly</span></div></div></div>'
+        '<div itemscope itemtype="https://schema.org/Product"><span itemprop="name">Trail Cap</span>'
+        '<span itemprop="category">Caps</span></div></body></html>'
+    )
+    attributes = ExtractStructuredData(html_content).extract_structured_data()
+    assert attributes == {"product_name": "Trail Running Shoe", "product_price": "4500"}
@@ -0,0 +1,96 @@
+from src.extractors.extract_selectors import ExtractSelectors
+from src.utils.templates import TemplateStore
+from src.utils.utils import ParsedHTML
+from tests.conftest import product_page
+
+def learn_page(store, html_content, attributes):
+    """
+    Extracts the selectors of the attributes of a page and learns its template.
+
+    Args:
+    store (TemplateStore): The template store.
+    html_content (str): The HTML content of the page.
+    attributes (dict): The attributes of the page.
+
+    Returns:
+    dict: The selectors of the attributes.
+    """
+    document = ParsedHTML(html_content)
+    selectors = ExtractSelectors(document, attributes).extract_selectors()
+    signature, _, _ = store.match(document.tree)
+    store.learn(signature, attributes, selectors)
+    return selectors
+
+def test_template_extracts_the_next_pages_of_the_layout():
+    """
+    The selectors learned on one page extract the attributes of another page with the same layout.
+    """
+    store = TemplateStore()
+    learn_page(store, product_page("Trail Running Shoe", "Rs. 4,500"), {
+        "product_name": "Trail Running Shoe", "product_price": "Rs. 4,500", "product_images": ["https://example.com/image.jpg"]
+    })
+    _, template_id, attributes = store.match(ParsedHTML(product_page("Leather Boot", "Rs. 7,200", image="https://example.com/boot.jpg")).tree)
+    assert template_id is not None
+    assert attributes == {"product_name": "Leather Boot", "product_price": "Rs. 7,200", "product_images": ["https://example.com/boot.jpg"]}
+    assert store.stats()["hits"] == 1
+
+def test_template_values_are_normalized():
+    """
+    Regression: the values read with a template have their whitespace collapsed and stripped like the values
+    returned by the language model.
+    """
+    store = TemplateStore()
+    learn_page(store, product_page("Trail Running Shoe", "Rs. 4,500"), {"product_name": "Trail Running Shoe", "product_price": "Rs. 4,500"})
+    _, _, attributes = store.match(ParsedHTML(product_page("\n    Leather\t Boot\n  ", " Rs.  7,200 ")).tree)
+    assert attributes == {"product_name": "Leather Boot", "product_price": "Rs. 7,200"}
+
+def test_different_layout_does_not_match():
+    """
+    A page with another layout does not match the template.
+    """
+    store = TemplateStore()
+    learn_page(store, product_page("Trail Running Shoe", "Rs. 4,500"), {"product_name": "Trail Running Shoe", "product_price": "Rs. 4,500"})
+    _, template_id, attributes = store.match(ParsedHTML("<html><body><table><tr><td>Shoe</td><td>Rs. 4,500</td></tr></table></body></html>").tree)
+    assert template_id is None
+    assert attributes is None
+
+def test_template_needs_a_name_and_a_price():
+    """
+    A template is only learned if the name and the price were found with enough confidence.
+    """
+    store = TemplateStore()
+    learn_page(store, product_page("Trail Running Shoe", "Rs. 4,500"), {"product_name": "Trail Running Shoe", "product_price": "Rs. 9,999"})
+    assert store.stats()["templates"] == 0
+
+def test_loose_matches_are_not_learned():
+    """
+    Selectors matched with a low confidence are not learned.
+    """
+    assert TemplateStore.is_learnable({"css_selector": "html > body > h1", "xpath": "/html[1]/body[1]/h1[1]", "confidence": 1.0})
+    assert not TemplateStore.is_learnable({"css_selector": "html > body > h1", "xpath": "/html[1]/body[1]/h1[1]", "confidence": 0.6})
+    assert not TemplateStore.is_learnable({"css_selector": "Not Found", "xpath": "Not Found", "confidence": 0.0})
+
+def test_templates_are_shared_through_the_database(tmp_path):
+    """
+    A template learned by one worker is used by another worker on the same database.
+    """
+    path = str(tmp_path / "templates.sqlite3")
+    learner, reader = TemplateStore(path=path), TemplateStore(path=path)
+    learn_page(learner, product_page("Trail Running Shoe", "Rs. 4,500"), {"product_name": "Trail Running Shoe", "product_price": "Rs. 4,500"})
+    _, _, attributes = reader.match(ParsedHTML(product_page("Leather Boot", "Rs. 7,200")).tree)
+    assert attributes == {"product_name": "Leather Boot", "product_price": "Rs. 7,200"}
+    learner.close()
+    reader.close()
+
+def test_learned_selectors_are_returned_for_the_served_attributes():
+    """
+    The selectors of the attributes a template extracted are the ones it learned.
+    """
+    store = TemplateStore()
+    selectors = learn_page(store, product_page("Trail Running Shoe", "Rs. 4,500"), {"product_name": "Trail Running Shoe", "product_price": "Rs. 4,500"})
+    tree = ParsedHTML(product_page("Leather Boot", "Rs. 7,200")).tree
+    _, template_id, _ = store.match(tree)
+    learned = store.get_selectors(template_id, ["product_name", "product_description"], tree)
+    assert list(learned) == ["product_name"]
+    assert learned["product_name"]["css_selector"] == selectors["product_name"]["css_selector"]
+    assert learned["product_name"]["xpath"] == selectors["product_name"]["xpath"]
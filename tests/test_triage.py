@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from src.utils.triage import PageTriage
+from tests.conftest import read_sample
+
+def classify(html_content):
+    """
+    Classifies a whole page.
+
+    Args:
+    html_content (str): The HTML content.
+
+    Returns:
+    str: The type of the page.
+    """
+    return PageTriage(html_content[:PageTriage.prefix_chars], len(html_content)).page_type
+
+def json_ld(data):
+    """
+    Wraps structured data in a JSON-LD script tag.
+
+    Args:
+    data (dict): The structured data.
+
+    Returns:
+    str: The script tag.
+    """
+    return f'<script type="application/ld+json">{json.dumps(data)}</script>'
+
+@pytest.mark.parametrize("number", [1, 2, 3])
+def test_sample_pages_are_products(number):
+    """
+    The bundled product pages are classified as products.
+    """
+    assert classify(read_sample(number)) == "product"
+
+def test_binary_content_is_not_html():
+    """
+    Content that only starts like a tag is not HTML.
+    """
+    assert classify("<\x00\x01\x02\x03\x04\x05\x06" * 20) == "not_html"
+
+def test_captcha_page_is_a_bot_wall():
+    """
+    Captcha interstitials are recognized by their title.
+    """
+    assert classify("<html><head><title>Just a moment...</title></head><body><div>Checking</div></body></html>") == "bot_wall"
+
+@pytest.mark.parametrize("title", ["404", "404 - Page not found", "Error 404 | Shop", "Page not found"])
+def test_not_found_pages_are_empty_shells(title):
+    """
+    Not found pages are recognized by their title.
+    """
+    page = f"<html><head><title>{title}</title></head><body><p>{'Some text. ' * 50}</p></body></html>"
+    assert classify(page) == "empty_shell"
+
+@pytest.mark.parametrize("title", ["Peugeot 404", "Levi's 404 Jeans"])
+def test_404_in_product_names_is_not_a_not_found_page(title):
+    """
+    Regression: product names containing 404 are not taken for not found pages.
+    """
+    page = f"<html><head><title>{title}</title></head><body><h1>{title}</h1><p>{'Some text. ' * 50}</p></body></html>"
+    assert classify(page) == "product"
+
+def test_page_without_content_is_an_empty_shell():
+    """
+    Small pages with almost no text nor images are empty shells.
+    """
+    assert classify("<html><head><title>Shop</title></head><body><div id='app'></div></body></html>") == "empty_shell"
+
+def test_related_products_do_not_make_a_listing():
+    """
+    Regression: a product page describing its related products and variants as products is not a listing.
+    """
+    related = [{"@type": "Product", "name": f"Related {index}"} for index in range(4)]
+    variants = [{"@type": "Product", "name": f"Variant {index}"} for index in range(3)]
+    product = {"@context": "https://schema.org", "@type": "Product", "name": "Shoe", "isRelatedTo": related, "hasVariant": variants}
+    cards = "".join(f'<div itemscope itemtype="https://schema.org/Product"><span itemprop="name">Card {index}</span></div>' for index in range(6))
+    page = f"<html><head><title>Shoe</title>{json_ld(product)}</head><body><h1>Shoe</h1>{cards}<p>{'Some text. ' * 50}</p></body></html>"
+    assert classify(page) == "product"
+
+def test_item_list_is_a_listing():
+    """
+    A page marked up as a list of products is a listing.
+    """
+    items = {
+        "@context": "https://schema.org", "@type": "ItemList",
+        "itemListElement": [{"@type": "ListItem", "item": {"@type": "Product", "name": f"Shoe {index}"}} for index in range(5)],
+    }
+    page = f"<html><head><title>Shoes</title>{json_ld(items)}</head><body><h1>Shoes</h1><p>{'Some text. ' * 50}</p></body></html>"
+    assert classify(page) == "listing"